@@ -104,6 +104,8 @@ setupSystemdServices(){
     if [[ "$installation_type" == 'broadcaster' ]]; then
         sudo "$BASE_DIR/install/piwall2_queue_service.sh"
         sudo "$BASE_DIR/install/piwall2_server_service.sh"
+        sudo "$BASE_DIR/install/piwall2_ytdlp_resolver_service.sh"
+        sudo "$BASE_DIR/install/piwall2_broadcast_worker_service.sh"
     fi
     if [[ "$installation_type" == 'receiver' ]]; then
         sudo "$BASE_DIR/install/piwall2_receiver_service.sh"
@@ -123,9 +125,9 @@ setupSystemdServices(){
     fi
 
     if [[ "$installation_type" == 'broadcaster' ]]; then
-        sudo systemctl enable piwall2_queue.service piwall2_server.service
+        sudo systemctl enable piwall2_queue.service piwall2_server.service piwall2_ytdlp_resolver.service piwall2_broadcast_worker.service
         sudo systemctl daemon-reload
-        sudo systemctl restart piwall2_queue.service piwall2_server.service
+        sudo systemctl restart piwall2_queue.service piwall2_server.service piwall2_ytdlp_resolver.service piwall2_broadcast_worker.service
     fi
     if [[ "$installation_type" == 'receiver' ]]; then
         sudo systemctl enable piwall2_receiver.service
@@ -0,0 +1,17 @@
+#!/usr/bin/env bash
+# creates the broadcast worker service file
+BASE_DIR="$(dirname "$( cd "$( dirname "${BASH_SOURCE[0]}" )" >/dev/null 2>&1 && pwd )")"
+cat <<-EOF | sudo tee /etc/systemd/system/piwall2_broadcast_worker.service >/dev/null
+[Unit]
+Description=piwall2 broadcast worker
+After=network-online.target
+Wants=network-online.target
+
+[Service]
+Environment=HOME=/root
+ExecStart=$BASE_DIR/bin/broadcast_worker
+Restart=on-failure
+
+[Install]
+WantedBy=multi-user.target
+EOF
@@ -0,0 +1,17 @@
+#!/usr/bin/env bash
+# creates the yt-dlp resolver service file
+BASE_DIR="$(dirname "$( cd "$( dirname "${BASH_SOURCE[0]}" )" >/dev/null 2>&1 && pwd )")"
+cat <<-EOF | sudo tee /etc/systemd/system/piwall2_ytdlp_resolver.service >/dev/null
+[Unit]
+Description=piwall2 yt-dlp resolver
+After=network-online.target
+Wants=network-online.target
+
+[Service]
+Environment=HOME=/root
+ExecStart=$BASE_DIR/bin/ytdlp_resolver
+Restart=on-failure
+
+[Install]
+WantedBy=multi-user.target
+EOF
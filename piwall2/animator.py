@@ -1,9 +1,9 @@
 import math
 import time
 
+from piwall2.broadcaster.queuenotifier import QueueNotifier
 from piwall2.broadcaster.settingsdb import SettingsDb
 from piwall2.configloader import ConfigLoader
-from piwall2.controlmessagehelper import ControlMessageHelper
 from piwall2.displaymode import DisplayMode
 from piwall2.logger import Logger
 
@@ -44,7 +44,6 @@ class Animator:
         self.__animation_mode = None
         self.__settings_db = SettingsDb()
         self.__config_loader = ConfigLoader()
-        self.__control_message_helper = ControlMessageHelper().setup_for_broadcaster()
         self.__ticks = None
         self.__display_mode_helper = DisplayMode()
         self.__last_update_db_time = 0
@@ -65,6 +64,7 @@ class Animator:
             self.__display_mode_helper.set_display_mode(display_mode_by_tv_id)
 
         success = self.__settings_db.set(SettingsDb.SETTING_ANIMATION_MODE, animation_mode)
+        QueueNotifier.notify(QueueNotifier.EVENT_ANIMATION_MODE)
         return success
 
     # Pseudo-animation modes are never stored in the DB. Instead, a value of ANIMATION_MODE_NONE will be stored
@@ -97,9 +97,11 @@ class Animator:
 
         return self.ANIMATION_MODE_NONE
 
-    def tick(self):
+    # animation_mode: the current animation mode, as returned by `get_animation_mode(use_pseudo_animation_mode = False)`.
+    #   The queue caches the animation mode rather than reading it from the DB on every tick. See: QueueNotifier
+    def tick(self, animation_mode):
         old_animation_mode = self.__animation_mode
-        new_animation_mode = self.get_animation_mode(use_pseudo_animation_mode = False)
+        new_animation_mode = animation_mode
         self.__animation_mode = new_animation_mode
         if old_animation_mode != new_animation_mode:
             self.__ticks = 0
@@ -108,9 +110,9 @@ class Animator:
 
         display_mode_by_tv_id = None
         if self.__animation_mode == self.ANIMATION_MODE_NONE:
-            if not self.__should_update(2):
-                return
-            display_mode_by_tv_id = self.__get_current_display_modes()
+            # Nothing to animate. The queue's periodic wall state snapshot ensures eventual consistency of the
+            # DISPLAY_MODE. See: Queue.__send_wall_state_snapshot
+            return
         elif self.__animation_mode == self.ANIMATION_MODE_FULLSCREEN_TILE:
             if not self.__should_update(2):
                 return
@@ -136,19 +138,14 @@ class Animator:
         if not display_mode_by_tv_id:
             return
 
-        if self.__animation_mode == self.ANIMATION_MODE_NONE:
-            # send the DISPLAY_MODE control message even if we're using ANIMATION_MODE_NONE to ensure
-            # eventual consistency of the DISPLAY_MODE
-            self.__control_message_helper.send_msg(ControlMessageHelper.TYPE_DISPLAY_MODE, display_mode_by_tv_id)
-        else:
-            # Updating the DB can be slow -- occasionally it takes ~2 seconds because the SD cards
-            # can be slow randomly. So don't do it too often.
-            should_update_db = False
-            now = time.time()
-            if (now - self.__last_update_db_time) > self.__NUM_SECS_BTWN_DB_UPDATES:
-                should_update_db = True
-                self.__last_update_db_time = now
-            self.__display_mode_helper.set_display_mode(display_mode_by_tv_id, should_update_db)
+        # Updating the DB can be slow -- occasionally it takes ~2 seconds because the SD cards
+        # can be slow randomly. So don't do it too often.
+        should_update_db = False
+        now = time.time()
+        if (now - self.__last_update_db_time) > self.__NUM_SECS_BTWN_DB_UPDATES:
+            should_update_db = True
+            self.__last_update_db_time = now
+        self.__display_mode_helper.set_display_mode(display_mode_by_tv_id, should_update_db)
 
     # When update_every_N_seconds == 0, we update every tick.
     # Be less spamy updating state on receivers. Spamming them with the same state rapidly mqakes it more likely
@@ -161,12 +158,6 @@ class Animator:
             return False
         return True
 
-    def __get_current_display_modes(self):
-        display_mode_by_tv_id = {}
-        for tv_id, tv_settings in self.__settings_db.get_tv_settings().items():
-            display_mode_by_tv_id[tv_id] = tv_settings[SettingsDb.SETTING_DISPLAY_MODE]
-        return display_mode_by_tv_id
-
     def __get_display_modes_for_fullscreen_tile(self):
         # Change modes every N seconds
         num_ticks_before_changing = self.__ticks_per_second * 2
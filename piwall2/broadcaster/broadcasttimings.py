@@ -0,0 +1,133 @@
+import time
+import traceback
+
+import piwall2.broadcaster.database
+from piwall2.broadcaster.databasewriter import DatabaseWriter
+from piwall2.logger import Logger
+from piwall2.telemetryhelper import TelemetryHelper
+
+"""
+Records when each stage of a broadcast happened, keyed by the broadcast's log_uuid, so that we can tell where the
+time between dequeuing a video and the video playing on the wall goes. See: utils/broadcast_timings_report
+
+Stages are recorded by the process that performs them: the Queue, the VideoBroadcaster, and bin/msend_video, which
+all run on the broadcaster. Receivers report their stages via telemetry messages, which the queue process records.
+All timestamps are taken from the broadcaster's clock, because the receivers' clocks are not synchronized with it.
+Like PlaybackSampleCollector, we treat the time at which a receiver's message was received as the time of its stage.
+
+Recording a timing must never break a broadcast, so errors, e.g. `sqlite3.OperationalError: database is locked`,
+are logged and otherwise ignored.
+"""
+class BroadcastTimings:
+
+    # Stages, in the order they happen in a typical broadcast.
+    STAGE_DEQUEUE = 'dequeue'
+    STAGE_YT_DLP_RESOLVED = 'yt_dlp_resolved'
+    STAGE_FIRST_BYTE = 'first_byte'
+    STAGE_DIMENSIONS_KNOWN = 'dimensions_known'
+    STAGE_INIT_SENT = 'init_sent'
+    STAGE_RECEIVERS_READY = 'receivers_ready'
+    STAGE_FIRST_BYTE_SENT = 'first_byte_sent'
+    STAGE_LOADING_SCREEN_ENDED = 'loading_screen_ended'
+    STAGE_PLAY_SENT = 'play_sent'
+    STAGE_END_OF_STREAM = 'end_of_stream'
+
+    STAGES = [
+        STAGE_DEQUEUE,
+        STAGE_YT_DLP_RESOLVED,
+        STAGE_FIRST_BYTE,
+        STAGE_DIMENSIONS_KNOWN,
+        STAGE_INIT_SENT,
+        STAGE_RECEIVERS_READY,
+        STAGE_FIRST_BYTE_SENT,
+        STAGE_LOADING_SCREEN_ENDED,
+        STAGE_PLAY_SENT,
+        STAGE_END_OF_STREAM,
+    ]
+
+    def __init__(self):
+        # Get the cursor for each query rather than once, because this may be used from several threads, and each
+        # thread has its own cursor. See: Database.get_cursor
+        self.__database = piwall2.broadcaster.database.Database()
+        self.__logger = Logger().set_namespace(self.__class__.__name__)
+
+    def construct(self):
+        cursor = self.__database.get_cursor()
+        cursor.execute("DROP TABLE IF EXISTS broadcast_timings")
+        cursor.execute("""
+            CREATE TABLE broadcast_timings (
+                broadcast_timing_id INTEGER PRIMARY KEY,
+                log_uuid VARCHAR(100),
+                stage VARCHAR(50),
+                timestamp REAL,
+                receiver VARCHAR(200) DEFAULT '',
+                create_date DATETIME DEFAULT CURRENT_TIMESTAMP
+            )""")
+
+        cursor.execute("DROP INDEX IF EXISTS log_uuid_idx")
+        cursor.execute("CREATE INDEX log_uuid_idx ON broadcast_timings (log_uuid)")
+
+    # timestamp: the time at which the stage happened. Defaults to now.
+    # receiver: the receiver that reported the stage, if it was reported by a receiver.
+    #
+    # The timing is written in the background, so that recording it doesn't delay the broadcast. Writes that are still
+    # pending when the process exits are flushed. See: DatabaseWriter
+    def record(self, log_uuid, stage, timestamp = None, receiver = ''):
+        if not log_uuid:
+            return
+        if timestamp is None:
+            timestamp = time.time()
+        future = DatabaseWriter.submit(lambda cursor: cursor.execute(
+            "INSERT INTO broadcast_timings (log_uuid, stage, timestamp, receiver) VALUES(?, ?, ?, ?)",
+            [log_uuid, stage, timestamp, receiver]
+        ).rowcount)
+        future.add_done_callback(lambda future: self.__log_record_failure(future, stage))
+
+    def __log_record_failure(self, future, stage):
+        exception = future.exception()
+        if exception is not None:
+            self.__logger.warning(f"Unable to record broadcast timing for stage {stage}: " +
+                "".join(traceback.format_exception(type(exception), exception, exception.__traceback__)))
+
+    # Registers a handler with the listener to record the stages that the receivers report.
+    def listen(self, telemetry_listener):
+        telemetry_listener.add_handler(TelemetryHelper.TYPE_BROADCAST_TIMING, self.__handle_broadcast_timing)
+        return self
+
+    """
+    Returns the stage timestamps of the most recent broadcasts, as a list of dicts, most recent first:
+        {
+            'log_uuid': ...,
+            'timestamps': {stage => timestamp, ...},
+        }
+
+    Only broadcasts with a recorded dequeue stage are included. If a stage was recorded more than once, e.g. by each
+    receiver, the latest timestamp is used: a stage is only done once every receiver is done with it.
+    """
+    def get_recent_broadcasts(self, num_broadcasts, include_screensavers = False):
+        cursor = self.__database.get_cursor()
+        screensaver_clause = ''
+        if not include_screensavers:
+            screensaver_clause = "AND log_uuid NOT LIKE 'SCREENSAVER\\_\\_%' ESCAPE '\\'"
+        cursor.execute(
+            (f"SELECT log_uuid FROM broadcast_timings WHERE stage = ? {screensaver_clause} " +
+                "ORDER BY timestamp DESC LIMIT ?"),
+            [self.STAGE_DEQUEUE, num_broadcasts]
+        )
+        log_uuids = [row['log_uuid'] for row in cursor.fetchall()]
+        if not log_uuids:
+            return []
+
+        placeholders = ','.join(['?'] * len(log_uuids))
+        cursor.execute(
+            ("SELECT log_uuid, stage, MAX(timestamp) AS timestamp FROM broadcast_timings " +
+                f"WHERE log_uuid IN ({placeholders}) GROUP BY log_uuid, stage"),
+            log_uuids
+        )
+        timestamps_by_log_uuid = {log_uuid: {} for log_uuid in log_uuids}
+        for row in cursor.fetchall():
+            timestamps_by_log_uuid[row['log_uuid']][row['stage']] = row['timestamp']
+        return [{'log_uuid': log_uuid, 'timestamps': timestamps_by_log_uuid[log_uuid]} for log_uuid in log_uuids]
+
+    def __handle_broadcast_timing(self, msg, receive_time):
+        self.record(msg['log_uuid'], msg['stage'], receive_time, msg['receiver'])
@@ -0,0 +1,206 @@
+import json
+import os
+import select
+import signal
+import socket
+import time
+import traceback
+
+from piwall2.broadcaster.databasewriter import DatabaseWriter
+from piwall2.broadcaster.videobroadcaster import VideoBroadcaster
+from piwall2.configloader import ConfigLoader
+from piwall2.logger import Logger
+
+"""
+A long-lived service that runs broadcasts on behalf of the queue. See: bin/broadcast_worker
+
+The queue used to start each broadcast by running bin/broadcast, which paid for python startup, importing piwall2's
+modules, parsing the config, and adding the multicast route on every video and screensaver. The worker does all of
+that once at startup. Each broadcast then runs in a child process that the worker forks, so that it inherits the
+worker's already initialized state. Running broadcasts in their own process preserves bin/broadcast's semantics:
+stopping a broadcast sends SIGTERM to the child, whose signal handler kills the broadcast's process groups. See:
+VideoBroadcaster.__do_housekeeping
+
+Protocol: clients connect to the unix socket at SOCKET_PATH and send a single line of JSON:
+    {"method": "start", "params": {"url": "...", "log_uuid": "...", "show_loading_screen": false,
+        "yt_dlp_extractors": "youtube", "stream_id": 123, "switch_time": null, "is_handoff_enabled": true}}
+    {"method": "stop"}
+    {"method": "status"}
+    {"method": "wait"}
+
+The response is a single line of JSON. On success, {"result": ...}, where the result is:
+    start: {"pid": 123}
+    stop: {"exit_status": 0}. The exit status is null if no broadcast was running.
+    status: {"is_running": true, "exit_status": null}. The exit status is that of the most recent broadcast, once
+        it has exited.
+    wait: {"exit_status": 0}. The response is sent once the current broadcast has exited, so clients can be
+        notified that the broadcast is over without polling. If no broadcast is running, it is sent immediately.
+
+On failure:
+    {"error": "..."}
+
+Requests are handled one at a time, in the order they are received. The worker waits for requests and for the
+broadcast to exit at the same time, via a pidfd for the broadcast's child process.
+"""
+class BroadcastWorker:
+
+    SOCKET_PATH = '/tmp/piwall2_broadcast_worker.sock'
+
+    def __init__(self):
+        self.__logger = Logger().set_namespace(self.__class__.__name__)
+        ConfigLoader()
+        VideoBroadcaster.add_multicast_route_if_not_added()
+        self.__broadcast_pid = None
+        self.__broadcast_pidfd = None
+        self.__exit_status = None
+        self.__server_socket = None
+
+        # Connections that are waiting for the current broadcast to exit. See: the `wait` method
+        self.__waiting_conns = []
+
+    def serve(self):
+        try:
+            os.remove(self.SOCKET_PATH)
+        except FileNotFoundError:
+            pass
+
+        self.__server_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.__server_socket.bind(self.SOCKET_PATH)
+        self.__server_socket.listen()
+        self.__logger.info(f"Listening on {self.SOCKET_PATH} ...")
+        while True:
+            fds = [self.__server_socket]
+            if self.__broadcast_pidfd is not None:
+                fds.append(self.__broadcast_pidfd)
+            readable_fds, _, _ = select.select(fds, [], [])
+
+            if self.__broadcast_pidfd is not None and self.__broadcast_pidfd in readable_fds:
+                self.__is_running() # Reaps the broadcast, which notifies the waiting connections.
+            if self.__server_socket in readable_fds:
+                conn, addr = self.__server_socket.accept()
+                is_waiting = False
+                try:
+                    is_waiting = self.__handle_connection(conn)
+                except Exception:
+                    self.__logger.error('Caught exception: {}'.format(traceback.format_exc()))
+                finally:
+                    if not is_waiting:
+                        conn.close()
+
+    # Returns whether the connection is waiting for the broadcast to exit, in which case it must be kept open.
+    def __handle_connection(self, conn):
+        try:
+            request = json.loads(conn.makefile('rb').readline())
+            method = request['method']
+            if method == 'start':
+                result = self.__start(conn, request['params'])
+            elif method == 'stop':
+                result = self.__stop()
+            elif method == 'status':
+                result = self.__status()
+            elif method == 'wait':
+                if self.__is_running():
+                    self.__waiting_conns.append(conn)
+                    return True
+                result = {'exit_status': self.__exit_status}
+            else:
+                raise Exception(f"Unknown method: {method}.")
+            response = {'result': result}
+        except Exception as e:
+            self.__logger.error('Caught exception: {}'.format(traceback.format_exc()))
+            response = {'error': str(e)}
+        self.__send_response(conn, response)
+        return False
+
+    def __send_response(self, conn, response):
+        conn.sendall((json.dumps(response) + "\n").encode())
+
+    def __start(self, conn, params):
+        if self.__is_running():
+            # E.g. the queue was restarted while a broadcast was in progress.
+            self.__logger.warning(f"Stopping broadcast (PID: {self.__broadcast_pid}) before starting a new one...")
+            self.__stop()
+
+        start_time = time.time()
+        pid = os.fork()
+        if pid == 0:
+            self.__run_broadcast_in_child(conn, params)
+
+        self.__broadcast_pid = pid
+        self.__broadcast_pidfd = os.pidfd_open(pid)
+        self.__exit_status = None
+        self.__logger.info(f"Started broadcast of {params['url']} (PID: {pid}) in " +
+            f"{round(time.time() - start_time, 3)}s.")
+        return {'pid': pid}
+
+    def __stop(self):
+        if not self.__is_running():
+            return {'exit_status': self.__exit_status}
+
+        start_time = time.time()
+        self.__logger.info(f"Stopping broadcast (PID: {self.__broadcast_pid})...")
+        try:
+            os.kill(self.__broadcast_pid, signal.SIGTERM)
+        except Exception:
+            # might raise: `ProcessLookupError: [Errno 3] No such process`
+            pass
+        self.__wait(0)
+        self.__logger.info(f"Stopped broadcast in {round(time.time() - start_time, 3)}s. Exit status: " +
+            f"{self.__exit_status}.")
+        return {'exit_status': self.__exit_status}
+
+    def __status(self):
+        return {'is_running': self.__is_running(), 'exit_status': self.__exit_status}
+
+    def __is_running(self):
+        if self.__broadcast_pid is None:
+            return False
+        return not self.__wait(os.WNOHANG)
+
+    # Reaps the broadcast child process if it has exited. Returns whether it was reaped.
+    def __wait(self, options):
+        pid, wait_status = os.waitpid(self.__broadcast_pid, options)
+        if pid == 0:
+            return False
+        self.__exit_status = os.waitstatus_to_exitcode(wait_status)
+        self.__broadcast_pid = None
+        os.close(self.__broadcast_pidfd)
+        self.__broadcast_pidfd = None
+
+        for conn in self.__waiting_conns:
+            try:
+                self.__send_response(conn, {'result': {'exit_status': self.__exit_status}})
+            except Exception:
+                # The client may have stopped waiting, e.g. if the queue was restarted.
+                pass
+            finally:
+                conn.close()
+        self.__waiting_conns = []
+        return True
+
+    # Runs in the forked child process. Never returns.
+    def __run_broadcast_in_child(self, conn, params):
+        exit_status = 1
+        try:
+            conn.close()
+            self.__server_socket.close()
+            for waiting_conn in self.__waiting_conns:
+                waiting_conn.close()
+            VideoBroadcaster(
+                params['url'], params.get('log_uuid'), params.get('show_loading_screen', False),
+                params.get('yt_dlp_extractors'), params.get('stream_id'), params.get('switch_time'),
+                params.get('is_handoff_enabled', False)
+            ).broadcast()
+            exit_status = 0
+        except SystemExit as e:
+            # VideoBroadcaster's signal handler exits with the signal number.
+            exit_status = e.code if isinstance(e.code, int) else 1
+        except Exception:
+            self.__logger.error('Caught exception: {}'.format(traceback.format_exc()))
+        finally:
+            # os._exit skips the atexit handlers, so commit the broadcast's submitted writes, e.g. its
+            # BroadcastTimings, before exiting.
+            DatabaseWriter.flush(DatabaseWriter.FLUSH_TIMEOUT_S)
+
+            # Skip the parent's cleanup handlers: the child shares the parent's sockets and open files.
+            os._exit(exit_status)
@@ -0,0 +1,157 @@
+import json
+import select
+import socket
+import time
+
+from piwall2.broadcaster.broadcastworker import BroadcastWorker
+from piwall2.config import Config
+from piwall2.logger import Logger
+
+"""
+Client for the broadcast worker service. See: BroadcastWorker
+
+Once a broadcast has been started, instances of this class provide the subset of subprocess.Popen's interface that
+the queue uses to manage a bin/broadcast process: `poll`, `terminate`, and `wait`. Thus the queue can manage a
+broadcast in the same way, whether it was started via the worker or by running bin/broadcast.
+
+Once the broadcast has started, the client keeps a connection open to the worker, on which the worker sends the
+broadcast's exit status once it exits (see: the worker's `wait` method). Thus `poll` only checks whether that
+connection is readable, rather than making a request to the worker.
+"""
+class BroadcastWorkerClient:
+
+    __TIMEOUT_S = 10
+
+    # Stopping a broadcast waits for the broadcast to clean up after itself.
+    __STOP_TIMEOUT_S = 30
+
+    def __init__(self):
+        self.__logger = Logger().set_namespace(self.__class__.__name__)
+        self.__is_enabled = Config.get('use_broadcast_worker', True)
+        self.__wait_socket = None
+        self.returncode = None
+
+    # Returns whether the broadcast was started. If not, the caller should fall back to running bin/broadcast.
+    # See: VideoBroadcaster.__init__ for the parameters.
+    def start(
+        self, url, log_uuid, show_loading_screen = False, yt_dlp_extractors = None, stream_id = None,
+        switch_time = None, is_handoff_enabled = False
+    ):
+        if not self.__is_enabled:
+            return False
+
+        start_time = time.time()
+        try:
+            result = self.__call('start', {
+                'url': url,
+                'log_uuid': log_uuid,
+                'show_loading_screen': show_loading_screen,
+                'yt_dlp_extractors': yt_dlp_extractors,
+                'stream_id': stream_id,
+                'switch_time': switch_time,
+                'is_handoff_enabled': is_handoff_enabled,
+            })
+        except Exception as e:
+            self.__logger.warning("Unable to start broadcast via the broadcast worker, falling back to " +
+                f"bin/broadcast: {e}")
+            return False
+
+        try:
+            self.__wait_socket = self.__connect()
+            self.__send_request(self.__wait_socket, 'wait')
+        except Exception as e:
+            # Without the wait connection, we wouldn't know when the broadcast is over. Stop it, so that the caller
+            # can fall back to bin/broadcast.
+            self.__logger.warning("Unable to wait for broadcast via the broadcast worker, falling back to " +
+                f"bin/broadcast: {e}")
+            self.__wait_socket = None
+            self.terminate()
+            return False
+
+        self.__logger.info(f"Started broadcast via the broadcast worker (PID: {result['pid']}) in " +
+            f"{round(time.time() - start_time, 3)}s.")
+        return True
+
+    # Returns the broadcast's exit status if it has exited, otherwise None.
+    def poll(self):
+        if self.returncode is not None:
+            return self.returncode
+
+        readable_sockets, _, _ = select.select([self.__wait_socket], [], [], 0)
+        if readable_sockets:
+            self.__read_exit_status()
+        return self.returncode
+
+    # Allows passing the client to `select`: it becomes readable once the broadcast has exited. Only valid until the
+    # broadcast's exit status has been read, i.e. while `poll` returns None.
+    def fileno(self):
+        return self.__wait_socket.fileno()
+
+    def terminate(self):
+        if self.returncode is not None:
+            return
+
+        start_time = time.time()
+        sock = self.__connect(self.__STOP_TIMEOUT_S)
+        try:
+            self.__send_request(sock, 'stop')
+            result = self.__read_response(sock, 'stop')
+        finally:
+            sock.close()
+        self.__set_returncode(result['exit_status'])
+        self.__logger.info(f"Stopped broadcast via the broadcast worker in {round(time.time() - start_time, 3)}s.")
+
+    def wait(self):
+        if self.returncode is None:
+            self.__wait_socket.settimeout(None)
+            self.__read_exit_status()
+        return self.returncode
+
+    def __read_exit_status(self):
+        try:
+            result = self.__read_response(self.__wait_socket, 'wait')
+            exit_status = result['exit_status']
+        except Exception as e:
+            # If the worker is no longer running, neither is the broadcast it forked.
+            self.__logger.error(f"Unable to get the broadcast's exit status from the broadcast worker: {e}")
+            exit_status = 1
+        self.__set_returncode(exit_status)
+
+    def __set_returncode(self, returncode):
+        self.returncode = returncode
+        if self.__wait_socket is not None:
+            self.__wait_socket.close()
+            self.__wait_socket = None
+
+    def __call(self, method, params = None):
+        sock = self.__connect()
+        try:
+            self.__send_request(sock, method, params)
+            return self.__read_response(sock, method)
+        finally:
+            sock.close()
+
+    def __connect(self, timeout_s = None):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout_s or self.__TIMEOUT_S)
+        try:
+            sock.connect(BroadcastWorker.SOCKET_PATH)
+        except Exception as e:
+            sock.close()
+            raise e
+        return sock
+
+    def __send_request(self, sock, method, params = None):
+        request = {'method': method}
+        if params is not None:
+            request['params'] = params
+        sock.sendall((json.dumps(request) + "\n").encode())
+
+    def __read_response(self, sock, method):
+        line = sock.makefile('rb').readline()
+        if not line:
+            raise Exception(f"The broadcast worker closed the connection for method '{method}'.")
+        response = json.loads(line)
+        if 'error' in response:
+            raise Exception(f"The broadcast worker returned an error for method '{method}': {response['error']}")
+        return response['result']
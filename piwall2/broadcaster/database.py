@@ -1,9 +1,11 @@
 import sqlite3
 import threading
 import time
+import traceback
 
 from piwall2.directoryutils import DirectoryUtils
 from piwall2.logger import Logger
+import piwall2.broadcaster.broadcasttimings
 import piwall2.broadcaster.playlist
 import piwall2.broadcaster.settingsdb
 
@@ -21,7 +23,15 @@ class Database:
     __DB_PATH = DirectoryUtils().root_dir + '/piwall2.db'
 
     # Zero indexed schema_version (first version is v0).
-    __SCHEMA_VERSION = 3
+    __SCHEMA_VERSION = 6
+
+    # Wait this long for another connection's lock before raising `sqlite3.OperationalError: database is locked`.
+    __BUSY_TIMEOUT_MS = 5000
+
+    __MMAP_SIZE_BYTES = 1024 * 1024 * 64
+
+    # See: Database.start_periodic_checkpoints
+    __CHECKPOINT_INTERVAL_S = 60
 
     def __init__(self):
         self.__logger = Logger().set_namespace(self.__class__.__name__)
@@ -45,9 +55,11 @@ class Database:
         if current_schema_version == -1:
             # construct from scratch
             self.__logger.info("Constructing database schema from scratch...")
+            self.__enable_wal_journal_mode()
             self.__construct_schema_version()
             piwall2.broadcaster.playlist.Playlist().construct()
             piwall2.broadcaster.settingsdb.SettingsDb().construct()
+            piwall2.broadcaster.broadcasttimings.BroadcastTimings().construct()
         elif current_schema_version < self.__SCHEMA_VERSION:
             self.__logger.info(
                 f"Database schema is outdated. Updating from version {current_schema_version} to " +
@@ -64,6 +76,12 @@ class Database:
                     self.__update_schema_to_v2()
                 elif i == 3:
                     self.__update_schema_to_v3()
+                elif i == 4:
+                    self.__update_schema_to_v4()
+                elif i == 5:
+                    self.__update_schema_to_v5()
+                elif i == 6:
+                    self.__update_schema_to_v6()
                 else:
                     msg = "No update schema method defined for version: {}.".format(i)
                     self.__logger.error(msg)
@@ -89,9 +107,63 @@ class Database:
             conn = sqlite3.connect(self.__DB_PATH, isolation_level = None)
             conn.row_factory = dict_factory
             cursor = conn.cursor()
+            self.__configure_connection(cursor)
             thread_local.database_cursor = cursor
         return cursor
 
+    # Points the DB classes at another database file, e.g. a scratch database for benchmarking. Must be called before
+    # the first cursor is opened. See: utils/benchmark_db
+    @staticmethod
+    def set_db_path(db_path):
+        Database.__DB_PATH = db_path
+
+    """
+    SQLite's automatic checkpoint runs as part of whichever commit grows the WAL past 1000 pages, so an unlucky write,
+    e.g. a server request, would pay for syncing the WAL to the DB file. Checkpoint periodically from a daemon thread
+    instead, so that the automatic checkpoint rarely runs. A passive checkpoint doesn't wait for readers or writers.
+    """
+    def start_periodic_checkpoints(self):
+        thread = threading.Thread(target = self.__checkpoint_periodically, daemon = True)
+        thread.start()
+        return self
+
+    def __checkpoint_periodically(self):
+        while True:
+            time.sleep(self.__CHECKPOINT_INTERVAL_S)
+            try:
+                start_time = time.time()
+                cursor = self.get_cursor()
+                cursor.execute("PRAGMA wal_checkpoint(PASSIVE)")
+                result = cursor.fetchone()
+                self.__logger.debug(f"Checkpointed {result['checkpointed']} of {result['log']} WAL pages in " +
+                    f"{round(time.time() - start_time, 3)}s.")
+            except Exception:
+                self.__logger.warning(f"Unable to checkpoint the WAL: {traceback.format_exc()}")
+
+    """
+    Applied to every connection. The DB is in WAL journal mode, so readers and the writer don't block each other.
+    See: __update_schema_to_v5
+
+    synchronous = NORMAL: commits don't wait for an fsync, which could take seconds on the SD card. The WAL is synced
+        at each checkpoint instead. A commit may be lost if power is lost, but the DB can't be corrupted.
+    busy_timeout: wait for the writer's lock rather than immediately raising `database is locked`.
+    mmap_size: read the DB via memory mapped I/O rather than read syscalls.
+    """
+    def __configure_connection(self, cursor):
+        cursor.execute("PRAGMA synchronous = NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout = {self.__BUSY_TIMEOUT_MS}")
+        cursor.execute(f"PRAGMA mmap_size = {self.__MMAP_SIZE_BYTES}")
+
+    # The journal mode is stored in the DB file, so it only needs to be set once. It can't be changed in the middle of
+    # a transaction, so commit the schema changes so far, and continue in a new transaction.
+    def __enable_wal_journal_mode(self):
+        self.get_cursor().execute("COMMIT")
+        self.get_cursor().execute("PRAGMA journal_mode = WAL")
+        journal_mode = self.get_cursor().fetchone()['journal_mode']
+        if journal_mode != 'wal':
+            raise Exception(f"Unable to enable WAL journal mode. Journal mode is: {journal_mode}.")
+        self.get_cursor().execute("BEGIN TRANSACTION")
+
     def __construct_schema_version(self):
         self.get_cursor().execute("DROP TABLE IF EXISTS schema_version")
         self.get_cursor().execute("CREATE TABLE schema_version (version INTEGER)")
@@ -116,3 +188,23 @@ class Database:
         self.get_cursor().execute("CREATE INDEX status_type_priority_idx ON playlist_videos (status, type, priority)")
         self.get_cursor().execute("DROP INDEX IF EXISTS status_priority_idx")
         self.get_cursor().execute("CREATE INDEX status_priority_idx ON playlist_videos (status, priority DESC, playlist_video_id ASC)")
+
+    # Add new table for storing the timings of each broadcast's stages
+    def __update_schema_to_v4(self):
+        piwall2.broadcaster.broadcasttimings.BroadcastTimings().construct()
+
+    # Switch to WAL journaling, so that the queue's reads don't block the server's writes and vice versa.
+    def __update_schema_to_v5(self):
+        self.__enable_wal_journal_mode()
+
+    # Add a table that finished playlist items are archived to, and replace the playlist_videos indexes with a
+    # partial index that only covers queued and playing items. See: Playlist.archive_finished_videos
+    def __update_schema_to_v6(self):
+        piwall2.broadcaster.playlist.Playlist().construct_history()
+        self.get_cursor().execute("DROP INDEX IF EXISTS status_type_priority_idx")
+        self.get_cursor().execute("DROP INDEX IF EXISTS status_priority_idx")
+        self.get_cursor().execute("DROP INDEX IF EXISTS queue_idx")
+        self.get_cursor().execute(
+            "CREATE INDEX queue_idx ON playlist_videos (status, priority DESC, playlist_video_id ASC) " +
+            f"WHERE {piwall2.broadcaster.playlist.Playlist.QUEUE_INDEX_WHERE_CLAUSE}"
+        )
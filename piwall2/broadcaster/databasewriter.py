@@ -0,0 +1,130 @@
+import atexit
+import concurrent.futures
+import os
+import queue
+import threading
+import traceback
+
+import piwall2.broadcaster.database
+from piwall2.logger import Logger
+
+"""
+Serializes each process's writes to the DB through a single writer thread. Concurrent writes, e.g. from the server's
+request handler threads, are grouped into one transaction, so they share one commit, rather than each paying for its
+own commit on the SD card.
+
+The writer doesn't wait for more writes before starting a batch, so a lone write is not delayed. Instead, the writes
+that arrive while a batch is being committed, which takes a few milliseconds on the SD card, form the next batch.
+
+A write is a function that takes a cursor and returns a result, e.g.:
+
+    DatabaseWriter.write(lambda cursor: cursor.execute("UPDATE ...", params).rowcount)
+
+Each write runs in its own savepoint within the batch's transaction, so a write that raises an exception is rolled
+back without affecting the other writes in the batch. Its exception is re-raised to the caller.
+
+`write` blocks until the batch containing the write is committed, so a caller that reads the DB after a write sees
+the write, e.g. an API response that returns the queue after enqueuing a video. `submit` doesn't block: it returns a
+future for the write's result.
+
+Reads and schema changes don't go through the writer. See: Database.construct
+"""
+class DatabaseWriter:
+
+    __MAX_BATCH_SIZE = 100
+
+    # At exit, wait up to this long for writes that were submitted but not yet committed. See: DatabaseWriter.flush
+    FLUSH_TIMEOUT_S = 5
+
+    __logger = Logger().set_namespace('DatabaseWriter')
+    __lock = threading.Lock()
+
+    # The writer thread and its queue of (future, write) tuples. The thread is started on the first write in each
+    # process. Threads don't survive a fork, so a forked process starts its own writer.
+    __requests = None
+    __pid = None
+
+    # Returns the result of `write(cursor)` once it has been committed, or raises its exception.
+    @staticmethod
+    def write(write):
+        return DatabaseWriter.submit(write).result()
+
+    # Returns a concurrent.futures.Future for the result of `write(cursor)`.
+    @staticmethod
+    def submit(write):
+        future = concurrent.futures.Future()
+        DatabaseWriter.__get_requests().put((future, write))
+        return future
+
+    # Blocks until the writes that were submitted before this call have been committed.
+    @staticmethod
+    def flush(timeout = None):
+        with DatabaseWriter.__lock:
+            if DatabaseWriter.__pid != os.getpid():
+                return
+        try:
+            DatabaseWriter.submit(lambda cursor: None).result(timeout = timeout)
+        except Exception:
+            DatabaseWriter.__logger.warning(f"Unable to flush writes: {traceback.format_exc()}")
+
+    @staticmethod
+    def __flush_at_exit():
+        DatabaseWriter.flush(DatabaseWriter.FLUSH_TIMEOUT_S)
+
+    @staticmethod
+    def __get_requests():
+        with DatabaseWriter.__lock:
+            if DatabaseWriter.__pid != os.getpid():
+                DatabaseWriter.__requests = queue.Queue()
+                DatabaseWriter.__pid = os.getpid()
+                thread = threading.Thread(
+                    target = DatabaseWriter.__run, args = (DatabaseWriter.__requests,), daemon = True
+                )
+                thread.start()
+                atexit.register(DatabaseWriter.__flush_at_exit)
+            return DatabaseWriter.__requests
+
+    @staticmethod
+    def __run(requests):
+        # The writer thread's own connection. See: Database.get_cursor
+        cursor = piwall2.broadcaster.database.Database().get_cursor()
+        while True:
+            batch = [requests.get()]
+            while len(batch) < DatabaseWriter.__MAX_BATCH_SIZE:
+                try:
+                    batch.append(requests.get_nowait())
+                except queue.Empty:
+                    break
+            DatabaseWriter.__write_batch(cursor, batch)
+
+    @staticmethod
+    def __write_batch(cursor, batch):
+        outcomes = []
+        try:
+            cursor.execute("BEGIN IMMEDIATE TRANSACTION")
+            for future, write in batch:
+                cursor.execute("SAVEPOINT write")
+                try:
+                    outcomes.append((future, write(cursor), None))
+                except Exception as e:
+                    cursor.execute("ROLLBACK TO SAVEPOINT write")
+                    outcomes.append((future, None, e))
+                cursor.execute("RELEASE SAVEPOINT write")
+            cursor.execute("COMMIT")
+        except Exception as e:
+            DatabaseWriter.__logger.warning(f"Unable to commit a batch of {len(batch)} writes: " +
+                f"{traceback.format_exc()}")
+            try:
+                cursor.execute("ROLLBACK")
+            except Exception:
+                # might raise: `sqlite3.OperationalError: cannot rollback - no transaction is active`
+                pass
+            for future, write in batch:
+                future.set_exception(e)
+            return
+
+        for future, result, exception in outcomes:
+            if exception is None:
+                future.set_result(result)
+            else:
+                future.set_exception(exception)
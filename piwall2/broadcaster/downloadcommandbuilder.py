@@ -0,0 +1,153 @@
+import shlex
+import sys
+
+from piwall2.broadcaster.ytdlpresolverclient import YtDlpResolverClient
+from piwall2.config import Config
+from piwall2.configloader import ConfigLoader
+from piwall2.directoryutils import DirectoryUtils
+from piwall2.logger import Logger
+
+# Helper to build the command that downloads a video via youtube-dl and converts / muxes it to the format that we
+# broadcast. This is used both when broadcasting a video (see: VideoBroadcaster) and when prefetching the next video
+# in the playlist queue (see: Prefetcher).
+class DownloadCommandBuilder:
+
+    # bestaudio: try to select the best audio-only format
+    # bestaudio*: this is the fallback option -- select the best quality format that contains audio.
+    #   It may also contain video, e.g. in the case that there are no audio-only formats available.
+    #   Some videos (live videos) only have combined video + audio formats. Thus 'bestaudio' would
+    #   fail for them.
+    AUDIO_FORMAT = 'bestaudio/bestaudio*'
+
+    # video_tmp_dir, audio_tmp_dir: youtube-dl is run from within these directories. Workaround for
+    #   https://github.com/yt-dlp/yt-dlp/issues/6447 . Concurrent downloads must use distinct directories.
+    #
+    # yt_dlp_extractors: string. Extractor names for yt-dlp to use, separated by commas.
+    #   See: VideoBroadcaster.__init__
+    def __init__(self, video_url, video_tmp_dir, audio_tmp_dir, yt_dlp_extractors = None):
+        self.__config_loader = ConfigLoader()
+        self.__video_url = video_url
+        self.__video_tmp_dir = video_tmp_dir
+        self.__audio_tmp_dir = audio_tmp_dir
+        self.__yt_dlp_extractors = yt_dlp_extractors
+        self.__were_formats_resolved = False
+
+    # Returns a command that downloads the video and writes it to stdout as MPEG-TS.
+    def build_download_and_convert_cmd(self, ytdl_video_format = None):
+        # Mix the best audio with the video and send via multicast
+        # See: https://github.com/dasl-/piwall2/blob/main/docs/best_video_container_format_for_streaming.adoc
+        # See: https://github.com/dasl-/piwall2/blob/main/docs/streaming_high_quality_videos_from_youtube-dl_to_stdout.adoc
+        ffmpeg_input_clause = self.__get_ffmpeg_input_clause(ytdl_video_format)
+
+        # `-c:a mp2`: mp2 is believed to result in better quality audio at high bit rates: https://wiki.audacityteam.org/wiki/MP2
+        #
+        # `-map 0:v:0 -map 1:a:0 -shortest`: Mux video from the first input with audio from the second input:
+        # https://stackoverflow.com/a/12943003/627663 We need to specify, because in some cases (live videos), either input
+        # could contain both audio and video. But in most cases, the first input will have only video, and the second input
+        # will have only audio.
+        return (f"set -o pipefail && export SHELLOPTS && {self.get_standard_ffmpeg_cmd()} {ffmpeg_input_clause} " +
+            "-c:v copy -c:a mp2 -b:a 256k -map 0:v:0 -map 1:a:0 -shortest -f mpegts -")
+
+    # Whether the command that was built downloads media URLs that were resolved by the yt-dlp resolver service,
+    # rather than running yt-dlp itself.
+    def were_formats_resolved(self):
+        return self.__were_formats_resolved
+
+    @staticmethod
+    def get_standard_ffmpeg_cmd():
+        # unfortunately there's no way to make ffmpeg output its stats progress stuff with line breaks
+        log_opts = '-nostats '
+        if sys.stderr.isatty():
+            log_opts = '-stats '
+
+        if Logger.get_level() <= Logger.DEBUG:
+            pass # don't change anything, ffmpeg is pretty verbose by default
+        else:
+            log_opts += '-loglevel error'
+
+        # Note: don't use ffmpeg's `-xerror` flag:
+        # https://gist.github.com/dasl-/1ad012f55f33f14b44393960f66c6b00
+        return f"ffmpeg -hide_banner {log_opts} "
+
+    def __get_ffmpeg_input_clause(self, ytdl_video_format):
+        """
+        Pipe to mbuffer to avoid video drop outs when youtube-dl temporarily loses its connection
+        and is trying to reconnect:
+
+            [download] Got server HTTP error: [Errno 104] Connection reset by peer. Retrying (attempt 1 of 10)...
+            [download] Got server HTTP error: [Errno 104] Connection reset by peer. Retrying (attempt 2 of 10)...
+            [download] Got server HTTP error: [Errno 104] Connection reset by peer. Retrying (attempt 3 of 10)...
+
+        This can happen from time to time when downloading long videos.
+        Youtube-dl should download quickly until it fills the mbuffer. After the mbuffer is filled,
+        ffmpeg will apply backpressure to youtube-dl because of ffmpeg's `-re` flag
+
+        --retries infinite: using this to avoid scenarios where all of the retries (10 by default) were
+        exhausted on long video downloads. After a while, retries would be necessary to reconnect. The
+        retries would be successful, but the connection errors would happen again a few minutes later.
+        This allows us to keep retrying whenever it is necessary.
+
+        If the yt-dlp resolver service is running, we use it to resolve the video's direct media URLs, and download
+        them via bin/ranged_download. This avoids paying for yt-dlp's startup and extraction twice per video. See:
+        YtDlpResolver. The ranged downloader fetches each URL over several connections, and retries a failed range on
+        its own rather than reconnecting the whole stream. See: RangedDownloader. If the ranged downloader is
+        disabled, we download the resolved URLs via curl. If the resolver service isn't running, we fall back to
+        running yt-dlp.
+
+        Use yt-dlp, a fork of youtube-dl that has a workaround (for now) for an issue where youtube has been
+        throttling youtube-dl’s download speed:
+        https://github.com/ytdl-org/youtube-dl/issues/29326#issuecomment-879256177
+        """
+        if not ytdl_video_format:
+            ytdl_video_format = self.__config_loader.get_youtube_dl_video_format()
+
+        # 50 MB. Based on one video, 1080p avc1 video consumes about 0.36 MB/s. So this should
+        # be enough buffer for ~139s
+        video_buffer_size = 1024 * 1024 * 50
+
+        # Also use a 50MB buffer, because in some cases (live videos), the audio stream we download may also contain video.
+        audio_buffer_size = 1024 * 1024 * 50
+
+        resolved_formats = YtDlpResolverClient().resolve(
+            self.__video_url, {'video': ytdl_video_format, 'audio': self.AUDIO_FORMAT}
+        )
+        if resolved_formats:
+            self.__were_formats_resolved = True
+            video_download_cmd = self.__get_resolved_format_download_cmd(resolved_formats['video'], video_buffer_size)
+            audio_download_cmd = self.__get_resolved_format_download_cmd(resolved_formats['audio'], audio_buffer_size)
+        else:
+            video_download_cmd = self.__get_youtube_dl_cmd(self.__video_tmp_dir, ytdl_video_format, video_buffer_size)
+            audio_download_cmd = self.__get_youtube_dl_cmd(self.__audio_tmp_dir, self.AUDIO_FORMAT, audio_buffer_size)
+
+        return f"-i <({video_download_cmd}) -i <({audio_download_cmd})"
+
+    def __get_youtube_dl_cmd(self, tmp_dir, ytdl_format, buffer_size):
+        log_opts = '--no-progress'
+        if Logger.get_level() <= Logger.DEBUG:
+            log_opts = '' # show video download progress
+        if not sys.stderr.isatty():
+            log_opts += ' --newline'
+
+        use_extractors = ''
+        if self.__yt_dlp_extractors is not None:
+            use_extractors = f'--use-extractors {shlex.quote(self.__yt_dlp_extractors)}'
+
+        return (f"mkdir -p {shlex.quote(tmp_dir)} && cd {shlex.quote(tmp_dir)} && yt-dlp {shlex.quote(self.__video_url)} " +
+            f"--retries infinite --format {shlex.quote(ytdl_format)} --output - {log_opts} {use_extractors} | " +
+            f"mbuffer -q -Q -m {buffer_size}b")
+
+    # resolved_format: a format returned by YtDlpResolverClient.resolve
+    def __get_resolved_format_download_cmd(self, resolved_format, buffer_size):
+        headers = ''
+        for name, value in resolved_format['http_headers'].items():
+            headers += f"--header {shlex.quote(f'{name}: {value}')} "
+
+        if Config.get('use_ranged_downloader', True):
+            download_cmd = (f"{DirectoryUtils().root_dir}/bin/ranged_download " +
+                f"--url {shlex.quote(resolved_format['url'])} {headers}" +
+                f"--connections {int(Config.get('ranged_download_connections', 4))} " +
+                f"--log-uuid {shlex.quote(Logger.get_uuid())}")
+        else:
+            download_cmd = (f"curl --silent --show-error --fail --location --retry 10 --retry-delay 1 {headers}" +
+                f"{shlex.quote(resolved_format['url'])}")
+        return f"{download_cmd} | mbuffer -q -Q -m {buffer_size}b"
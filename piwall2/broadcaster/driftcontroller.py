@@ -0,0 +1,87 @@
+import time
+
+from piwall2.config import Config
+from piwall2.controlmessagehelper import ControlMessageHelper
+from piwall2.logger import Logger
+
+"""
+Corrects for TVs drifting apart from each other over the course of a long video.
+
+We use the TV that is furthest behind as the reference, and bring any TV that is ahead of it by more than a
+threshold back into sync. We can't seek: the receivers play the video from stdin, which is not seekable. And
+omxplayer does not support fine-grained adjustments of its playback rate. Thus, the correction is to briefly pause
+the TVs that are ahead, for as long as they are ahead. See: Receiver.__apply_drift_correction
+
+To avoid oscillating, after a correction we wait for a cooldown period before correcting again. This gives the
+receivers time to send fresh samples of their playback positions. A TV must drift beyond the threshold again
+before it is corrected again.
+
+See: PlaybackSampleCollector
+"""
+class DriftController:
+
+    # After a correction, don't correct again for this many seconds. This should be long enough that all samples
+    # used to compute drift were taken after the previous correction. See: PlaybackSampleCollector.__MAX_SAMPLE_AGE_S
+    __COOLDOWN_S = 10
+
+    # A drift larger than this is likely a symptom of a different problem, e.g. a receiver that dropped packets.
+    # Don't pause a TV for longer than this in one correction.
+    __MAX_HOLD_MS = 500
+
+    def __init__(self, playback_sample_collector):
+        self.__logger = Logger().set_namespace(self.__class__.__name__)
+        self.__playback_sample_collector = playback_sample_collector
+        self.__control_message_helper = ControlMessageHelper().setup_for_broadcaster()
+        self.__threshold_ms = Config.get('drift_correction_threshold_ms', 50)
+        self.__reset(None)
+
+    def correct_drift(self, stream_id):
+        if not self.__threshold_ms or self.__threshold_ms <= 0:
+            return
+
+        if stream_id != self.__stream_id:
+            self.__reset(stream_id)
+
+        now = time.time()
+        if (now - self.__last_correction_time) < self.__COOLDOWN_S:
+            return
+
+        projected_positions = self.__playback_sample_collector.get_projected_positions(stream_id)
+        if len(projected_positions) < 2:
+            return
+
+        reference_position_s = min(p['position_s'] for p in projected_positions.values())
+        drift_ms_by_tv_id = {}
+        for tv_id, projected_position in projected_positions.items():
+            drift_ms_by_tv_id[tv_id] = round((projected_position['position_s'] - reference_position_s) * 1000)
+
+        if self.__drift_ms_by_tv_id_before_correction is not None:
+            self.__logger.info(f"Drift after correction: {self.__format_drift(drift_ms_by_tv_id)}. Drift before " +
+                f"correction was: {self.__format_drift(self.__drift_ms_by_tv_id_before_correction)}.")
+            self.__drift_ms_by_tv_id_before_correction = None
+
+        hold_ms_by_tv_id = {}
+        for tv_id, drift_ms in drift_ms_by_tv_id.items():
+            if drift_ms > self.__threshold_ms:
+                hold_ms_by_tv_id[tv_id] = min(drift_ms, self.__MAX_HOLD_MS)
+        if not hold_ms_by_tv_id:
+            return
+
+        self.__logger.info(f"Correcting drift for stream {stream_id}: {self.__format_drift(drift_ms_by_tv_id)}. " +
+            f"Pausing TVs that are ahead: {hold_ms_by_tv_id}.")
+        self.__control_message_helper.send_msg(ControlMessageHelper.TYPE_DRIFT_CORRECTION, {
+            'stream_id': stream_id,
+            'hold_ms_by_tv_id': hold_ms_by_tv_id,
+        })
+        self.__last_correction_time = now
+        self.__drift_ms_by_tv_id_before_correction = drift_ms_by_tv_id
+
+    def __reset(self, stream_id):
+        self.__stream_id = stream_id
+        self.__last_correction_time = 0
+
+        # Set after a correction, so that we can log the drift after the correction took effect.
+        self.__drift_ms_by_tv_id_before_correction = None
+
+    def __format_drift(self, drift_ms_by_tv_id):
+        return ', '.join([f"{tv_id}: +{drift_ms}ms" for tv_id, drift_ms in sorted(drift_ms_by_tv_id.items())])
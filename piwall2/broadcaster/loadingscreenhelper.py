@@ -2,9 +2,11 @@ import hashlib
 import json
 import os
 import random
+import shlex
 import subprocess
 
 from piwall2.broadcaster.ffprober import Ffprober
+from piwall2.broadcaster.receiverroster import ReceiverRoster
 from piwall2.cmdrunner import CmdRunner
 from piwall2.config import Config
 from piwall2.configloader import ConfigLoader
@@ -74,20 +76,43 @@ class LoadingScreenHelper:
     # For each loading screen:
     #   1) check if it exists on the broadcaster. If not, throw an exception.
     #   2) check if it exists on each receiver. If not, copy it to all receivers.
+    #
+    # Receivers that have not sent a heartbeat recently are skipped, rather than waiting for their ssh connections to
+    # time out. The live receivers are determined once, up front: msend_file_to_receivers stops the receiver service,
+    # which is what sends the heartbeats, so the receivers would not look live to the next copy.
     def copy_loading_screens_from_broadcaster_to_receivers(self):
         loading_screens = self.__get_loading_screen_candidates()
-        cmd_runner = CmdRunner()
         for loading_screen in loading_screens:
             if not os.path.isfile(loading_screen['video_path']):
                 raise Exception(f"Loading screen does not exist: {loading_screen['video_path']}")
 
+        cmd_runner = CmdRunner(self.__get_live_receivers_list())
         loading_screens_to_copy = self.__get_loading_screens_that_need_to_be_copied(loading_screens, cmd_runner)
+        receivers_str = ','.join(cmd_runner.get_receivers_hostname_list())
         for loading_screen in loading_screens_to_copy:
             self.__logger.info(f"Sending loading screen to receivers: {loading_screen}")
             cmd = (DirectoryUtils().root_dir +
-                f'/utils/msend_file_to_receivers --input-file {loading_screen} --output-file {loading_screen}')
+                f'/utils/msend_file_to_receivers --input-file {loading_screen} --output-file {loading_screen} ' +
+                f'--receivers {shlex.quote(receivers_str)}')
             cmd_runner.run_cmd_with_realtime_output(cmd)
 
+    # If we don't know which receivers are live, for instance because the queue process is not running, we fall back
+    # to using all receivers. See: ReceiverRoster
+    def __get_live_receivers_list(self):
+        receivers_list = ConfigLoader().get_receivers_list()
+        live_receivers_list = ReceiverRoster().get_live_receivers()
+        if live_receivers_list is None:
+            self.__logger.info("Receiver roster is unavailable. Assuming all receivers are live.")
+            return receivers_list
+
+        if not live_receivers_list:
+            raise Exception(f"None of the receivers have sent a heartbeat recently: {receivers_list}.")
+        dead_receivers_list = [r for r in receivers_list if r not in live_receivers_list]
+        if dead_receivers_list:
+            self.__logger.warning("Skipping receivers that have not sent a heartbeat recently: " +
+                f"{dead_receivers_list}.")
+        return live_receivers_list
+
     # Returns a dict with the keys: video_path, width, height
     def __choose_random_loading_screen(self):
         candidates = self.__get_loading_screen_candidates()
@@ -139,7 +164,7 @@ class LoadingScreenHelper:
                 video_to_match_count_map[video_path] += 1
 
         loading_screens_that_need_to_be_copied = []
-        num_receivers = len(ConfigLoader().get_receivers_list())
+        num_receivers = len(cmd_runner.get_receivers_hostname_list())
         for video_path, match_count in video_to_match_count_map.items():
             if match_count < num_receivers:
                 self.__logger.info("Loading screen needs to be copied to one or more receivers " +
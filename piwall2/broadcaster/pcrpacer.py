@@ -0,0 +1,78 @@
+import collections
+import os
+import time
+
+from piwall2.broadcaster.pcrtimeline import PcrTimeline
+
+"""
+Paces the broadcast of an MPEG-TS stream against the wall clock, using the stream's PCR timeline. See: PcrTimeline
+
+The receivers' omxplayer instances read more quickly, and thus respond to dbus messages more quickly, when they have
+plenty of video buffered. See: docs/controlling_video_broadcast_speed.adoc. But sending too far ahead would overflow
+the receivers' input buffers. Thus we let the broadcast run ahead of real time by up to `lead_s` seconds of media, and
+up to `max_lead_bytes` bytes, and otherwise release the stream at real time.
+
+"Real time" starts when the first data is written. Data is released a chunk at a time: a chunk is held back until
+the last PCR in the chunk is within the lead of the elapsed time.
+"""
+class PcrPacer:
+
+    def __init__(self, lead_s, max_lead_bytes):
+        self.__lead_s = lead_s
+        self.__max_lead_bytes = max_lead_bytes
+        self.__pcr_timeline = PcrTimeline()
+        self.__start_time = None
+        self.__media_time_sent_s = 0
+        self.__bytes_sent = 0
+
+        # An estimate of how many bytes the receivers have played, based on the elapsed time.
+        self.__bytes_played = 0
+
+        # (media_time_s, bytes_sent) after each chunk that has been sent, but not yet played.
+        self.__unplayed_chunks = collections.deque()
+
+    # Writes the data to the file descriptor, once it is time to release it.
+    def write(self, fd, data):
+        now = time.time()
+        if self.__start_time is None:
+            self.__start_time = now
+
+        self.__pcr_timeline.feed(data, now)
+        media_time_s = self.__pcr_timeline.get_media_time_s()
+        if media_time_s is not None:
+            wait_s = self.__get_wait_s(media_time_s, len(data), now)
+            while wait_s > 0:
+                time.sleep(wait_s)
+                wait_s = self.__get_wait_s(media_time_s, len(data), time.time())
+
+        view = memoryview(data)
+        while view:
+            num_bytes_written = os.write(fd, view)
+            view = view[num_bytes_written:]
+
+        self.__bytes_sent += len(data)
+        if media_time_s is not None:
+            self.__media_time_sent_s = media_time_s
+            self.__unplayed_chunks.append((media_time_s, self.__bytes_sent))
+
+    # How far into the stream's timeline the data written so far reaches, in seconds.
+    def get_media_time_sent_s(self):
+        return self.__media_time_sent_s
+
+    def get_elapsed_time_s(self):
+        if self.__start_time is None:
+            return 0
+        return time.time() - self.__start_time
+
+    def get_pcr_timeline(self):
+        return self.__pcr_timeline
+
+    def __get_wait_s(self, media_time_s, num_bytes, now):
+        playback_position_s = now - self.__start_time
+        wait_s = media_time_s - self.__lead_s - playback_position_s
+
+        while self.__unplayed_chunks and self.__unplayed_chunks[0][0] <= playback_position_s:
+            self.__bytes_played = self.__unplayed_chunks.popleft()[1]
+        if self.__unplayed_chunks and (self.__bytes_sent + num_bytes - self.__bytes_played) > self.__max_lead_bytes:
+            wait_s = max(wait_s, self.__unplayed_chunks[0][0] - playback_position_s)
+        return wait_s
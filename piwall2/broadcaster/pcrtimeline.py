@@ -0,0 +1,128 @@
+import time
+
+"""
+Tracks the media timeline of an MPEG-TS stream from the program clock references (PCRs) in its packets, as the
+stream's bytes pass through the broadcaster. See: VideoBroadcaster
+
+The PCR is the stream's 27 MHz clock: a packet's PCR says at what point in the stream's timeline the packet should be
+played. Thus the difference between the stream's last and first PCRs is the stream's duration, and we can estimate
+when playback will be over without waiting for a real time player to reach the end of the stream.
+
+We sample at most two PCRs per `feed`: the first and the last in the fed data. That's plenty for timekeeping, and it
+keeps the cost of `feed` independent of how much data is fed.
+
+See: ITU-T H.222.0, section 2.4.3.5 (adaptation field) and 2.4.2.2 (PCR)
+"""
+class PcrTimeline:
+
+    __TS_PACKET_SIZE = 188
+    __TS_SYNC_BYTE = 0x47
+
+    __PCR_HZ = 27000000
+
+    # The PCR is a 33 bit base at 90 kHz times 300, plus a 9 bit extension. It wraps around about once a day.
+    __PCR_MODULUS = (2 ** 33) * 300
+
+    def __init__(self):
+        self.__buffer = b''
+        self.__pcr_pid = None
+        self.__first_pcr = None
+        self.__last_raw_pcr = None
+        self.__last_pcr = None
+        self.__latest_origin_time = None
+
+    # receive_time: the wall clock time at which the data was received. Defaults to now.
+    def feed(self, data, receive_time = None):
+        if receive_time is None:
+            receive_time = time.time()
+
+        self.__buffer += data
+        if not self.__sync():
+            return
+
+        num_packets = len(self.__buffer) // self.__TS_PACKET_SIZE
+        first_pcr_index = None
+        for i in range(num_packets):
+            pcr = self.__get_pcr(i * self.__TS_PACKET_SIZE)
+            if pcr is not None:
+                self.__add_pcr(pcr, receive_time)
+                first_pcr_index = i
+                break
+        if first_pcr_index is not None:
+            for i in range(num_packets - 1, first_pcr_index, -1):
+                pcr = self.__get_pcr(i * self.__TS_PACKET_SIZE)
+                if pcr is not None:
+                    self.__add_pcr(pcr, receive_time)
+                    break
+        self.__buffer = self.__buffer[num_packets * self.__TS_PACKET_SIZE:]
+
+    # Returns how far into the stream's timeline the data fed so far reaches, in seconds, or None if no PCRs have
+    # been seen yet. Once the whole stream has been fed, this is the stream's duration.
+    def get_media_time_s(self):
+        if self.__first_pcr is None:
+            return None
+        return (self.__last_pcr - self.__first_pcr) / self.__PCR_HZ
+
+    """
+    Returns the earliest wall clock time at which playback of the stream's timeline could have started, given when
+    each part of the stream was received. A player can't play a packet before it was received: if part of the stream
+    arrived late, e.g. because the download stalled, playback can't be ahead of that part's arrival. Returns None if
+    no PCRs have been seen yet.
+    """
+    def get_latest_origin_time(self):
+        return self.__latest_origin_time
+
+    def __add_pcr(self, raw_pcr, receive_time):
+        if self.__first_pcr is None:
+            self.__first_pcr = raw_pcr
+            self.__last_pcr = raw_pcr
+        else:
+            delta = (raw_pcr - self.__last_raw_pcr) % self.__PCR_MODULUS
+            if delta > self.__PCR_MODULUS / 2:
+                delta -= self.__PCR_MODULUS # A small step backwards rather than a huge step forwards.
+            self.__last_pcr += delta
+        self.__last_raw_pcr = raw_pcr
+
+        origin_time = receive_time - self.get_media_time_s()
+        if self.__latest_origin_time is None or origin_time > self.__latest_origin_time:
+            self.__latest_origin_time = origin_time
+
+    # Returns the packet's PCR, or None if the packet doesn't have one. We only use the PCRs of the first PID that
+    # carries PCRs.
+    def __get_pcr(self, offset):
+        packet = self.__buffer
+        if packet[offset] != self.__TS_SYNC_BYTE:
+            return None
+
+        adaptation_field_control = (packet[offset + 3] >> 4) & 0x03
+        if adaptation_field_control not in (2, 3):
+            return None
+        adaptation_field_length = packet[offset + 4]
+        if adaptation_field_length < 7 or not (packet[offset + 5] & 0x10):
+            return None
+
+        pid = ((packet[offset + 1] & 0x1F) << 8) | packet[offset + 2]
+        if self.__pcr_pid is None:
+            self.__pcr_pid = pid
+        elif pid != self.__pcr_pid:
+            return None
+
+        b = packet[offset + 6:offset + 12]
+        pcr_base = (b[0] << 25) | (b[1] << 17) | (b[2] << 9) | (b[3] << 1) | (b[4] >> 7)
+        pcr_extension = ((b[4] & 0x01) << 8) | b[5]
+        return pcr_base * 300 + pcr_extension
+
+    # Skip any leading garbage, so that the buffer starts at a TS packet boundary.
+    def __sync(self):
+        while len(self.__buffer) > self.__TS_PACKET_SIZE:
+            if (
+                self.__buffer[0] == self.__TS_SYNC_BYTE and
+                self.__buffer[self.__TS_PACKET_SIZE] == self.__TS_SYNC_BYTE
+            ):
+                return True
+            sync_byte_index = self.__buffer.find(bytes([self.__TS_SYNC_BYTE]), 1)
+            if sync_byte_index < 0:
+                self.__buffer = b''
+                return False
+            self.__buffer = self.__buffer[sync_byte_index:]
+        return len(self.__buffer) == self.__TS_PACKET_SIZE and self.__buffer[0] == self.__TS_SYNC_BYTE
@@ -0,0 +1,98 @@
+import time
+
+from piwall2.logger import Logger
+from piwall2.telemetryhelper import TelemetryHelper
+
+# Collects the playback position samples sent by the receivers, and measures how far the TVs have drifted apart
+# from each other. See: PlaybackSampler
+#
+# Receivers' clocks are not synchronized with the broadcaster's clock. Thus, we project each TV's position onto the
+# broadcaster's clock using the time at which we received its sample, rather than using any receiver timestamps.
+# This assumes that network latency is negligible, which is true enough on a LAN.
+class PlaybackSampleCollector:
+
+    # Samples older than this are not used to measure drift.
+    __MAX_SAMPLE_AGE_S = 5
+
+    __DRIFT_LOGS_PER_SECOND = 0.1
+
+    def __init__(self):
+        self.__logger = Logger().set_namespace(self.__class__.__name__)
+
+        # dict keyed by tv_id. Each value is a dict with the keys: receiver, stream_id, position_s, is_paused,
+        # load_avg, and position_time (the broadcaster time at which the TV was at position_s).
+        self.__latest_samples = {}
+        self.__last_drift_log_time = 0
+
+    # Registers the collector's handlers with the listener.
+    def listen(self, telemetry_listener):
+        (telemetry_listener
+            .add_handler(TelemetryHelper.TYPE_PLAYBACK_SAMPLE, self.__handle_playback_sample)
+            .add_tick_handler(self.__maybe_log_drift))
+        return self
+
+    """
+    Returns a dict keyed by tv_id with each TV's current playback position projected onto the broadcaster's clock.
+    Only TVs that are playing the given stream and are not paused are included. Each value is a dict with the keys:
+        receiver
+        position_s
+        load_avg
+    """
+    def get_projected_positions(self, stream_id):
+        now = time.time()
+        projected_positions = {}
+        # Copy the items, because the listener thread may add samples while we iterate.
+        for tv_id, sample in list(self.__latest_samples.items()):
+            if (
+                sample['stream_id'] != stream_id or sample['is_paused'] or
+                (now - sample['position_time']) > self.__MAX_SAMPLE_AGE_S
+            ):
+                continue
+            projected_positions[tv_id] = {
+                'receiver': sample['receiver'],
+                'position_s': sample['position_s'] + (now - sample['position_time']),
+                'load_avg': sample['load_avg'],
+            }
+        return projected_positions
+
+    # Returns the stream_id of the most recent sample, or None if there are no samples.
+    def get_latest_stream_id(self):
+        latest_sample = None
+        for sample in list(self.__latest_samples.values()):
+            if latest_sample is None or sample['position_time'] > latest_sample['position_time']:
+                latest_sample = sample
+        if latest_sample is None:
+            return None
+        return latest_sample['stream_id']
+
+    def __handle_playback_sample(self, msg, receive_time):
+        for sample in msg['samples']:
+            self.__latest_samples[sample['tv_id']] = {
+                'receiver': msg['receiver'],
+                'stream_id': msg['stream_id'],
+                'position_s': sample['position_s'],
+                'is_paused': sample['is_paused'],
+                'load_avg': msg['load_avg'],
+                'position_time': receive_time - sample['sample_age_s'],
+            }
+
+    def __maybe_log_drift(self):
+        if (time.time() - self.__last_drift_log_time) < (1 / self.__DRIFT_LOGS_PER_SECOND):
+            return
+        self.__last_drift_log_time = time.time()
+
+        stream_id = self.get_latest_stream_id()
+        if stream_id is None:
+            return
+        projected_positions = self.get_projected_positions(stream_id)
+        if len(projected_positions) < 2:
+            return
+
+        min_position_s = min(p['position_s'] for p in projected_positions.values())
+        max_position_s = max(p['position_s'] for p in projected_positions.values())
+        offsets = ''
+        for tv_id, projected_position in sorted(projected_positions.items()):
+            offsets += (f"{tv_id}: +{round((projected_position['position_s'] - min_position_s) * 1000)}ms " +
+                f"(load avg: {projected_position['load_avg']}), ")
+        self.__logger.info(f"Playback drift for stream {stream_id}: {round((max_position_s - min_position_s) * 1000)}ms " +
+            f"at position {round(min_position_s, 1)}s. Offsets from the most behind TV: {offsets.rstrip(', ')}.")
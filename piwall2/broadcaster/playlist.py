@@ -1,3 +1,5 @@
+from piwall2.broadcaster.databasewriter import DatabaseWriter
+from piwall2.broadcaster.queuenotifier import QueueNotifier
 from piwall2.logger import Logger
 import piwall2.broadcaster.database
 
@@ -25,6 +27,17 @@ class Playlist:
     # sqlite3's maximum integer value. Higher priority means play the video first.
     __CHANNEL_VIDEO_PRIORITY = 2 ** 63 - 1
 
+    """
+    Finished rows (STATUS_DONE and STATUS_DELETED) are moved to the playlist_history table, so that playlist_videos
+    only holds the queue and recently finished rows. See: archive_finished_videos
+
+    The playlist_videos index only covers queued and playing rows, so it stays small no matter how many rows have
+    finished. SQLite only uses a partial index if it can tell from the query's WHERE clause that the query only
+    matches rows in the index. Thus queries that should use the index must name the statuses literally, e.g.
+    `status = 'STATUS_QUEUED'`, rather than as bound parameters, e.g. `status = ?`.
+    """
+    QUEUE_INDEX_WHERE_CLAUSE = f"status = '{STATUS_QUEUED}' OR status = '{STATUS_PLAYING}'"
+
     def __init__(self):
         self.__cursor = piwall2.broadcaster.database.Database().get_cursor()
         self.__logger = Logger().set_namespace(self.__class__.__name__)
@@ -46,10 +59,30 @@ class Playlist:
                 priority INTEGER DEFAULT 0
             )""")
 
-        self.__cursor.execute("DROP INDEX IF EXISTS status_type_priority_idx")
-        self.__cursor.execute("CREATE INDEX status_type_priority_idx ON playlist_videos (status, type, priority)")
-        self.__cursor.execute("DROP INDEX IF EXISTS status_priority_idx")
-        self.__cursor.execute("CREATE INDEX status_priority_idx ON playlist_videos (status, priority DESC, playlist_video_id ASC)")
+        self.__cursor.execute("DROP INDEX IF EXISTS queue_idx")
+        self.__cursor.execute(
+            "CREATE INDEX queue_idx ON playlist_videos (status, priority DESC, playlist_video_id ASC) " +
+            f"WHERE {self.QUEUE_INDEX_WHERE_CLAUSE}"
+        )
+        self.construct_history()
+
+    def construct_history(self):
+        self.__cursor.execute("DROP TABLE IF EXISTS playlist_history")
+        self.__cursor.execute("""
+            CREATE TABLE playlist_history (
+                playlist_video_id INTEGER PRIMARY KEY,
+                type VARCHAR(20) DEFAULT 'TYPE_VIDEO',
+                create_date DATETIME  DEFAULT CURRENT_TIMESTAMP,
+                url TEXT,
+                thumbnail TEXT,
+                title TEXT,
+                duration VARCHAR(20),
+                status VARCHAR(20),
+                is_skip_requested INTEGER DEFAULT 0,
+                settings TEXT DEFAULT '',
+                priority INTEGER DEFAULT 0,
+                archive_date DATETIME DEFAULT CURRENT_TIMESTAMP
+            )""")
 
     def enqueue(self, url, thumbnail, title, duration, settings, video_type):
         if video_type == self.TYPE_CHANNEL_VIDEO:
@@ -57,29 +90,81 @@ class Playlist:
         else:
             priority = 0
 
-        self.__cursor.execute(
+        playlist_video_id = DatabaseWriter.write(lambda cursor: cursor.execute(
             ("INSERT INTO playlist_videos " +
                 "(url, thumbnail, title, duration, status, settings, type, priority) " +
                 "VALUES(?, ?, ?, ?, ?, ?, ?, ?)"),
             [url, thumbnail, title, duration, self.STATUS_QUEUED, settings, video_type, priority]
+        ).lastrowid)
+        QueueNotifier.notify(QueueNotifier.EVENT_ENQUEUE)
+        return playlist_video_id
+
+    """
+    Enqueues a list of videos in one transaction, rather than committing each of them separately. Returns the number of
+    videos that were enqueued. Each video is a dict with the keys: url, thumbnail, title, and duration.
+
+    If should_shuffle is True, the videos are enqueued in a random order. The shuffle is done in SQL: the videos are
+    staged in a temporary table, and copied into the playlist ordered by RANDOM(), so that their playlist_video_ids,
+    and thus their order in the queue, are assigned in that order.
+    """
+    def enqueue_many(self, videos, should_shuffle = False):
+        if not videos:
+            return 0
+
+        num_enqueued = DatabaseWriter.write(lambda cursor: self.__enqueue_many(cursor, videos, should_shuffle))
+        QueueNotifier.notify(QueueNotifier.EVENT_ENQUEUE)
+        return num_enqueued
+
+    def __enqueue_many(self, cursor, videos, should_shuffle):
+        params = [
+            [video['url'], video['thumbnail'], video['title'], video['duration']]
+            for video in videos
+        ]
+        if not should_shuffle:
+            cursor.executemany(
+                ("INSERT INTO playlist_videos " +
+                    "(url, thumbnail, title, duration, status, settings, type, priority) " +
+                    "VALUES(?, ?, ?, ?, ?, '', ?, 0)"),
+                [video_params + [self.STATUS_QUEUED, self.TYPE_VIDEO] for video_params in params]
+            )
+            return cursor.rowcount
+
+        cursor.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS enqueue_many_videos (url TEXT, thumbnail TEXT, title TEXT, duration TEXT)"
         )
-        return self.__cursor.lastrowid
+        cursor.execute("DELETE FROM enqueue_many_videos")
+        cursor.executemany(
+            "INSERT INTO enqueue_many_videos (url, thumbnail, title, duration) VALUES(?, ?, ?, ?)", params
+        )
+        cursor.execute(
+            ("INSERT INTO playlist_videos " +
+                "(url, thumbnail, title, duration, status, settings, type, priority) " +
+                "SELECT url, thumbnail, title, duration, ?, '', ?, 0 FROM enqueue_many_videos ORDER BY RANDOM()"),
+            [self.STATUS_QUEUED, self.TYPE_VIDEO]
+        )
+        num_enqueued = cursor.rowcount
+        cursor.execute("DELETE FROM enqueue_many_videos")
+        return num_enqueued
 
     # Re-enqueue a video at the front of the queue.
     #
+    # If no videos of TYPE_VIDEO are queued, MAX(priority) is NULL, hence the COALESCE.
+    #
     # Note: this method only works for videos of type TYPE_VIDEO. Attempting to use this for
     # type CHANNEL_VIDEO would result in integer overflow incrementing the priority if we
     # did not filter for only videos of TYPE_VIDEO in the sub WHERE clause.
     def reenqueue(self, playlist_video_id):
-        self.__cursor.execute("""
+        rowcount = DatabaseWriter.write(lambda cursor: cursor.execute(f"""
             UPDATE playlist_videos set
                 status = ?,
                 is_skip_requested = ?,
-                priority = (SELECT MAX(priority)+1 FROM playlist_videos WHERE type = ? AND status = ?)
+                priority = (
+                    SELECT COALESCE(MAX(priority), 0) + 1 FROM playlist_videos WHERE type = ? AND status = '{self.STATUS_QUEUED}'
+                )
             WHERE playlist_video_id = ?""",
-            [self.STATUS_QUEUED, 0, self.TYPE_VIDEO, self.STATUS_QUEUED, playlist_video_id]
-        )
-        return self.__cursor.rowcount >= 1
+            [self.STATUS_QUEUED, 0, self.TYPE_VIDEO, playlist_video_id]
+        ).rowcount)
+        return rowcount >= 1
 
     # Passing the id of the video to skip ensures our skips are "atomic". That is, we can ensure we skip the
     # video that the user intended to skip.
@@ -87,61 +172,77 @@ class Playlist:
     # Note: technically this method only _requests_ a skip. The actual skipping is asynchronous, handled by
     # the queue process.
     def skip(self, playlist_video_id):
-        self.__cursor.execute(
+        rowcount = DatabaseWriter.write(lambda cursor: cursor.execute(
             "UPDATE playlist_videos set is_skip_requested = 1 WHERE status = ? AND playlist_video_id = ?",
             [self.STATUS_PLAYING, playlist_video_id]
-        )
-        return self.__cursor.rowcount >= 1
+        ).rowcount)
+        QueueNotifier.notify(QueueNotifier.EVENT_SKIP)
+        return rowcount >= 1
 
     def remove_videos_of_type(self, video_type):
-        self.__cursor.execute(
-            "UPDATE playlist_videos set status = ? WHERE status = ? AND type = ?",
-            [self.STATUS_DELETED, self.STATUS_QUEUED, video_type]
-        )
-        return self.__cursor.rowcount >= 1
+        rowcount = DatabaseWriter.write(lambda cursor: cursor.execute(
+            f"UPDATE playlist_videos set status = ? WHERE status = '{self.STATUS_QUEUED}' AND type = ?",
+            [self.STATUS_DELETED, video_type]
+        ).rowcount)
+        QueueNotifier.notify(QueueNotifier.EVENT_REMOVE)
+        return rowcount >= 1
 
     def remove(self, playlist_video_id):
-        self.__cursor.execute(
+        rowcount = DatabaseWriter.write(lambda cursor: cursor.execute(
             "UPDATE playlist_videos set status = ? WHERE playlist_video_id = ? AND status = ?",
             [self.STATUS_DELETED, playlist_video_id, self.STATUS_QUEUED]
-        )
-        return self.__cursor.rowcount >= 1
+        ).rowcount)
+        QueueNotifier.notify(QueueNotifier.EVENT_REMOVE)
+        return rowcount >= 1
 
     def clear(self):
-        self.__cursor.execute("UPDATE playlist_videos set status = ? WHERE status = ?",
-            [self.STATUS_DELETED, self.STATUS_QUEUED]
+        DatabaseWriter.write(self.__clear)
+        QueueNotifier.notify(QueueNotifier.EVENT_CLEAR)
+
+    def __clear(self, cursor):
+        cursor.execute(f"UPDATE playlist_videos set status = ? WHERE status = '{self.STATUS_QUEUED}'",
+            [self.STATUS_DELETED]
         )
-        self.__cursor.execute(
-            "UPDATE playlist_videos set is_skip_requested = 1 WHERE status = ?",
-            [self.STATUS_PLAYING]
+        cursor.execute(
+            f"UPDATE playlist_videos set is_skip_requested = 1 WHERE status = '{self.STATUS_PLAYING}'"
         )
 
     def play_next(self, playlist_video_id):
-        self.__cursor.execute(
-            """
+        rowcount = DatabaseWriter.write(lambda cursor: cursor.execute(
+            f"""
                 UPDATE playlist_videos set priority = (
-                    SELECT MAX(priority)+1 FROM playlist_videos WHERE type = ? AND status = ?
+                    SELECT COALESCE(MAX(priority), 0) + 1 FROM playlist_videos WHERE type = ? AND status = '{self.STATUS_QUEUED}'
                 ) WHERE playlist_video_id = ?
             """,
-            [self.TYPE_VIDEO, self.STATUS_QUEUED, playlist_video_id]
-        )
-        return self.__cursor.rowcount >= 1
+            [self.TYPE_VIDEO, playlist_video_id]
+        ).rowcount)
+        QueueNotifier.notify(QueueNotifier.EVENT_PLAY_NEXT)
+        return rowcount >= 1
 
     def get_current_video(self):
-        self.__cursor.execute("SELECT * FROM playlist_videos WHERE status = ? LIMIT 1", [self.STATUS_PLAYING])
+        self.__cursor.execute(f"SELECT * FROM playlist_videos WHERE status = '{self.STATUS_PLAYING}' LIMIT 1")
         return self.__cursor.fetchone()
 
     def get_next_playlist_item(self):
         self.__cursor.execute(
-            "SELECT * FROM playlist_videos WHERE status = ? order by priority desc, playlist_video_id asc LIMIT 1",
-            [self.STATUS_QUEUED]
+            f"SELECT * FROM playlist_videos WHERE status = '{self.STATUS_QUEUED}' " +
+            "order by priority desc, playlist_video_id asc LIMIT 1"
         )
         return self.__cursor.fetchone()
 
+    # Returns up to `limit` of the next playlist items, in the order that they will be played.
+    def get_next_playlist_items(self, limit):
+        self.__cursor.execute(
+            f"SELECT * FROM playlist_videos WHERE status = '{self.STATUS_QUEUED}' " +
+            "order by priority desc, playlist_video_id asc LIMIT ?",
+            [limit]
+        )
+        return self.__cursor.fetchall()
+
     def get_queue(self):
         self.__cursor.execute(
-            "SELECT * FROM playlist_videos WHERE status IN (?, ?) order by priority desc, playlist_video_id asc",
-            [self.STATUS_PLAYING, self.STATUS_QUEUED]
+            f"SELECT * FROM playlist_videos WHERE {self.QUEUE_INDEX_WHERE_CLAUSE} " +
+            "order by priority desc, playlist_video_id asc"
         )
         queue = self.__cursor.fetchall()
         ordered_queue = []
@@ -157,27 +258,62 @@ class Playlist:
     #   2) Someone deletes the video from the queue
     #   3) We attempt to set the video to "playing" status
     def set_current_video(self, playlist_video_id):
-        self.__cursor.execute(
+        rowcount = DatabaseWriter.write(lambda cursor: cursor.execute(
             "UPDATE playlist_videos set status = ? WHERE status = ? AND playlist_video_id = ?",
             [self.STATUS_PLAYING, self.STATUS_QUEUED, playlist_video_id]
-        )
-        if self.__cursor.rowcount == 1:
+        ).rowcount)
+        if rowcount == 1:
             return True
         return False
 
     def end_video(self, playlist_video_id):
-        self.__cursor.execute(
+        DatabaseWriter.write(lambda cursor: cursor.execute(
             "UPDATE playlist_videos set status=? WHERE playlist_video_id=?",
             [self.STATUS_DONE, playlist_video_id]
-        )
+        ))
 
     # Clean up any weird state we may have in the DB as a result of unclean shutdowns, etc:
     # set any existing 'playing' videos to 'done'.
     def clean_up_state(self):
-        self.__cursor.execute(
-            "UPDATE playlist_videos set status = ? WHERE status = ?",
-            [self.STATUS_DONE, self.STATUS_PLAYING]
+        DatabaseWriter.write(lambda cursor: cursor.execute(
+            f"UPDATE playlist_videos set status = ? WHERE status = '{self.STATUS_PLAYING}'",
+            [self.STATUS_DONE]
+        ))
+
+    """
+    Moves up to `limit` of the oldest finished rows from playlist_videos to playlist_history, atomically. Returns the
+    number of rows that were moved. Call this repeatedly, rather than with a large limit, so that other writers are
+    not blocked for long.
+
+    The row with the greatest playlist_video_id is never moved. playlist_video_ids are assigned as one more than the
+    greatest id in the table, so moving that row would allow its id to be reused.
+    """
+    def archive_finished_videos(self, limit):
+        return DatabaseWriter.write(lambda cursor: self.__archive_finished_videos(cursor, limit))
+
+    def __archive_finished_videos(self, cursor, limit):
+        cursor.execute(
+            ("SELECT playlist_video_id FROM playlist_videos WHERE status IN (?, ?) AND " +
+                "playlist_video_id < (SELECT MAX(playlist_video_id) FROM playlist_videos) " +
+                "order by playlist_video_id asc LIMIT ?"),
+            [self.STATUS_DONE, self.STATUS_DELETED, limit]
+        )
+        playlist_video_ids = [row['playlist_video_id'] for row in cursor.fetchall()]
+        if not playlist_video_ids:
+            return 0
+
+        columns = ('playlist_video_id, type, create_date, url, thumbnail, title, duration, status, ' +
+            'is_skip_requested, settings, priority')
+        placeholders = ', '.join(['?'] * len(playlist_video_ids))
+        cursor.execute(
+            (f"INSERT INTO playlist_history ({columns}) SELECT {columns} FROM playlist_videos " +
+                f"WHERE playlist_video_id IN ({placeholders})"),
+            playlist_video_ids
+        )
+        cursor.execute(
+            f"DELETE FROM playlist_videos WHERE playlist_video_id IN ({placeholders})", playlist_video_ids
         )
+        return len(playlist_video_ids)
 
     def should_skip_video_id(self, playlist_video_id):
         current_video = self.get_current_video()
@@ -0,0 +1,128 @@
+import heapq
+import traceback
+
+import piwall2.broadcaster.database
+from piwall2.broadcaster.playlist import Playlist
+from piwall2.logger import Logger
+
+"""
+An in-memory copy of the playlist queue, for the queue process. See: Queue
+
+The queue asks the same questions of the playlist many times: which item is next, and whether the current item
+should be skipped. Asking SQLite each time costs I/O, and can fail with `sqlite3.OperationalError: database is
+locked` when the DB is under load. Instead, the model holds the queued items in a heap, ordered the same way as
+Playlist's queries: by priority descending, then by playlist_video_id. Reads are served from memory. SQLite sorts
+NULL before any integer, so `ORDER BY priority DESC` puts NULL priorities last, and so does the heap.
+
+Writes still go to the DB, via Playlist, and the model is reloaded after each write it makes. Other processes write
+to the DB too, e.g. the server when a video is enqueued or skipped. The queue calls `refresh` when it is notified of
+such a change (see: QueueNotifier), and `refresh_if_changed` otherwise. The latter is cheap: it compares SQLite's
+`PRAGMA data_version`, which changes whenever another connection commits a change to the DB.
+
+This implements the subset of Playlist's interface that the queue uses.
+"""
+class PlaylistModel:
+
+    def __init__(self):
+        self.__logger = Logger().set_namespace(self.__class__.__name__)
+        self.__playlist = Playlist()
+
+        # Entries are tuples: (is_priority_null, -priority, playlist_video_id, playlist_item)
+        self.__heap = []
+        self.__current_video = None
+        self.__data_version = None
+        self.__is_stale = True
+        self.refresh()
+
+    # Reloads the model from the DB. Returns whether it was reloaded. If the DB can't be read, the model keeps its
+    # current contents, and is reloaded on the next call to `refresh_if_changed`.
+    def refresh(self):
+        try:
+            # Read the data_version before the items, so that a change committed in between is picked up by the
+            # next call to `refresh_if_changed`.
+            data_version = self.__get_data_version()
+            queue = self.__playlist.get_queue()
+        except Exception:
+            self.__logger.warning(f"Unable to refresh the playlist model: {traceback.format_exc()}")
+            self.__is_stale = True
+            return False
+
+        heap = []
+        current_video = None
+        for playlist_item in queue:
+            if playlist_item['status'] == Playlist.STATUS_PLAYING:
+                current_video = playlist_item
+            else:
+                priority = playlist_item['priority']
+                heap.append((
+                    priority is None, -(priority or 0), playlist_item['playlist_video_id'], playlist_item
+                ))
+        heapq.heapify(heap)
+
+        self.__heap = heap
+        self.__current_video = current_video
+        self.__data_version = data_version
+        self.__is_stale = False
+        return True
+
+    def refresh_if_changed(self):
+        try:
+            is_changed = self.__is_stale or self.__get_data_version() != self.__data_version
+        except Exception:
+            self.__logger.warning(f"Unable to check whether the playlist changed: {traceback.format_exc()}")
+            return False
+        if is_changed:
+            return self.refresh()
+        return False
+
+    def get_next_playlist_item(self):
+        if not self.__heap:
+            return None
+        return self.__heap[0][-1]
+
+    # Returns up to `limit` of the next playlist items, in the order that they will be played.
+    def get_next_playlist_items(self, limit):
+        return [entry[-1] for entry in heapq.nsmallest(limit, self.__heap)]
+
+    def should_skip_video_id(self, playlist_video_id):
+        current_video = self.__current_video
+        if current_video and current_video['playlist_video_id'] != playlist_video_id:
+            self.__logger.warning(
+                "Database and current process disagree about which playlist item is currently playing. " +
+                f"Database says playlist_video_id: {current_video['playlist_video_id']}, whereas current " +
+                f"process says playlist_video_id: {playlist_video_id}."
+            )
+            return False
+
+        if current_video and current_video["is_skip_requested"]:
+            self.__logger.info("Skipping current playlist item as requested.")
+            return True
+
+        return False
+
+    def set_current_video(self, playlist_video_id):
+        is_set = self.__playlist.set_current_video(playlist_video_id)
+        self.refresh()
+        return is_set
+
+    def end_video(self, playlist_video_id):
+        self.__playlist.end_video(playlist_video_id)
+        self.refresh()
+
+    def reenqueue(self, playlist_video_id):
+        is_reenqueued = self.__playlist.reenqueue(playlist_video_id)
+        self.refresh()
+        return is_reenqueued
+
+    def clean_up_state(self):
+        self.__playlist.clean_up_state()
+        self.refresh()
+
+    # Finished items are not in the model, so there is no need to refresh it.
+    def archive_finished_videos(self, limit):
+        return self.__playlist.archive_finished_videos(limit)
+
+    def __get_data_version(self):
+        cursor = piwall2.broadcaster.database.Database().get_cursor()
+        cursor.execute("PRAGMA data_version")
+        return cursor.fetchone()['data_version']
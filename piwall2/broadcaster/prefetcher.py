@@ -0,0 +1,248 @@
+import os
+import shlex
+import signal
+import subprocess
+import time
+import traceback
+
+from piwall2.broadcaster.downloadcommandbuilder import DownloadCommandBuilder
+from piwall2.broadcaster.videocache import VideoCache
+from piwall2.config import Config
+from piwall2.configloader import ConfigLoader
+from piwall2.logger import Logger
+
+"""
+Downloads and converts the next items in the playlist queue while the current video plays, and spools them to
+local files. Starting a video from a cold start takes several seconds: yt-dlp's startup and format selection, and
+downloading the first bytes of the video. Broadcasting a prefetched video from its spool file avoids all of that.
+
+Each item is downloaded to `<playlist_video_id>.ts.part` in the spool directory, and renamed to
+`<playlist_video_id>.ts` once the download is complete. Only complete spool files are used for broadcasting. If the
+next video is still being prefetched when it is time to play it, we abandon the prefetch and broadcast it as usual.
+
+Prefetches are thrown away when their items are no longer among the next items in the queue, e.g. because the queue
+order changed or an item was removed. We prefetch one item at a time, in queue order, to limit how much bandwidth
+prefetching takes away from the video that is currently playing.
+
+If the VideoCache is enabled, completed prefetches are moved into the cache instead of being kept in the spool, and
+items that are already cached are not prefetched. The broadcast of a cached item is then a cache hit.
+"""
+class Prefetcher:
+
+    __SPOOL_DIR = '/tmp/piwall2_prefetch_spool'
+
+    # Workaround for https://github.com/yt-dlp/yt-dlp/issues/6447 . These must be distinct from the directories
+    # used by VideoBroadcaster, because the prefetch runs concurrently with the broadcast.
+    __VIDEO_TMP_DIR = '/tmp/piwall2_prefetch_video_tmp'
+    __AUDIO_TMP_DIR = '/tmp/piwall2_prefetch_audio_tmp'
+
+    __UPDATES_PER_SECOND = 1
+
+    def __init__(self, playlist):
+        self.__logger = Logger().set_namespace(self.__class__.__name__)
+        self.__playlist = playlist
+        self.__video_cache = VideoCache()
+        self.__ytdl_video_format = ConfigLoader().get_youtube_dl_video_format()
+        self.__depth = Config.get('prefetch_depth', 1)
+        self.__max_spool_size_bytes = Config.get('prefetch_max_spool_size_mb', 1024) * 1024 * 1024
+        self.__last_update_time = 0
+
+        # dict keyed by playlist_video_id. Each value is a dict with the keys: url, proc, pgid, start_time, and
+        # is_complete.
+        self.__prefetches = {}
+
+        # Items whose prefetch failed or exceeded the spool size. We don't retry them while they remain in the queue.
+        self.__abandoned_playlist_video_ids = set()
+
+        self.__clean_up_spool()
+
+    # Called from the queue's run loop while a playlist item is being broadcast.
+    def update(self):
+        if not self.__depth or self.__depth <= 0:
+            return
+
+        now = time.time()
+        if (now - self.__last_update_time) < (1 / self.__UPDATES_PER_SECOND):
+            return
+        self.__last_update_time = now
+
+        try:
+            self.__update_internal()
+        except Exception:
+            self.__logger.error('Caught exception: {}'.format(traceback.format_exc()))
+
+    """
+    Returns the path of the complete spool file for the playlist item, or None if it has not been prefetched. The
+    caller takes ownership of the returned spool file, and should remove it via `remove_spool_file` once the
+    broadcast is over.
+
+    If the item is still being prefetched, the prefetch is abandoned: the caller should broadcast the item as usual.
+    """
+    def claim_spool_file(self, playlist_item):
+        playlist_video_id = playlist_item['playlist_video_id']
+        if playlist_video_id not in self.__prefetches:
+            return None
+
+        self.__poll(playlist_video_id)
+        prefetch = self.__prefetches.get(playlist_video_id)
+        if prefetch is None:
+            return None # The prefetch failed
+        if not prefetch['is_complete'] or prefetch['url'] != playlist_item['url']:
+            self.__discard(playlist_video_id, 'it was not done prefetching when it was time to play it')
+            return None
+
+        del self.__prefetches[playlist_video_id]
+        spool_file = self.__get_spool_file_path(playlist_video_id)
+        self.__logger.info(f"Using prefetched spool file for playlist_video_id {playlist_video_id}: {spool_file}")
+        return spool_file
+
+    # Returns whether the playlist item can be broadcast without downloading it first: it is a local file, its
+    # prefetch is complete, or it is cached. Unlike `claim_spool_file`, this doesn't abandon a prefetch that is still
+    # in progress.
+    def is_prefetched(self, playlist_item):
+        url = playlist_item['url']
+        if not url.startswith('http://') and not url.startswith('https://'):
+            return True
+
+        playlist_video_id = playlist_item['playlist_video_id']
+        if playlist_video_id in self.__prefetches:
+            self.__poll(playlist_video_id)
+        if self.__video_cache.contains(url, self.__ytdl_video_format):
+            return True
+        prefetch = self.__prefetches.get(playlist_video_id)
+        return prefetch is not None and prefetch['is_complete'] and prefetch['url'] == url
+
+    def remove_spool_file(self, spool_file):
+        try:
+            os.remove(spool_file)
+        except FileNotFoundError:
+            pass
+
+    def __update_internal(self):
+        next_items = [
+            item for item in self.__playlist.get_next_playlist_items(self.__depth)
+            if item['url'].startswith('http://') or item['url'].startswith('https://')
+        ]
+        next_urls_by_playlist_video_id = {item['playlist_video_id']: item['url'] for item in next_items}
+
+        for playlist_video_id in list(self.__prefetches.keys()):
+            if next_urls_by_playlist_video_id.get(playlist_video_id) != self.__prefetches[playlist_video_id]['url']:
+                self.__discard(playlist_video_id, 'it is no longer among the next items in the queue')
+        self.__abandoned_playlist_video_ids &= set(next_urls_by_playlist_video_id.keys())
+
+        is_prefetch_in_progress = False
+        for playlist_video_id in list(self.__prefetches.keys()):
+            self.__poll(playlist_video_id)
+            if playlist_video_id in self.__prefetches and not self.__prefetches[playlist_video_id]['is_complete']:
+                is_prefetch_in_progress = True
+
+        if is_prefetch_in_progress:
+            self.__enforce_spool_size()
+            return
+
+        for item in next_items:
+            playlist_video_id = item['playlist_video_id']
+            if playlist_video_id in self.__prefetches or playlist_video_id in self.__abandoned_playlist_video_ids:
+                continue
+            if self.__video_cache.contains(item['url'], self.__ytdl_video_format):
+                continue
+            self.__start_prefetch(playlist_video_id, item['url'])
+            break
+
+    def __start_prefetch(self, playlist_video_id, url):
+        os.makedirs(self.__SPOOL_DIR, exist_ok = True)
+        part_file = self.__get_spool_file_path(playlist_video_id) + '.part'
+        download_and_convert_cmd = DownloadCommandBuilder(
+            url,
+            f'{self.__VIDEO_TMP_DIR}/{playlist_video_id}',
+            f'{self.__AUDIO_TMP_DIR}/{playlist_video_id}',
+            yt_dlp_extractors = 'youtube'
+        ).build_download_and_convert_cmd(self.__ytdl_video_format)
+        cmd = f"{download_and_convert_cmd} > {shlex.quote(part_file)}"
+        self.__logger.info(f"Prefetching playlist_video_id {playlist_video_id} with command: {cmd}")
+
+        # Info on start_new_session: https://gist.github.com/dasl-/1379cc91fb8739efa5b9414f35101f5f
+        # Allows killing all processes (subshells, children, grandchildren, etc as a group)
+        proc = subprocess.Popen(cmd, shell = True, executable = '/usr/bin/bash', start_new_session = True)
+        self.__prefetches[playlist_video_id] = {
+            'url': url,
+            'proc': proc,
+            'pgid': os.getpgid(proc.pid),
+            'start_time': time.time(),
+            'is_complete': False,
+        }
+
+    def __poll(self, playlist_video_id):
+        prefetch = self.__prefetches[playlist_video_id]
+        if prefetch['is_complete'] or prefetch['proc'].poll() is None:
+            return
+
+        returncode = prefetch['proc'].returncode
+        if returncode != 0:
+            self.__abandoned_playlist_video_ids.add(playlist_video_id)
+            self.__discard(playlist_video_id, f'the prefetch process exited non-zero: {returncode}')
+            return
+
+        spool_file = self.__get_spool_file_path(playlist_video_id)
+        os.replace(spool_file + '.part', spool_file)
+        prefetch['is_complete'] = True
+        self.__remove_tmp_dirs(playlist_video_id)
+        self.__logger.info(f"Finished prefetching playlist_video_id {playlist_video_id} in " +
+            f"{round(time.time() - prefetch['start_time'], 1)}s ({os.path.getsize(spool_file)} bytes).")
+
+        if self.__video_cache.is_enabled():
+            del self.__prefetches[playlist_video_id]
+            self.__video_cache.add(prefetch['url'], self.__ytdl_video_format, spool_file)
+            if not self.__video_cache.contains(prefetch['url'], self.__ytdl_video_format):
+                self.__abandoned_playlist_video_ids.add(playlist_video_id)
+
+    # If the spool has grown too large, abandon the prefetch that is in progress.
+    def __enforce_spool_size(self):
+        spool_size_bytes = 0
+        for file_name in os.listdir(self.__SPOOL_DIR):
+            try:
+                spool_size_bytes += os.path.getsize(os.path.join(self.__SPOOL_DIR, file_name))
+            except FileNotFoundError:
+                pass
+        if spool_size_bytes <= self.__max_spool_size_bytes:
+            return
+
+        for playlist_video_id, prefetch in list(self.__prefetches.items()):
+            if not prefetch['is_complete']:
+                self.__abandoned_playlist_video_ids.add(playlist_video_id)
+                self.__discard(playlist_video_id, f'the spool size ({spool_size_bytes} bytes) exceeded the ' +
+                    f'maximum ({self.__max_spool_size_bytes} bytes)')
+
+    def __discard(self, playlist_video_id, reason):
+        self.__logger.info(f"Discarding prefetch of playlist_video_id {playlist_video_id} because {reason}.")
+        prefetch = self.__prefetches.pop(playlist_video_id)
+        if not prefetch['is_complete']:
+            try:
+                os.killpg(prefetch['pgid'], signal.SIGTERM)
+            except Exception:
+                # might raise: `ProcessLookupError: [Errno 3] No such process`
+                pass
+            prefetch['proc'].wait()
+
+        spool_file = self.__get_spool_file_path(playlist_video_id)
+        for file_path in [spool_file, spool_file + '.part']:
+            self.remove_spool_file(file_path)
+        self.__remove_tmp_dirs(playlist_video_id)
+
+    def __remove_tmp_dirs(self, playlist_video_id):
+        subprocess.check_output(
+            (f'rm -rf {shlex.quote(self.__VIDEO_TMP_DIR)}/{playlist_video_id} ' +
+                f'{shlex.quote(self.__AUDIO_TMP_DIR)}/{playlist_video_id}'),
+            shell = True, executable = '/usr/bin/bash'
+        )
+
+    # Remove any spool files left over from a previous run of the queue.
+    def __clean_up_spool(self):
+        subprocess.check_output(
+            (f'rm -rf {shlex.quote(self.__SPOOL_DIR)} {shlex.quote(self.__VIDEO_TMP_DIR)} ' +
+                f'{shlex.quote(self.__AUDIO_TMP_DIR)}'),
+            shell = True, executable = '/usr/bin/bash'
+        )
+
+    def __get_spool_file_path(self, playlist_video_id):
+        return f'{self.__SPOOL_DIR}/{playlist_video_id}.ts'
@@ -1,56 +1,145 @@
+import json
 import os
 import random
+import select
 import shlex
 import signal
 import subprocess
 import time
+import traceback
 
 from piwall2.animator import Animator
+from piwall2.broadcaster.broadcasttimings import BroadcastTimings
+from piwall2.broadcaster.broadcastworkerclient import BroadcastWorkerClient
+from piwall2.broadcaster.database import Database
+from piwall2.broadcaster.driftcontroller import DriftController
 from piwall2.broadcaster.loadingscreenhelper import LoadingScreenHelper
+from piwall2.broadcaster.playbacksamplecollector import PlaybackSampleCollector
 from piwall2.broadcaster.playlist import Playlist
+from piwall2.broadcaster.playlistmodel import PlaylistModel
+from piwall2.broadcaster.prefetcher import Prefetcher
+from piwall2.broadcaster.queuenotifier import QueueNotifier
+from piwall2.broadcaster.receiverroster import ReceiverRoster
 from piwall2.broadcaster.remote import Remote
 from piwall2.broadcaster.screensaverhelper import ScreensaverHelper
+from piwall2.broadcaster.telemetrylistener import TelemetryListener
+from piwall2.broadcaster.videobroadcaster import VideoBroadcaster
 from piwall2.config import Config
 from piwall2.configloader import ConfigLoader
 from piwall2.controlmessagehelper import ControlMessageHelper
+from piwall2.cropgeometry import CropGeometry
 from piwall2.directoryutils import DirectoryUtils
+from piwall2.displaymode import DisplayMode
 from piwall2.logger import Logger
 from piwall2.volumecontroller import VolumeController
 
 # The Queue is responsible for playing the next video in the Playlist
+#
+# The queue blocks until it is notified of a change to the state it acts on (see: QueueNotifier), remote input is
+# received, the broadcast ends, or its next timer fires. Between those, it doesn't touch the DB or amixer.
 class Queue:
 
     __TICKS_PER_SECOND = 10
-    __RECEIVER_VOLUME_SETS_PER_SECOND = 0.5
+    __WALL_STATE_SNAPSHOTS_PER_SECOND = 0.5
+    __DRIFT_CORRECTIONS_PER_SECOND = 1
+
+    # Re-read the playlist and the cached wall state this often even without notifications, in case they were
+    # changed by something that doesn't notify the queue, e.g. running amixer by hand.
+    __FALLBACK_CHECK_INTERVAL_S = 5
+
+    # Archive finished playlist items this often. If there are more than a batch's worth to archive, the next batch
+    # is archived the next time the queue wakes up. See: Playlist.archive_finished_videos
+    __PLAYLIST_ARCHIVE_INTERVAL_S = 60 * 60
+    __PLAYLIST_ARCHIVE_BATCH_SIZE = 500
 
     def __init__(self):
         self.__logger = Logger().set_namespace(self.__class__.__name__)
         self.__logger.info("Starting queue...")
+
+        # Bind the notifier's socket before reading any state, so that we don't miss changes made in the meantime.
+        self.__queue_notifier = QueueNotifier().setup_for_queue()
         self.__config_loader = ConfigLoader()
-        self.__playlist = Playlist()
+        self.__playlist = PlaylistModel()
         self.__volume_controller = VolumeController()
         self.__control_message_helper = ControlMessageHelper().setup_for_broadcaster()
         self.__last_tick_time = 0
-        self.__last_set_receiver_vol_time = 0
+        self.__last_wall_state_snapshot_time = 0
+        self.__last_drift_correction_time = 0
+        self.__last_fallback_check_time = 0
+        self.__last_playlist_archive_time = 0
+        self.__last_wall_state = None
+
+        # Whether to check the playlist for a skip request or the next item to play. See: QueueNotifier
+        self.__is_playlist_check_needed = True
+
+        # The wall state that is cached between notifications. See: QueueNotifier
+        self.__vol_pct = None
+        self.__display_mode_by_tv_id = None
+        self.__animation_mode = None
+
+        # Receivers skip applying a wall state snapshot whose version they have already applied. Start from the
+        # current time rather than zero, so that versions remain distinct across restarts of the queue process.
+        self.__wall_state_version = int(time.time() * 1000)
         self.__broadcast_proc = None
+
+        # The stream_id of the current broadcast. See: VideoBroadcaster
+        self.__stream_id = None
+
+        # A video that a broadcast handed off, which is still finishing playing on the wall. A dict with the keys:
+        # stream_id and playback_end_time. See: VideoBroadcaster.__wait_for_playback_to_end
+        self.__ending_stream = None
+        self.__is_gapless_enabled = Config.get('gapless_transitions', True)
+
+        # Becomes readable once the broadcast proc has exited: either the BroadcastWorkerClient, or a pidfd for the
+        # bin/broadcast process.
+        self.__broadcast_proc_waitable = None
         self.__playlist_item = None
         self.__is_broadcast_in_progress = False
+        self.__prefetcher = Prefetcher(self.__playlist)
+
+        # The prefetched spool file that the current broadcast is reading from, if any. See: Prefetcher
+        self.__spool_file = None
         self.__animator = Animator(self.__TICKS_PER_SECOND)
+        self.__display_mode_helper = DisplayMode()
         self.__remote = Remote(self.__TICKS_PER_SECOND)
         self.__loading_screen_helper = LoadingScreenHelper()
 
+        telemetry_listener = TelemetryListener()
+        self.__receiver_roster = ReceiverRoster().listen(telemetry_listener)
+        self.__playback_sample_collector = PlaybackSampleCollector().listen(telemetry_listener)
+        self.__broadcast_timings = BroadcastTimings().listen(telemetry_listener)
+        telemetry_listener.start()
+        self.__drift_controller = DriftController(self.__playback_sample_collector)
+
         # house keeping
+        Database().start_periodic_checkpoints()
         self.__volume_controller.set_vol_pct(50)
         self.__playlist.clean_up_state()
+        self.__validate_crop_geometry()
+
+    # Compute the whole wall's crop table once at startup, so that any misconfiguration is logged once, rather than
+    # on every video. See: CropGeometry
+    def __validate_crop_geometry(self):
+        crop_geometry = CropGeometry()
+        for video_width, video_height in CropGeometry.COMMON_VIDEO_DIMENSIONS:
+            wall_crop_table = crop_geometry.get_wall_crop_table(video_width, video_height)
+            self.__logger.info(f"Wall crop table for {video_width}x{video_height} videos: {wall_crop_table}")
 
     def run(self):
         while True:
+            self.__handle_notifications()
+            self.__maybe_forget_ending_stream()
+            is_playlist_check_needed = self.__is_playlist_check_needed
+            self.__is_playlist_check_needed = False
             if self.__is_broadcast_in_progress:
-                self.__maybe_skip_broadcast()
+                if is_playlist_check_needed:
+                    self.__maybe_skip_broadcast()
                 if self.__broadcast_proc and self.__broadcast_proc.poll() is not None:
                     self.__logger.info("Ending broadcast because broadcast proc is no longer running...")
                     self.__stop_broadcast_if_broadcasting()
-            else:
+                elif self.__playlist_item:
+                    self.__prefetcher.update()
+            elif is_playlist_check_needed:
                 next_item = self.__playlist.get_next_playlist_item()
                 if next_item:
                     self.__play_playlist_item(next_item)
@@ -58,18 +147,104 @@ class Queue:
                     self.__play_screensaver()
             self.__tick_animation_and_set_receiver_state()
             self.__remote.check_for_input_and_handle(self.__playlist_item)
+            self.__maybe_archive_playlist_history()
+
+            self.__wait_for_notification_or_timer()
+
+    # Re-read the state that changed since the last time we woke up. See: QueueNotifier
+    def __handle_notifications(self):
+        events = self.__queue_notifier.get_events()
+        is_fallback_check_due = (time.time() - self.__last_fallback_check_time) >= self.__FALLBACK_CHECK_INTERVAL_S
+        if is_fallback_check_due:
+            self.__last_fallback_check_time = time.time()
+
+        if any(event in QueueNotifier.PLAYLIST_EVENTS for event in events):
+            self.__playlist.refresh()
+            self.__is_playlist_check_needed = True
+        elif is_fallback_check_due and self.__playlist.refresh_if_changed():
+            self.__is_playlist_check_needed = True
+        if is_fallback_check_due or QueueNotifier.EVENT_VOLUME in events:
+            self.__vol_pct = self.__volume_controller.get_vol_pct()
+        if is_fallback_check_due or QueueNotifier.EVENT_DISPLAY_MODE in events:
+            self.__display_mode_by_tv_id = self.__display_mode_helper.get_display_mode_by_tv_id()
+        if is_fallback_check_due or QueueNotifier.EVENT_ANIMATION_MODE in events:
+            self.__animation_mode = self.__animator.get_animation_mode(use_pseudo_animation_mode = False)
+
+    # Once the handed off video has finished playing, a playlist item that was waiting for it may start.
+    # See: __play_playlist_item
+    def __maybe_forget_ending_stream(self):
+        if self.__ending_stream and time.time() >= self.__ending_stream['playback_end_time']:
+            self.__ending_stream = None
+            self.__is_playlist_check_needed = True
+
+    def __maybe_archive_playlist_history(self):
+        if (time.time() - self.__last_playlist_archive_time) < self.__PLAYLIST_ARCHIVE_INTERVAL_S:
+            return
+
+        try:
+            num_archived = self.__playlist.archive_finished_videos(self.__PLAYLIST_ARCHIVE_BATCH_SIZE)
+        except Exception:
+            self.__logger.warning(f"Unable to archive finished playlist items: {traceback.format_exc()}")
+            self.__last_playlist_archive_time = time.time()
+            return
 
-            time.sleep(0.050)
+        if num_archived > 0:
+            self.__logger.info(f"Archived {num_archived} finished playlist items.")
+        if num_archived < self.__PLAYLIST_ARCHIVE_BATCH_SIZE:
+            self.__last_playlist_archive_time = time.time()
 
+    # Block until we are notified of a change, remote input is received, the broadcast ends, or the next timer fires.
+    def __wait_for_notification_or_timer(self):
+        if self.__is_playlist_check_needed:
+            return
+
+        next_timer_time = min(
+            self.__last_wall_state_snapshot_time + 1 / self.__WALL_STATE_SNAPSHOTS_PER_SECOND,
+            self.__last_fallback_check_time + self.__FALLBACK_CHECK_INTERVAL_S
+        )
+        if self.__animation_mode != Animator.ANIMATION_MODE_NONE:
+            next_timer_time = min(next_timer_time, self.__last_tick_time + 1 / self.__TICKS_PER_SECOND)
+        if self.__is_broadcast_in_progress:
+            # The prefetcher updates at the same rate as drift corrections. See: Prefetcher.update
+            next_timer_time = min(
+                next_timer_time, self.__last_drift_correction_time + 1 / self.__DRIFT_CORRECTIONS_PER_SECOND
+            )
+        if self.__ending_stream:
+            next_timer_time = min(next_timer_time, self.__ending_stream['playback_end_time'])
+
+        waitables = [self.__queue_notifier]
+        if self.__remote.get_socket() is not None:
+            waitables.append(self.__remote.get_socket())
+        if self.__broadcast_proc_waitable is not None:
+            waitables.append(self.__broadcast_proc_waitable)
+        select.select(waitables, [], [], max(0, next_timer_time - time.time()))
+
+    """
+    If the previous video is still finishing playing, we switch to the playlist item gaplessly, but only if it can
+    start right away. Otherwise, the previous video finishes playing first, and then we show the loading screen while
+    the playlist item starts, as usual. Screensavers are local files, so they can always start right away.
+    """
     def __play_playlist_item(self, playlist_item):
+        if self.__ending_stream and not self.__prefetcher.is_prefetched(playlist_item):
+            self.__logger.info("Waiting for the previous video to finish playing before starting playlist_video_id " +
+                f"{playlist_item['playlist_video_id']}, because it has not been prefetched.")
+            return
+
         if not self.__playlist.set_current_video(playlist_item["playlist_video_id"]):
             # Someone deleted the item from the queue in between getting the item and starting it.
+            self.__is_playlist_check_needed = True
             return
         log_uuid = Logger.make_uuid()
         Logger.set_uuid(log_uuid)
+        self.__broadcast_timings.record(log_uuid, BroadcastTimings.STAGE_DEQUEUE)
         self.__logger.info(f"Starting broadcast for playlist_video_id: {playlist_item['playlist_video_id']}")
-        self.__loading_screen_helper.send_loading_screen_signal(log_uuid)
-        self.__do_broadcast(playlist_item['url'], log_uuid)
+        if not self.__ending_stream:
+            self.__loading_screen_helper.send_loading_screen_signal(log_uuid)
+        self.__spool_file = self.__prefetcher.claim_spool_file(playlist_item)
+        if self.__spool_file:
+            self.__do_broadcast(self.__spool_file, log_uuid)
+        else:
+            self.__do_broadcast(playlist_item['url'], log_uuid)
         self.__playlist_item = playlist_item
 
     def __play_screensaver(self):
@@ -98,16 +273,38 @@ class Queue:
             screensaver_video_path = screensaver_data['video_path']
 
         self.__logger.info("Starting broadcast of screensaver...")
+        self.__broadcast_timings.record(log_uuid, BroadcastTimings.STAGE_DEQUEUE)
         self.__do_broadcast(screensaver_video_path, log_uuid)
 
+    # The broadcast is started via the broadcast worker if it is running, otherwise via bin/broadcast. Either way,
+    # self.__broadcast_proc provides the same interface. See: BroadcastWorkerClient
     def __do_broadcast(self, url, log_uuid):
-        cmd = (f"{DirectoryUtils().root_dir}/bin/broadcast --url {shlex.quote(url)} " +
-            f"--log-uuid {shlex.quote(log_uuid)} --no-show-loading-screen --use-extractors youtube")
-        # Using start_new_session = False here because it is not necessary to start a new session here (though
-        # it should not hurt if we were to set it to True either)
-        self.__broadcast_proc = subprocess.Popen(
-            cmd, shell = True, executable = '/usr/bin/bash', start_new_session = False
-        )
+        self.__stream_id = random.getrandbits(31)
+        switch_time = None
+        if self.__ending_stream:
+            switch_time = self.__ending_stream['playback_end_time']
+
+        broadcast_worker_client = BroadcastWorkerClient()
+        if broadcast_worker_client.start(
+            url, log_uuid, show_loading_screen = False, yt_dlp_extractors = 'youtube', stream_id = self.__stream_id,
+            switch_time = switch_time, is_handoff_enabled = self.__is_gapless_enabled
+        ):
+            self.__broadcast_proc = broadcast_worker_client
+            self.__broadcast_proc_waitable = broadcast_worker_client
+        else:
+            cmd = (f"{DirectoryUtils().root_dir}/bin/broadcast --url {shlex.quote(url)} " +
+                f"--log-uuid {shlex.quote(log_uuid)} --no-show-loading-screen --use-extractors youtube " +
+                f"--stream-id {self.__stream_id}")
+            if switch_time is not None:
+                cmd += f" --switch-time {switch_time}"
+            if self.__is_gapless_enabled:
+                cmd += " --handoff"
+            # Using start_new_session = False here because it is not necessary to start a new session here (though
+            # it should not hurt if we were to set it to True either)
+            self.__broadcast_proc = subprocess.Popen(
+                cmd, shell = True, executable = '/usr/bin/bash', start_new_session = False
+            )
+            self.__broadcast_proc_waitable = os.pidfd_open(self.__broadcast_proc.pid)
         self.__is_broadcast_in_progress = True
 
     def __maybe_skip_broadcast(self):
@@ -121,6 +318,7 @@ class Queue:
                 should_skip = self.__playlist.should_skip_video_id(self.__playlist_item['playlist_video_id'])
             except Exception as e:
                 self.__logger.info(f"Caught exception: {e}.")
+                self.__is_playlist_check_needed = True # Try again.
         elif self.__is_screensaver_broadcast_in_progress():
             should_skip = self.__playlist.get_next_playlist_item() is not None
 
@@ -141,7 +339,7 @@ class Queue:
             self.__logger.info("Killing broadcast proc (if it's still running)...")
             was_killed = True
             try:
-                os.kill(self.__broadcast_proc.pid, signal.SIGTERM)
+                self.__broadcast_proc.terminate()
             except Exception:
                 # might raise: `ProcessLookupError: [Errno 3] No such process`
                 was_killed = False
@@ -152,7 +350,16 @@ class Queue:
                 else:
                     self.__logger.error(f'Got non-zero exit_status for broadcast proc: {exit_status}')
 
-        self.__control_message_helper.send_msg(ControlMessageHelper.TYPE_SKIP_VIDEO, {})
+        handed_off_stream = self.__get_handed_off_stream()
+        if handed_off_stream and not was_skipped and handed_off_stream['playback_end_time'] > time.time():
+            # Leave the video playing. The next broadcast will switch to its video once this one is over.
+            self.__ending_stream = handed_off_stream
+            self.__logger.info("Broadcast handed off. Video playback will be over in " +
+                f"{round(handed_off_stream['playback_end_time'] - time.time(), 3)}s.")
+        else:
+            self.__control_message_helper.send_msg(
+                ControlMessageHelper.TYPE_SKIP_VIDEO, {'stream_id': self.__stream_id}
+            )
 
         if self.__playlist_item:
             if self.__should_reenqueue_current_playlist_item(was_skipped):
@@ -160,12 +367,37 @@ class Queue:
             else:
                 self.__playlist.end_video(self.__playlist_item["playlist_video_id"])
 
+        if self.__spool_file:
+            self.__prefetcher.remove_spool_file(self.__spool_file)
+            self.__spool_file = None
+
+        if isinstance(self.__broadcast_proc_waitable, int):
+            os.close(self.__broadcast_proc_waitable)
+        self.__broadcast_proc_waitable = None
+
         self.__logger.info("Ended video broadcast.")
         Logger.set_uuid('')
         self.__broadcast_proc = None
+        self.__stream_id = None
+        self.__is_playlist_check_needed = True
         self.__playlist_item = None
         self.__is_broadcast_in_progress = False
 
+    # Returns the stream that the current broadcast handed off, or None if it didn't hand off.
+    # See: VideoBroadcaster.ENDING_STREAM_FILE
+    def __get_handed_off_stream(self):
+        try:
+            with open(VideoBroadcaster.ENDING_STREAM_FILE) as stream_file:
+                stream = json.loads(stream_file.read())
+            os.remove(VideoBroadcaster.ENDING_STREAM_FILE)
+        except Exception:
+            # The file won't exist unless the broadcast handed off.
+            return None
+
+        if stream['stream_id'] != self.__stream_id:
+            return None
+        return stream
+
     """
     Starting a channel video causes the currently playing video to immediately be skipped. Playing a lot of channel
     videos in quick succession could therefore cause the playlist queue to become depleted without the videos even
@@ -193,18 +425,53 @@ class Queue:
     # Possible failure scenarios:
     # 1) A UDP packet was dropped, so a receiver missed setting some state adjustment. This seems unlikely given that
     #   we tuned everything to minimize UDP packet loss (very important for a successful video broadcast).
-    # 2) We ignored setting state the first time due to throttling to avoid being overwhelmed with user state modification.
-    #   See: OmxplayerController.__MAX_IN_FLIGHT_PROCS
-    # 3) A receiver process was restarted and thus lost its state.
+    # 2) A receiver failed to set state the first time, e.g. because its dbus connection to omxplayer was lost.
+    #   See: OmxplayerController.__call_method
+    # 3) A receiver process was restarted and thus lost its state, possibly including the fact that a video is playing.
     def __tick_animation_and_set_receiver_state(self):
         now = time.time()
-        if (now - self.__last_tick_time) > (1 / self.__TICKS_PER_SECOND):
+        if (
+            self.__animation_mode != Animator.ANIMATION_MODE_NONE and
+            (now - self.__last_tick_time) >= (1 / self.__TICKS_PER_SECOND)
+        ):
             # sets the display_mode of the TVs
-            self.__animator.tick()
+            self.__animator.tick(self.__animation_mode)
             self.__last_tick_time = now
 
-        # maybe set volume
-        if (now - self.__last_set_receiver_vol_time) > (1 / self.__RECEIVER_VOLUME_SETS_PER_SECOND):
-            vol_pct = self.__volume_controller.get_vol_pct()
-            self.__control_message_helper.send_msg(ControlMessageHelper.TYPE_VOLUME, vol_pct)
-            self.__last_set_receiver_vol_time = now
+        if (now - self.__last_wall_state_snapshot_time) >= (1 / self.__WALL_STATE_SNAPSHOTS_PER_SECOND):
+            self.__send_wall_state_snapshot()
+            self.__last_wall_state_snapshot_time = now
+
+        if (now - self.__last_drift_correction_time) >= (1 / self.__DRIFT_CORRECTIONS_PER_SECOND):
+            stream = self.__get_current_stream()
+            if stream:
+                self.__drift_controller.correct_drift(stream['stream_id'])
+            self.__last_drift_correction_time = now
+
+    # Send all of the wall's state in a single control message. The version is only incremented when the state
+    # changes, which allows receivers to cheaply ignore snapshots they have already applied.
+    def __send_wall_state_snapshot(self):
+        wall_state = {
+            'vol_pct': self.__vol_pct,
+            'display_mode_by_tv_id': self.__display_mode_by_tv_id,
+            'animation_mode': self.__animation_mode,
+            'stream': self.__get_current_stream(),
+        }
+        if wall_state != self.__last_wall_state:
+            self.__wall_state_version += 1
+            self.__last_wall_state = wall_state
+
+        msg = {**wall_state, 'version': self.__wall_state_version}
+        self.__control_message_helper.send_msg(ControlMessageHelper.TYPE_WALL_STATE, msg)
+
+    # Returns the parameters of the stream that is currently being broadcast, or None if nothing is being broadcast.
+    def __get_current_stream(self):
+        if not self.__is_broadcast_in_progress:
+            return None
+
+        try:
+            with open(VideoBroadcaster.CURRENT_STREAM_FILE) as stream_file:
+                return json.loads(stream_file.read())
+        except Exception:
+            # The file won't exist until the broadcast process has sent the INIT_VIDEO control message.
+            return None
@@ -0,0 +1,72 @@
+import os
+import socket
+
+from piwall2.logger import Logger
+
+"""
+Notifies the queue process of changes to the state it acts on, so that the queue can block until something changes,
+rather than polling the DB and amixer. See: Queue.run
+
+Writers, e.g. the server process, send a datagram on a unix socket naming the kind of change. The queue binds the
+socket, includes it in its `select` call, and drains it each time it wakes up. Notifications carry no state: the
+queue re-reads whatever changed. Thus it's fine to coalesce them, and a notification that can't be sent, e.g.
+because the queue isn't running or its socket buffer is full, is simply dropped: the queue reads all of the state
+when it starts, and a full buffer means it already has a wake up pending.
+"""
+class QueueNotifier:
+
+    SOCKET_PATH = '/tmp/piwall2_queue_notifier.sock'
+
+    # Changes to the playlist queue. See: Playlist
+    EVENT_ENQUEUE = 'enqueue'
+    EVENT_SKIP = 'skip'
+    EVENT_REMOVE = 'remove'
+    EVENT_CLEAR = 'clear'
+    EVENT_PLAY_NEXT = 'play_next'
+    PLAYLIST_EVENTS = (EVENT_ENQUEUE, EVENT_SKIP, EVENT_REMOVE, EVENT_CLEAR, EVENT_PLAY_NEXT)
+
+    # Changes to the wall's state. See: VolumeController, DisplayMode, Animator
+    EVENT_VOLUME = 'volume'
+    EVENT_DISPLAY_MODE = 'display_mode'
+    EVENT_ANIMATION_MODE = 'animation_mode'
+
+    __MAX_EVENT_SIZE_BYTES = 64
+
+    def __init__(self):
+        self.__logger = Logger().set_namespace(self.__class__.__name__)
+        self.__socket = None
+
+    # Binds the socket that notifications are sent to. Only the queue process should call this.
+    def setup_for_queue(self):
+        try:
+            os.remove(self.SOCKET_PATH)
+        except FileNotFoundError:
+            pass
+        self.__socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.__socket.bind(self.SOCKET_PATH)
+        self.__socket.setblocking(False)
+        return self
+
+    # Allows passing the notifier to `select`.
+    def fileno(self):
+        return self.__socket.fileno()
+
+    # Returns the set of events that were received since the last call, without blocking.
+    def get_events(self):
+        events = set()
+        while True:
+            try:
+                events.add(self.__socket.recv(self.__MAX_EVENT_SIZE_BYTES).decode())
+            except BlockingIOError:
+                return events
+
+    @staticmethod
+    def notify(event):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            sock.setblocking(False)
+            sock.sendto(event.encode(), QueueNotifier.SOCKET_PATH)
+        except (FileNotFoundError, ConnectionRefusedError, BlockingIOError):
+            pass
+        finally:
+            sock.close()
@@ -0,0 +1,212 @@
+import re
+import threading
+import time
+import urllib.request
+
+from piwall2.logger import Logger
+
+"""
+Downloads a media URL over several HTTP connections at once, and writes the bytes to an output file in order. See:
+bin/ranged_download
+
+yt-dlp and curl download each format as one long HTTP stream. When that connection is reset, which happens from
+time to time on long videos, the stream stalls until the download reconnects. Instead, we split the file into
+ranges and fetch them via HTTP range requests over several connections. The ranges are handed out in file order, so
+the start of the file is filled first, and at most `max_buffered_ranges` ranges are downloaded ahead of the range
+that is next to be written. A range whose request fails is retried on its own, resuming from the last byte it
+received, while the other connections keep downloading the ranges after it.
+
+The first range is small, and doubles as the probe for the file's size: its response's Content-Range header tells
+us the total size. Its bytes are written as soon as they arrive, to keep the time to first byte low. If the server
+doesn't support range requests, i.e. it responds with the whole file, we download the file over that one connection.
+"""
+class RangedDownloader:
+
+    __CONTENT_RANGE_REGEX = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+    __READ_SIZE_BYTES = 64 * 1024
+
+    __TIMEOUT_S = 10
+
+    # Retries back off linearly up to the max delay.
+    __RETRY_DELAY_S = 1
+    __MAX_RETRY_DELAY_S = 5
+
+    # headers: dict of HTTP headers to send with each request, e.g. a format's `http_headers` returned by
+    #   YtDlpResolverClient.resolve
+    def __init__(
+        self, url, headers = None, num_connections = 4, range_size_bytes = 2 * 1024 * 1024,
+        first_range_size_bytes = 256 * 1024, max_buffered_ranges = 16, max_attempts_per_range = 10
+    ):
+        # Don't log to stdout: the downloaded bytes are usually written to stdout.
+        self.__logger = Logger(dont_log_to_stdout = True).set_namespace(self.__class__.__name__)
+        self.__url = url
+        self.__headers = headers or {}
+        self.__num_connections = max(1, num_connections)
+        self.__range_size_bytes = range_size_bytes
+        self.__first_range_size_bytes = first_range_size_bytes
+        self.__max_buffered_ranges = max(1, max_buffered_ranges)
+        self.__max_attempts_per_range = max_attempts_per_range
+
+        self.__ranges = []
+        self.__next_range_to_fetch = 0
+        self.__next_range_to_write = 0
+        self.__downloaded_ranges = {}
+        self.__error = None
+        self.__is_done = False
+        self.__lock = threading.Condition()
+
+    # Downloads the file and writes it to out_file, a binary file object. Returns the number of bytes written.
+    def download(self, out_file):
+        start_time = time.time()
+        response = self.__open_with_retries(0, self.__first_range_size_bytes - 1)
+        total_size = self.__get_total_size(response, 0)
+        if total_size is None:
+            self.__logger.info(f"Server does not support range requests (HTTP status: {response.status}). " +
+                "Downloading over a single connection...")
+            num_bytes_written = self.__read_response(response, out_file.write)
+            response.close()
+            out_file.flush()
+            content_length = response.headers.get('Content-Length')
+            if content_length is not None and num_bytes_written < int(content_length):
+                raise Exception(f"Response ended early at byte {num_bytes_written} of {content_length}.")
+            return num_bytes_written
+
+        first_range_end = min(self.__first_range_size_bytes, total_size) - 1
+        for range_start in range(first_range_end + 1, total_size, self.__range_size_bytes):
+            self.__ranges.append((range_start, min(range_start + self.__range_size_bytes, total_size) - 1))
+        self.__logger.info(f"Downloading {total_size} bytes in {len(self.__ranges) + 1} ranges over " +
+            f"{self.__num_connections} connections...")
+
+        for i in range(min(self.__num_connections, len(self.__ranges))):
+            threading.Thread(target = self.__fetch_ranges, daemon = True).start()
+
+        try:
+            num_bytes_written = self.__read_response(response, out_file.write)
+            response.close()
+            if num_bytes_written < first_range_end + 1:
+                # The first range's response ended early. Resume it from where it stopped.
+                self.__fetch_range(num_bytes_written, first_range_end, out_file.write)
+            out_file.flush()
+
+            for i in range(len(self.__ranges)):
+                data = self.__get_downloaded_range(i)
+                out_file.write(data)
+                out_file.flush()
+        finally:
+            with self.__lock:
+                self.__is_done = True
+                self.__lock.notify_all()
+
+        self.__logger.info(f"Downloaded {total_size} bytes in {round(time.time() - start_time, 3)}s.")
+        return total_size
+
+    # Runs in each connection's thread.
+    def __fetch_ranges(self):
+        while True:
+            with self.__lock:
+                while (
+                    not self.__is_done and self.__error is None and
+                    self.__next_range_to_fetch >= self.__next_range_to_write + self.__max_buffered_ranges
+                ):
+                    self.__lock.wait()
+                if self.__is_done or self.__error is not None or self.__next_range_to_fetch >= len(self.__ranges):
+                    return
+                index = self.__next_range_to_fetch
+                self.__next_range_to_fetch += 1
+
+            range_start, range_end = self.__ranges[index]
+            data = bytearray()
+            try:
+                self.__fetch_range(range_start, range_end, data.extend)
+            except Exception as e:
+                with self.__lock:
+                    self.__error = e
+                    self.__lock.notify_all()
+                return
+
+            with self.__lock:
+                self.__downloaded_ranges[index] = data
+                self.__lock.notify_all()
+
+    # Blocks until the range has been downloaded, and returns its bytes.
+    def __get_downloaded_range(self, index):
+        with self.__lock:
+            while index not in self.__downloaded_ranges:
+                if self.__error is not None:
+                    raise self.__error
+                self.__lock.wait()
+            data = self.__downloaded_ranges.pop(index)
+            self.__next_range_to_write = index + 1
+            self.__lock.notify_all()
+            return data
+
+    # Fetches the inclusive byte range, passing its bytes to on_data as they arrive. If the request fails, retry,
+    # resuming from the last byte received.
+    def __fetch_range(self, range_start, range_end, on_data):
+        offset = range_start
+        attempt = 1
+        while True:
+            try:
+                response = self.__open(offset, range_end)
+                if self.__get_total_size(response, offset) is None:
+                    raise Exception(f"Unexpected response to range request (HTTP status: {response.status})")
+                offset += self.__read_response(response, on_data, range_end - offset + 1)
+                response.close()
+                if offset > range_end:
+                    return
+                raise Exception(f"Response ended early at byte {offset}")
+            except Exception as e:
+                if attempt >= self.__max_attempts_per_range:
+                    raise Exception(f"Giving up on range {range_start}-{range_end} after {attempt} attempts: {e}")
+                self.__logger.warning(f"Error downloading range {range_start}-{range_end} at byte {offset} " +
+                    f"(attempt {attempt} of {self.__max_attempts_per_range}): {e}. Retrying...")
+                time.sleep(min(self.__RETRY_DELAY_S * attempt, self.__MAX_RETRY_DELAY_S))
+                attempt += 1
+
+    def __open_with_retries(self, range_start, range_end):
+        attempt = 1
+        while True:
+            try:
+                return self.__open(range_start, range_end)
+            except Exception as e:
+                if attempt >= self.__max_attempts_per_range:
+                    raise
+                self.__logger.warning(f"Error requesting {self.__url} (attempt {attempt} of " +
+                    f"{self.__max_attempts_per_range}): {e}. Retrying...")
+                time.sleep(min(self.__RETRY_DELAY_S * attempt, self.__MAX_RETRY_DELAY_S))
+                attempt += 1
+
+    def __open(self, range_start, range_end):
+        headers = dict(self.__headers)
+        headers['Range'] = f'bytes={range_start}-{range_end}'
+        request = urllib.request.Request(self.__url, headers = headers)
+        return urllib.request.urlopen(request, timeout = self.__TIMEOUT_S)
+
+    # Returns the file's total size if the response is a partial response starting at the expected offset.
+    # Otherwise returns None.
+    def __get_total_size(self, response, expected_range_start):
+        if response.status != 206:
+            return None
+        match = self.__CONTENT_RANGE_REGEX.match(response.headers.get('Content-Range', ''))
+        if not match or int(match.group(1)) != expected_range_start:
+            return None
+        return int(match.group(3))
+
+    # Passes the response's bytes to on_data, reading at most max_bytes. Returns the number of bytes read.
+    def __read_response(self, response, on_data, max_bytes = None):
+        num_bytes_read = 0
+        while max_bytes is None or num_bytes_read < max_bytes:
+            read_size = self.__READ_SIZE_BYTES
+            if max_bytes is not None:
+                read_size = min(read_size, max_bytes - num_bytes_read)
+            try:
+                data = response.read(read_size)
+            except Exception:
+                # Keep the bytes read so far. The caller resumes from there.
+                break
+            if not data:
+                break
+            on_data(data)
+            num_bytes_read += len(data)
+        return num_bytes_read
@@ -0,0 +1,113 @@
+import json
+import os
+import time
+import traceback
+
+from piwall2.configloader import ConfigLoader
+from piwall2.logger import Logger
+from piwall2.telemetryhelper import TelemetryHelper
+
+# Keeps a roster of which receivers are live, based on the heartbeats they send. See: Heartbeat
+#
+# The roster is maintained in the queue process, from heartbeats dispatched by the TelemetryListener. It is
+# periodically written to a file, so that other processes on the broadcaster (e.g. LoadingScreenHelper via CmdRunner)
+# can skip receivers that are down, rather than waiting for their ssh connections to time out.
+class ReceiverRoster:
+
+    ROSTER_FILE = '/tmp/piwall2_receiver_roster.json'
+
+    # A receiver is considered live if we have received a heartbeat from it within this many seconds.
+    RECEIVER_TTL_S = 10
+
+    # If the roster file has not been updated within this many seconds, the roster is not being maintained (e.g. the
+    # queue process is stopped). In that case, we don't know which receivers are live.
+    ROSTER_TTL_S = 10
+
+    __WRITES_PER_SECOND = 0.5
+
+    def __init__(self):
+        self.__logger = Logger().set_namespace(self.__class__.__name__)
+
+    # Registers the roster's handlers with the listener. This should only be called in the queue process.
+    def listen(self, telemetry_listener):
+        self.__config_loader = ConfigLoader()
+        self.__receivers = self.__config_loader.get_receivers_list()
+        self.__config_hash = self.__config_loader.get_config_hash()
+
+        # dict keyed by receiver name, as it appears in the receivers config.
+        self.__roster = {}
+        self.__last_write_time = 0
+        (telemetry_listener
+            .add_handler(TelemetryHelper.TYPE_HEARTBEAT, self.__handle_heartbeat)
+            .add_tick_handler(self.__maybe_write_roster_file))
+        return self
+
+    # Returns a list of the receivers that have sent a heartbeat recently, in the same order as
+    # ConfigLoader.get_receivers_list. Returns None if it is unknown which receivers are live, because the
+    # roster is stale or does not exist.
+    def get_live_receivers(self):
+        try:
+            with open(self.ROSTER_FILE) as roster_file:
+                roster_data = json.loads(roster_file.read())
+        except FileNotFoundError:
+            return None
+        except Exception:
+            self.__logger.warning('Unable to read receiver roster: {}'.format(traceback.format_exc()))
+            return None
+
+        now = time.time()
+        if (now - roster_data['updated_at']) > self.ROSTER_TTL_S:
+            return None
+
+        live_receivers = []
+        for receiver in ConfigLoader().get_receivers_list():
+            if receiver not in roster_data['receivers']:
+                continue
+            if (now - roster_data['receivers'][receiver]['last_seen']) <= self.RECEIVER_TTL_S:
+                live_receivers.append(receiver)
+        return live_receivers
+
+    def __handle_heartbeat(self, heartbeat, receive_time):
+        receiver = heartbeat['receiver']
+        if receiver not in self.__receivers:
+            self.__logger.warning(f"Got heartbeat from unknown receiver: {heartbeat}.")
+            return
+
+        previous_heartbeat = self.__roster.get(receiver)
+        if previous_heartbeat is None or (receive_time - previous_heartbeat['last_seen']) > self.RECEIVER_TTL_S:
+            self.__logger.info(f"Receiver is live: {heartbeat}.")
+        if (
+            heartbeat['config_hash'] != self.__config_hash and
+            (previous_heartbeat is None or previous_heartbeat['config_hash'] != heartbeat['config_hash'])
+        ):
+            self.__logger.warning(f"Receiver {receiver} has a different config than the broadcaster. Its config " +
+                f"hash is {heartbeat['config_hash']}, but the broadcaster's config hash is {self.__config_hash}. " +
+                "Run utils/copy_config_to_receivers to fix this.")
+
+        self.__roster[receiver] = {**heartbeat, 'last_seen': receive_time}
+
+    def __maybe_write_roster_file(self):
+        if (time.time() - self.__last_write_time) < (1 / self.__WRITES_PER_SECOND):
+            return
+        self.__write_roster_file()
+        self.__last_write_time = time.time()
+
+    # Write to a temporary file and rename it, so that readers never see a partially written roster.
+    def __write_roster_file(self):
+        now = time.time()
+        for receiver, heartbeat in self.__roster.items():
+            if (
+                (now - heartbeat['last_seen']) > self.RECEIVER_TTL_S and
+                (self.__last_write_time - heartbeat['last_seen']) <= self.RECEIVER_TTL_S
+            ):
+                self.__logger.warning(f"Receiver has not sent a heartbeat in over {self.RECEIVER_TTL_S} seconds: " +
+                    f"{receiver}.")
+
+        roster_data = {
+            'updated_at': now,
+            'receivers': self.__roster,
+        }
+        tmp_file_path = self.ROSTER_FILE + '.tmp'
+        with open(tmp_file_path, 'w') as roster_file:
+            roster_file.write(json.dumps(roster_data))
+        os.replace(tmp_file_path, self.ROSTER_FILE)
@@ -96,6 +96,12 @@ class Remote:
             # a fixed width protocol is not used, so we have to check for the presence of the expected line
             # ending character (newline).
             raw_data = self.__socket.recv(128)
+            if not raw_data:
+                # LIRC closed the connection. Otherwise the socket would remain readable, and the queue, which waits
+                # for the socket to be readable, would never block.
+                self.__logger.warning("LIRC remote socket was closed. Disabling remote input.")
+                self.__is_remote_enabled = False
+                return
             data += raw_data
             self.__logger.debug(f"Received remote data ({len(raw_data)}): {raw_data}")
             if raw_data != data:
@@ -155,6 +161,12 @@ class Remote:
             if (time.time() - start_time) > ((1 / self.__ticks_per_second) / 2):
                 return
 
+    # Returns the LIRC socket, so that the queue can wait for remote input. Returns None if the remote is not enabled.
+    def get_socket(self):
+        if not self.__is_remote_enabled:
+            return None
+        return self.__socket
+
     def increment_channel(self):
         if len(Remote.__channel_videos) <= 0:
             return
@@ -64,6 +64,15 @@ class Piwall2Api():
         response_details['success'] = True
         return response_details
 
+    # post_data is a dict with the keys: videos, a list of dicts with the same keys as `enqueue`'s post_data, and
+    # optionally shuffle, whether to enqueue the videos in a random order.
+    def enqueue_bulk(self, post_data):
+        num_enqueued = self.__playlist.enqueue_many(post_data['videos'], post_data.get('shuffle', False))
+        return {
+            'num_enqueued': num_enqueued,
+            'success': True,
+        }
+
     def skip(self, post_data):
         success = self.__playlist.skip(post_data['playlist_video_id'])
         return {'success': success}
@@ -192,6 +201,8 @@ class ServerRequestHandler(http.server.BaseHTTPRequestHandler):
 
         if path == 'queue':
             response = self.__api.enqueue(post_data)
+        elif path == 'queue/bulk':
+            response = self.__api.enqueue_bulk(post_data)
         elif path == 'skip':
             response = self.__api.skip(post_data)
         elif path == 'remove':
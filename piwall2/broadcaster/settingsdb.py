@@ -1,5 +1,6 @@
 import piwall2.broadcaster.database
 import piwall2.displaymode
+from piwall2.broadcaster.databasewriter import DatabaseWriter
 from piwall2.configloader import ConfigLoader
 from piwall2.logger import Logger
 
@@ -38,12 +39,12 @@ class SettingsDb:
             )""")
 
     def set(self, key, value):
-        self.__cursor.execute(
+        rowcount = DatabaseWriter.write(lambda cursor: cursor.execute(
             ("INSERT INTO settings (key, value, update_date) VALUES(?, ?, datetime()) ON CONFLICT(key) DO " +
                 "UPDATE SET value=excluded.value, update_date=excluded.update_date"),
             [key, value]
-        )
-        return self.__cursor.rowcount == 1
+        ).rowcount)
+        return rowcount == 1
 
     # returns boolean success
     def set_multi(self, kv_dict):
@@ -57,12 +58,12 @@ class SettingsDb:
             params.extend([key, value])
         placeholders = placeholders.rstrip(',')
 
-        self.__cursor.execute(
+        rowcount = DatabaseWriter.write(lambda cursor: cursor.execute(
             (f"INSERT INTO settings (key, value, update_date) VALUES {placeholders} ON CONFLICT(key) DO " +
                 "UPDATE SET value=excluded.value, update_date=excluded.update_date"),
             params
-        )
-        return self.__cursor.rowcount == len(kv_dict)
+        ).rowcount)
+        return rowcount == len(kv_dict)
 
     # TODO: use RETURNING clause if we have a recent version of sqlite that supports it (>= 3.35.0)
     # https://www.sqlite.org/lang_returning.html
@@ -74,11 +75,11 @@ class SettingsDb:
             params.append(key)
         placeholders = placeholders.rstrip(',') + ')'
 
-        self.__cursor.execute(
+        rowcount = DatabaseWriter.write(lambda cursor: cursor.execute(
             (f"UPDATE settings SET value = CASE WHEN value = ? THEN ? ELSE ? END WHERE key IN {placeholders}"),
             params
-        )
-        return self.__cursor.rowcount == len(key_list)
+        ).rowcount)
+        return rowcount == len(key_list)
 
     def get(self, key, default = None):
         self.__cursor.execute(
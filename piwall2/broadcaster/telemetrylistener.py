@@ -0,0 +1,61 @@
+import socket
+import threading
+import time
+import traceback
+
+from piwall2.logger import Logger
+from piwall2.telemetryhelper import TelemetryHelper
+
+# Listens for telemetry messages from the receivers in a daemon thread, and dispatches each message to the
+# handler registered for its type. See: TelemetryHelper
+class TelemetryListener:
+
+    # Tick handlers are called at least this often, even if no telemetry messages are received.
+    __TICK_INTERVAL_S = 0.5
+
+    def __init__(self):
+        self.__logger = Logger().set_namespace(self.__class__.__name__)
+        self.__handlers = {}
+        self.__tick_handlers = []
+
+    # handler: a function that takes two arguments: the message content, and the time the message was received.
+    def add_handler(self, msg_type, handler):
+        self.__handlers[msg_type] = handler
+        return self
+
+    # handler: a function that takes no arguments. It is called periodically from the listener thread.
+    def add_tick_handler(self, handler):
+        self.__tick_handlers.append(handler)
+        return self
+
+    # Use a daemon thread, so that the listener does not prevent the process from exiting.
+    def start(self):
+        self.__telemetry_helper = TelemetryHelper().setup_for_broadcaster().set_receive_timeout(self.__TICK_INTERVAL_S)
+        self.__last_tick_time = 0
+        thread = threading.Thread(target = self.__run, daemon = True)
+        thread.start()
+        return self
+
+    def __run(self):
+        while True:
+            try:
+                self.__receive_and_dispatch()
+            except socket.timeout:
+                pass
+            except Exception:
+                self.__logger.error('Caught exception: {}'.format(traceback.format_exc()))
+
+            if (time.time() - self.__last_tick_time) >= self.__TICK_INTERVAL_S:
+                for tick_handler in self.__tick_handlers:
+                    try:
+                        tick_handler()
+                    except Exception:
+                        self.__logger.error('Caught exception: {}'.format(traceback.format_exc()))
+                self.__last_tick_time = time.time()
+
+    def __receive_and_dispatch(self):
+        msg = self.__telemetry_helper.receive_msg()
+        receive_time = time.time()
+        handler = self.__handlers.get(msg[TelemetryHelper.MSG_TYPE_KEY])
+        if handler is not None:
+            handler(msg[TelemetryHelper.CONTENT_KEY], receive_time)
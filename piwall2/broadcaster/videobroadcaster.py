@@ -1,20 +1,30 @@
+import json
 import os
+import random
 import shlex
 import signal
+import socket
 import subprocess
 import sys
-import tempfile
 import time
 import traceback
 
+from piwall2.broadcaster.broadcasttimings import BroadcastTimings
+from piwall2.broadcaster.downloadcommandbuilder import DownloadCommandBuilder
 from piwall2.broadcaster.loadingscreenhelper import LoadingScreenHelper
+from piwall2.broadcaster.pcrpacer import PcrPacer
+from piwall2.broadcaster.receiverroster import ReceiverRoster
+from piwall2.broadcaster.videocache import VideoCache
+from piwall2.broadcaster.videodimensionsparser import VideoDimensionsParser
 from piwall2.broadcaster.youtubedlexception import YoutubeDlException
+from piwall2.config import Config
 from piwall2.configloader import ConfigLoader
 from piwall2.controlmessagehelper import ControlMessageHelper
 from piwall2.directoryutils import DirectoryUtils
 from piwall2.logger import Logger
 from piwall2.multicasthelper import MulticastHelper
 from piwall2.receiver.receiver import Receiver
+from piwall2.telemetryhelper import TelemetryHelper
 
 # Broadcasts a video for playback on the piwall
 class VideoBroadcaster:
@@ -24,23 +34,30 @@ class VideoBroadcaster:
     __VIDEO_URL_TYPE_YOUTUBE = 'video_url_type_youtube'
     __VIDEO_URL_TYPE_LOCAL_FILE = 'video_url_type_local_file'
 
-    # bestaudio: try to select the best audio-only format
-    # bestaudio*: this is the fallback option -- select the best quality format that contains audio.
-    #   It may also contain video, e.g. in the case that there are no audio-only formats available.
-    #   Some videos (live videos) only have combined video + audio formats. Thus 'bestaudio' would
-    #   fail for them.
-    __AUDIO_FORMAT = 'bestaudio/bestaudio*'
+    __PUMP_CHUNK_SIZE_BYTES = 1024 * 64
 
-    __FIFO_PREFIX = 'piwall2_fifo'
+    # bin/msend_video sends the PLAY_VIDEO control message this long after it starts sending the video: 1.3s to
+    # end the loading screen, plus 0.2s for the loading screen's omxplayer instance to shut down.
+    __PLAYBACK_START_DELAY_S = 1.5
 
-    # Touch this file when video playing is done.
-    # We check for its existence to determine when video playback is over.
-    __VIDEO_PLAYBACK_DONE_FILE = '/tmp/video_playback_done.file'
+    # Allow for the receivers' buffering when estimating when video playback will be over.
+    __PLAYBACK_END_MARGIN_S = 0.25
+
+    # While a video is being broadcast, its stream parameters are written to this file. The queue process reads
+    # it to include the current stream in its periodic wall state snapshots. See: Queue.__send_wall_state_snapshot
+    CURRENT_STREAM_FILE = '/tmp/piwall2_current_stream.json'
+
+    # When a broadcast hands off to the next video, it writes the stream_id and estimated playback end time of its
+    # video to this file before exiting. The queue reads it to schedule the switch to the next video.
+    # See: VideoBroadcaster.__wait_for_playback_to_end
+    ENDING_STREAM_FILE = '/tmp/piwall2_ending_stream.json'
 
     # Workaround for https://github.com/yt-dlp/yt-dlp/issues/6447
     __VIDEO_TMP_DIR = '/tmp/piwall2_video_tmp'
     __AUDIO_TMP_DIR = '/tmp/piwall2_audio_tmp'
 
+    __is_multicast_route_added = False
+
     # video_url: may be a youtube url or a path to a file on disk
     # show_loading_screen: Loading screen may also get shown by the queue process. Sending the
     #   signal to show it from the queue is faster than showing it in the videobroadcaster
@@ -50,7 +67,17 @@ class VideoBroadcaster:
     # yt_dlp_extractors: string. Extractor names for yt-dlp to use, separated by commas.
     #   Whitelisting extractors to use can speed up video download initialization time.
     #   Refer to yt-dlp documentation for the '--use-extractors' flag for more details.
-    def __init__(self, video_url, log_uuid, show_loading_screen, yt_dlp_extractors = None):
+    #
+    # stream_id: uniquely identifies this broadcast's stream, so that receivers can tell consecutive streams apart.
+    #   A random one is chosen if not given.
+    # switch_time: if given, the previous video is still finishing playing. The receivers preroll this video, and
+    #   playback switches to it at this unix timestamp, without a loading screen. See: Receiver.__preroll_next_video
+    # is_handoff_enabled: if true, the broadcast ends `gapless_preroll_s` seconds before playback of the video is
+    #   estimated to be over, leaving the video playing, so that the next video can be prerolled.
+    def __init__(
+        self, video_url, log_uuid, show_loading_screen, yt_dlp_extractors = None, stream_id = None,
+        switch_time = None, is_handoff_enabled = False
+    ):
         self.__logger = Logger().set_namespace(self.__class__.__name__)
         if log_uuid:
             Logger.set_uuid(log_uuid)
@@ -62,14 +89,40 @@ class VideoBroadcaster:
         self.__show_loading_screen = show_loading_screen
         self.__yt_dlp_extractors = yt_dlp_extractors
 
+        if stream_id is None:
+            stream_id = random.getrandbits(31)
+        self.__stream_id = stream_id
+        self.__switch_time = switch_time
+        self.__is_handoff_enabled = is_handoff_enabled
+
+        # Whether the broadcast ended by handing off to the next video. See: __wait_for_playback_to_end
+        self.__is_handed_off = False
+
         # Store the PGIDs separately, because attempting to get the PGID later via `os.getpgid` can
         # raise `ProcessLookupError: [Errno 3] No such process` if the process is no longer running
         self.__video_broadcast_proc_pgid = None
         self.__download_and_convert_video_proc_pgid = None
 
-        self.__dimensions_fifo_name = None
+        self.__video_cache = VideoCache()
+        self.__broadcast_timings = BroadcastTimings()
+
+        # When the video is not cached, the converted video is written to this file as it is broadcast. Once the
+        # broadcast completes, the file is added to the cache.
+        self.__cache_part_file = None
+
+        VideoBroadcaster.add_multicast_route_if_not_added()
+        self.__control_message_helper = ControlMessageHelper().setup_for_broadcaster()
+        self.__do_housekeeping(for_end_of_video = False)
+        self.__register_signal_handlers()
+
+    # Bind multicast traffic to eth0. Otherwise it might send over wlan0 -- multicast doesn't work well over wifi.
+    # The route only needs to be added once per process. The broadcast worker adds it once at startup, so that the
+    # broadcasts it forks don't each pay for the subprocess. See: BroadcastWorker
+    @staticmethod
+    def add_multicast_route_if_not_added():
+        if VideoBroadcaster.__is_multicast_route_added:
+            return
 
-        # Bind multicast traffic to eth0. Otherwise it might send over wlan0 -- multicast doesn't work well over wifi.
         # `|| true` to avoid 'RTNETLINK answers: File exists' if the route has already been added.
         (subprocess.check_output(
             f"sudo ip route add {MulticastHelper.ADDRESS}/32 dev eth0 || true",
@@ -77,10 +130,7 @@ class VideoBroadcaster:
             executable = '/usr/bin/bash',
             stderr = subprocess.STDOUT
         ))
-
-        self.__control_message_helper = ControlMessageHelper().setup_for_broadcaster()
-        self.__do_housekeeping(for_end_of_video = False)
-        self.__register_signal_handlers()
+        VideoBroadcaster.__is_multicast_route_added = True
 
     def broadcast(self):
         attempt = 1
@@ -112,41 +162,56 @@ class VideoBroadcaster:
         2) To download the best audio quality
 
         Ytdl takes couple of seconds to be invoked. Luckily, (1) and (2) happen in parallel
-        (see self.__get_ffmpeg_input_clause_and_video_dimensions_pipeline).
-
-        Originally, a single pipeline was responsible for downloading, converting, and broadcasting the video.
-        Video dimensions were calculated separately, outside of this single pipeline.
+        (see DownloadCommandBuilder.build_download_and_convert_cmd).
 
-        Now we have two pipelines that we start separately:
-        1) download_and_convert_video_proc, which downloads the video, calculates the video dimensions, and
-            converts / muxes the video to the proper format.
+        We have two pipelines that we start separately:
+        1) download_and_convert_video_proc, which downloads the video and converts / muxes the video to the
+            proper format.
         2) video_broadcast_proc, which broadcasts the converted video
 
-        We connect the stdout of proc 1 to the stdin of proc 2.
+        The videobroadcaster pumps the stdout of proc 1 into the stdin of proc 2. As it does so, it paces the video
+        against the wall clock using the video's PCR timeline (see: PcrPacer), and estimates when playback will be
+        over.
 
-        In order to calculate the video dimensions inline with the rest of the video pipeline, we had to break up
-        the original single pipeline into these two halves, because broadcasting the video requires having started the
-        receivers first. And starting the receivers requires knowing how much to crop, which requires knowing the
-        video dimensions. Thus, we need to know the video dimensions before broadcasting the video. Without breaking
-        up the pipeline, we wouldn't be able to enforce that we don't start broadcasting the video before knowing the
-        dimensions.
+        Broadcasting the video requires having started the receivers first. And starting the receivers requires
+        knowing how much to crop, which requires knowing the video dimensions. Thus, we need to know the video
+        dimensions before broadcasting the video.
 
         So what happens is:
-        1) The download_and_convert_video_proc starts. The ffmpeg conversion and muxing part of this pipeline is
-            actually blocked by calculating the video dimensions first and writing them to a FIFO file.
-        2) Whenever the dimensions are calculated and written to the FIFO, the ffmpeg conversion and muxing part
-            of the pipeline is unblocked. Simultaneously, the videobroadcaster will read the dimensions from the
-            FIFO.
+        1) The download_and_convert_video_proc starts.
+        2) The videobroadcaster reads the start of the converted video from the download_and_convert_video_proc's
+            stdout, until it has parsed the video dimensions (see: VideoDimensionsParser). This generally takes
+            the first few hundred KB of the video.
         3) The videobroadcaster starts the receivers, and tells them the video dimensions.
-        4) The videobroadcaster starts the video_broadcast_proc, which broadcasts the converted video
+        4) The videobroadcaster starts the video_broadcast_proc, and pumps the bytes that were read in (2),
+            followed by the rest of the converted video, into it.
+
+        If the converted video is cached, none of this is necessary: the download_and_convert_video_proc just reads
+        the cached file, and the video dimensions are stored alongside it. See: VideoCache
         """
-        download_and_convert_video_proc = self.start_download_and_convert_video_proc()
-        self.__start_receivers()
+        cached_video = self.__get_cached_video()
+        if cached_video:
+            download_and_convert_video_proc = self.__start_cached_video_proc(cached_video['path'])
+            video_dimensions = [cached_video['video_width'], cached_video['video_height']]
+            video_prefix = b''
+            self.__broadcast_timings.record(Logger.get_uuid(), BroadcastTimings.STAGE_DIMENSIONS_KNOWN)
+        else:
+            if self.__get_video_url_type() == self.__VIDEO_URL_TYPE_YOUTUBE and self.__video_cache.is_enabled():
+                self.__cache_part_file = self.__video_cache.get_part_file_path(
+                    self.__video_url, self.__config_loader.get_youtube_dl_video_format()
+                )
+            download_and_convert_video_proc = self.start_download_and_convert_video_proc()
+            video_dimensions, video_prefix = self.__read_video_dimensions(download_and_convert_video_proc)
+        telemetry_helper, init_video_time = self.__start_receivers(video_dimensions)
 
         """
-        This `sleep` makes the videos more likely to start in-sync across all the TVs, but I'm not totally
-        sure why. My current theory is that this give the receivers enough time to start before the broadcast
-        command starts sending its data.
+        Wait for the receivers to ack that they are ready before broadcasting. We used to sleep for 2 seconds here,
+        which made the videos more likely to start in-sync across all the TVs, presumably because it gave the
+        receivers enough time to start before the broadcast command started sending its data. But 2 seconds was
+        wasted time when the receivers started quickly, and not enough time when they started slowly.
+
+        See data collected on the effectiveness of the sleep:
+        https://gist.github.com/dasl-/e5c05bf89c7a92d43881a2ff978dc889
 
         Another potential solution is making use of delay_buffer in video_broadcast_cmd, although I have
         abandoned that approach for now: https://gist.github.com/dasl-/9ed9d160384a8dd77382ce6a07c43eb6
@@ -157,77 +222,54 @@ class VideoBroadcaster:
         https://gist.github.com/dasl-/f3fcc941e276d116320d6fa9e4de25de
 
         And another thing I tried is starting the receivers early without any crop args to the invocation of
-        omxplayer. I would only send the crop args later via dbus. This allowed me to get rid of the sleep
-        below. I wasn't 100%, but it may have made things *slightly* less likely to start in sync. Hard to
-        know. Very rarely, you would see the crop change at the very start of the video if it couldn't complete
-        the dbus message before the video started playing. See the approach here:
-        https://gist.github.com/dasl-/db3ce584ba90802ba390ac0f07611dea
-
-        See data collected on the effectiveness of this sleep:
-        https://gist.github.com/dasl-/e5c05bf89c7a92d43881a2ff978dc889
+        omxplayer. I would only send the crop args later via dbus. I wasn't 100%, but it may have made things
+        *slightly* less likely to start in sync. Hard to know. Very rarely, you would see the crop change at the
+        very start of the video if it couldn't complete the dbus message before the video started playing. See the
+        approach here: https://gist.github.com/dasl-/db3ce584ba90802ba390ac0f07611dea
         """
-        time.sleep(2)
-        video_broadcast_proc = self.__start_video_broadcast_proc(download_and_convert_video_proc)
-
+        self.__wait_for_receivers_to_be_ready(telemetry_helper, init_video_time)
+        self.__broadcast_timings.record(Logger.get_uuid(), BroadcastTimings.STAGE_RECEIVERS_READY)
+        video_broadcast_proc = self.__start_video_broadcast_proc()
+        broadcast_start_time = time.time()
+        pcr_pacer = self.__pump_video(download_and_convert_video_proc, video_broadcast_proc, video_prefix)
+        self.__broadcast_timings.record(Logger.get_uuid(), BroadcastTimings.STAGE_END_OF_STREAM)
+
+        # The pump has reached the end of the video, so both procs are about to end.
         self.__logger.info("Waiting for download_and_convert_video and video_broadcast procs to end...")
-        has_download_and_convert_video_proc_ended = False
-        has_video_broadcast_proc_ended = False
-        while True: # Wait for the download_and_convert_video and video_broadcast procs to end...
-            if not has_download_and_convert_video_proc_ended and download_and_convert_video_proc.poll() is not None:
-                has_download_and_convert_video_proc_ended = True
-                if download_and_convert_video_proc.returncode != 0:
-                    raise YoutubeDlException("The download_and_convert_video process exited non-zero: " +
-                        f"{download_and_convert_video_proc.returncode}. This could mean an issue with youtube-dl; " +
-                        "it may require updating.")
-                self.__logger.info("The download_and_convert_video proc ended.")
-
-            if not has_video_broadcast_proc_ended and video_broadcast_proc.poll() is not None:
-                has_video_broadcast_proc_ended = True
-                if video_broadcast_proc.returncode != 0:
-                    raise Exception(f"The video broadcast process exited non-zero: {video_broadcast_proc.returncode}")
-                self.__logger.info("The video_broadcast proc ended.")
-
-            if has_download_and_convert_video_proc_ended and has_video_broadcast_proc_ended:
-                break
-
-            time.sleep(0.1)
-
-        while not os.path.isfile(self.__VIDEO_PLAYBACK_DONE_FILE):
-            time.sleep(0.1)
+        if download_and_convert_video_proc.wait() != 0:
+            raise YoutubeDlException("The download_and_convert_video process exited non-zero: " +
+                f"{download_and_convert_video_proc.returncode}. This could mean an issue with youtube-dl; " +
+                "it may require updating.")
+        self.__logger.info("The download_and_convert_video proc ended.")
+        if video_broadcast_proc.wait() != 0:
+            raise Exception(f"The video broadcast process exited non-zero: {video_broadcast_proc.returncode}")
+        self.__logger.info("The video_broadcast proc ended.")
+
+        if self.__cache_part_file:
+            self.__video_cache.add(
+                self.__video_url, self.__config_loader.get_youtube_dl_video_format(), self.__cache_part_file
+            )
+            self.__cache_part_file = None
 
-        # Wait to ensure video playback is done. Data collected suggests one second is sufficient:
-        # https://docs.google.com/spreadsheets/d/1YzxsD3GPzsIeKYliADN3af7ORys5nXHCRBykSnHaaxk/edit#gid=0
-        time.sleep(1)
-        self.__logger.info("Video playback is likely over.")
+        self.__wait_for_playback_to_end(pcr_pacer, broadcast_start_time)
+        if not self.__is_handed_off:
+            self.__logger.info("Video playback is likely over.")
 
     """
     Process to download video via youtube-dl and convert it to proper format via ffmpeg.
     Note that we only download the video if the input was a youtube_url. If playing a local file, no
     download is necessary.
-
-    This command also includes a pipeline to calculate video dimensions inline with the video download, which is enabled
-    by default (see `include_dimensions_pipeline`). This writes dimensions to a FIFO, which is read by another process
-    that sends the dimensions to the receivers. However, when using the `./utils/download_video` command, nothing
-    reads the FIFO. Writes to a FIFO block until there's another process reading them. So for the sake of commands like
-    `./utils/download_video`, where no process will be reading the FIFO, we can disable writing the dimensions to the FIFO.
     """
-    def start_download_and_convert_video_proc(self, ytdl_video_format = None, include_dimensions_pipeline = True):
+    def start_download_and_convert_video_proc(self, ytdl_video_format = None):
         if self.__get_video_url_type() == self.__VIDEO_URL_TYPE_LOCAL_FILE:
-            cmd = f"< {shlex.quote(self.__video_url)} {self.__get_video_dimensions_pipeline_cmd()}"
+            cmd = f"cat {shlex.quote(self.__video_url)}"
         else:
-            # Mix the best audio with the video and send via multicast
-            # See: https://github.com/dasl-/piwall2/blob/main/docs/best_video_container_format_for_streaming.adoc
-            # See: https://github.com/dasl-/piwall2/blob/main/docs/streaming_high_quality_videos_from_youtube-dl_to_stdout.adoc
-            ffmpeg_input_clause = self.__get_ffmpeg_input_clause_and_video_dimensions_pipeline(ytdl_video_format, include_dimensions_pipeline)
-
-            # `-c:a mp2`: mp2 is believed to result in better quality audio at high bit rates: https://wiki.audacityteam.org/wiki/MP2
-            #
-            # `-map 0:v:0 -map 1:a:0 -shortest`: Mux video from the first input with audio from the second input:
-            # https://stackoverflow.com/a/12943003/627663 We need to specify, because in some cases (live videos), either input
-            # could contain both audio and video. But in most cases, the first input will have only video, and the second input
-            # will have only audio.
-            cmd = (f"set -o pipefail && export SHELLOPTS && {self.__get_standard_ffmpeg_cmd()} {ffmpeg_input_clause} " +
-                "-c:v copy -c:a mp2 -b:a 256k -map 0:v:0 -map 1:a:0 -shortest -f mpegts -")
+            download_command_builder = DownloadCommandBuilder(
+                self.__video_url, self.__VIDEO_TMP_DIR, self.__AUDIO_TMP_DIR, self.__yt_dlp_extractors
+            )
+            cmd = download_command_builder.build_download_and_convert_cmd(ytdl_video_format)
+            if download_command_builder.were_formats_resolved():
+                self.__broadcast_timings.record(Logger.get_uuid(), BroadcastTimings.STAGE_YT_DLP_RESOLVED)
         self.__logger.info(f"Running download_and_convert_video_proc command: {cmd}")
 
         # Info on start_new_session: https://gist.github.com/dasl-/1379cc91fb8739efa5b9414f35101f5f
@@ -238,180 +280,229 @@ class VideoBroadcaster:
         self.__download_and_convert_video_proc_pgid = os.getpgid(download_and_convert_video_proc.pid)
         return download_and_convert_video_proc
 
-    def __start_video_broadcast_proc(self, download_and_convert_video_proc):
-        # See: https://github.com/dasl-/piwall2/blob/main/docs/controlling_video_broadcast_speed.adoc
-        mbuffer_size = round(Receiver.VIDEO_PLAYBACK_MBUFFER_SIZE_BYTES / 2)
-        burst_throttling_clause = (f'mbuffer -q -l /tmp/mbuffer-broadcast.out -m {mbuffer_size}b | ' +
-            f'{self.__get_standard_ffmpeg_cmd()} -re -i pipe:0 -c:v copy -c:a copy -f mpegts - >/dev/null ; ' +
-            f'touch {self.__VIDEO_PLAYBACK_DONE_FILE}')
+    def __start_cached_video_proc(self, cached_video_path):
+        cmd = f"cat {shlex.quote(cached_video_path)}"
+        self.__logger.info(f"Running cached video command: {cmd}")
+        cached_video_proc = subprocess.Popen(
+            cmd, shell = True, executable = '/usr/bin/bash', start_new_session = True, stdout = subprocess.PIPE
+        )
+        self.__download_and_convert_video_proc_pgid = os.getpgid(cached_video_proc.pid)
+        return cached_video_proc
+
+    # The converted video is written to the proc's stdin at a controlled speed. See: VideoBroadcaster.__pump_video
+    def __start_video_broadcast_proc(self):
         broadcasting_clause = (f"{DirectoryUtils().root_dir}/bin/msend_video " +
             f'--log-uuid {shlex.quote(Logger.get_uuid())} ' +
-            f'--end-of-video-magic-bytes {self.END_OF_VIDEO_MAGIC_BYTES.decode()}')
+            f'--end-of-video-magic-bytes {self.END_OF_VIDEO_MAGIC_BYTES.decode()} ' +
+            f'--stream-id {self.__stream_id}')
+        if self.__switch_time is not None:
+            broadcasting_clause += f' --switch-time {self.__switch_time}'
+
+        cache_clause = ''
+        if self.__cache_part_file:
+            cache_clause = f'{shlex.quote(self.__cache_part_file)} '
 
         # Mix the best audio with the video and send via multicast
         # See: https://github.com/dasl-/piwall2/blob/main/docs/best_video_container_format_for_streaming.adoc
         video_broadcast_cmd = ("set -o pipefail && export SHELLOPTS && " +
-            f"tee >({burst_throttling_clause}) >({broadcasting_clause}) >/dev/null")
+            f"tee {cache_clause}>({broadcasting_clause}) >/dev/null")
         self.__logger.info(f"Running broadcast command: {video_broadcast_cmd}")
 
         # Info on start_new_session: https://gist.github.com/dasl-/1379cc91fb8739efa5b9414f35101f5f
         # Allows killing all processes (subshells, children, grandchildren, etc as a group)
         video_broadcast_proc = subprocess.Popen(
             video_broadcast_cmd, shell = True, executable = '/usr/bin/bash', start_new_session = True,
-            stdin = download_and_convert_video_proc.stdout
+            stdin = subprocess.PIPE
         )
         self.__video_broadcast_proc_pgid = os.getpgid(video_broadcast_proc.pid)
         return video_broadcast_proc
 
-    def __start_receivers(self):
-        video_dimensions = self.__read_dimensions_from_fifo()
+    def __start_receivers(self, video_dimensions):
+        if self.__config_loader.is_any_receiver_dual_video_output() and video_dimensions[1] > 720:
+            raise Exception("This video's resolution is too high for a dual output receiver: " +
+                f"({video_dimensions[1]} is greater than 720p).")
+
+        # Start listening for the receivers' readiness acks before sending INIT_VIDEO, so that we don't miss any.
+        telemetry_helper = TelemetryHelper().setup_for_broadcaster()
         msg = {
             'log_uuid': Logger.get_uuid(),
+            'stream_id': self.__stream_id,
             'video_width': video_dimensions[0],
             'video_height': video_dimensions[1],
+            'switch_time': self.__switch_time,
         }
         self.__control_message_helper.send_msg(ControlMessageHelper.TYPE_INIT_VIDEO, msg)
+        init_video_time = time.time()
+        self.__broadcast_timings.record(Logger.get_uuid(), BroadcastTimings.STAGE_INIT_SENT, init_video_time)
         self.__logger.info(f"Sent {ControlMessageHelper.TYPE_INIT_VIDEO} control message.")
+        self.__write_json_file(self.CURRENT_STREAM_FILE, msg)
+        return (telemetry_helper, init_video_time)
 
-    def __get_standard_ffmpeg_cmd(self):
-        # unfortunately there's no way to make ffmpeg output its stats progress stuff with line breaks
-        log_opts = '-nostats '
-        if sys.stderr.isatty():
-            log_opts = '-stats '
+    """
+    Waits until every live receiver has acked that it is ready to receive the video, or until the timeout expires,
+    whichever comes first. Receivers ack once their receive_and_play_video command has started. See: VideoReceiver
 
-        if Logger.get_level() <= Logger.DEBUG:
-            pass # don't change anything, ffmpeg is pretty verbose by default
+    We only wait for receivers in the roster of live receivers, so that a receiver that is down doesn't delay every
+    video by the full timeout. If the roster is unavailable, we wait for all the configured receivers.
+    """
+    def __wait_for_receivers_to_be_ready(self, telemetry_helper, init_video_time):
+        expected_receivers = ReceiverRoster().get_live_receivers()
+        if expected_receivers is None:
+            expected_receivers = self.__config_loader.get_receivers_list()
+        timeout_s = Config.get('receiver_ready_timeout_s', 5)
+
+        ready_times = {}
+        while len(ready_times) < len(expected_receivers):
+            remaining_s = init_video_time + timeout_s - time.time()
+            if remaining_s <= 0:
+                break
+            telemetry_helper.set_receive_timeout(remaining_s)
+            try:
+                msg = telemetry_helper.receive_msg()
+            except socket.timeout:
+                break
+            if msg[TelemetryHelper.MSG_TYPE_KEY] != TelemetryHelper.TYPE_RECEIVER_READY:
+                continue
+            ack = msg[TelemetryHelper.CONTENT_KEY]
+            if ack['stream_id'] != self.__stream_id or ack['receiver'] not in expected_receivers:
+                continue
+            if ack['receiver'] not in ready_times:
+                ready_times[ack['receiver']] = time.time() - init_video_time
+                self.__logger.info(f"Receiver {ack['receiver']} was ready after " +
+                    f"{round(ready_times[ack['receiver']], 3)}s.")
+        telemetry_helper.close()
+
+        not_ready_receivers = [receiver for receiver in expected_receivers if receiver not in ready_times]
+        if not_ready_receivers:
+            self.__logger.warning(f"Timed out after {timeout_s}s waiting for receivers to be ready: " +
+                f"{not_ready_receivers}. Starting the broadcast anyway.")
         else:
-            log_opts += '-loglevel error'
-
-        # Note: don't use ffmpeg's `-xerror` flag:
-        # https://gist.github.com/dasl-/1ad012f55f33f14b44393960f66c6b00
-        return f"ffmpeg -hide_banner {log_opts} "
-
-    def __get_ffmpeg_input_clause_and_video_dimensions_pipeline(self, ytdl_video_format, include_dimensions_pipeline):
-        video_url_type = self.__get_video_url_type()
-        if video_url_type is not self.__VIDEO_URL_TYPE_YOUTUBE:
-            raise Exception(f'Unexpected video_url_type: {video_url_type}.')
-
-        """
-        Pipe to mbuffer to avoid video drop outs when youtube-dl temporarily loses its connection
-        and is trying to reconnect:
-
-            [download] Got server HTTP error: [Errno 104] Connection reset by peer. Retrying (attempt 1 of 10)...
-            [download] Got server HTTP error: [Errno 104] Connection reset by peer. Retrying (attempt 2 of 10)...
-            [download] Got server HTTP error: [Errno 104] Connection reset by peer. Retrying (attempt 3 of 10)...
-
-        This can happen from time to time when downloading long videos.
-        Youtube-dl should download quickly until it fills the mbuffer. After the mbuffer is filled,
-        ffmpeg will apply backpressure to youtube-dl because of ffmpeg's `-re` flag
+            self.__logger.info(f"All {len(expected_receivers)} receivers were ready after " +
+                f"{round(time.time() - init_video_time, 3)}s.")
 
-        --retries infinite: using this to avoid scenarios where all of the retries (10 by default) were
-        exhausted on long video downloads. After a while, retries would be necessary to reconnect. The
-        retries would be successful, but the connection errors would happen again a few minutes later.
-        This allows us to keep retrying whenever it is necessary.
+    # Write to a temp file and rename it so that the queue process never reads a partially written file.
+    def __write_json_file(self, file_path, data):
+        tmp_file_path = file_path + '.tmp'
+        with open(tmp_file_path, 'w') as tmp_file:
+            tmp_file.write(json.dumps(data))
+        os.replace(tmp_file_path, file_path)
 
-        Use yt-dlp, a fork of youtube-dl that has a workaround (for now) for an issue where youtube has been
-        throttling youtube-dl’s download speed:
-        https://github.com/ytdl-org/youtube-dl/issues/29326#issuecomment-879256177
-        """
-        youtube_dl_cmd_template = ("mkdir -p {0} && cd {0} && yt-dlp {1} --retries infinite --format {2} --output - {3} {4} | " +
-            "mbuffer -q -Q -m {5}b")
-
-        log_opts = '--no-progress'
-        if Logger.get_level() <= Logger.DEBUG:
-            log_opts = '' # show video download progress
-        if not sys.stderr.isatty():
-            log_opts += ' --newline'
-
-        if not ytdl_video_format:
-            ytdl_video_format = self.__config_loader.get_youtube_dl_video_format()
-
-        use_extractors = ''
-        if self.__yt_dlp_extractors is not None:
-            use_extractors = f'--use-extractors {shlex.quote(self.__yt_dlp_extractors)}'
-
-        # 50 MB. Based on one video, 1080p avc1 video consumes about 0.36 MB/s. So this should
-        # be enough buffer for ~139s
-        video_buffer_size = 1024 * 1024 * 50
-        youtube_dl_video_cmd = youtube_dl_cmd_template.format(
-            shlex.quote(self.__VIDEO_TMP_DIR),
-            shlex.quote(self.__video_url),
-            shlex.quote(ytdl_video_format),
-            log_opts,
-            use_extractors,
-            video_buffer_size
-        )
-
-        youtube_dl_video_cmd_with_dimensions_calculation = youtube_dl_video_cmd
-        if include_dimensions_pipeline:
-            youtube_dl_video_cmd_with_dimensions_calculation += ' | ' + self.__get_video_dimensions_pipeline_cmd()
-
-        # Also use a 50MB buffer, because in some cases (live videos), the audio stream we download may also contain video.
-        audio_buffer_size = 1024 * 1024 * 50
-        youtube_dl_audio_cmd = youtube_dl_cmd_template.format(
-            shlex.quote(self.__AUDIO_TMP_DIR),
-            shlex.quote(self.__video_url),
-            shlex.quote(self.__AUDIO_FORMAT),
-            log_opts,
-            use_extractors,
-            audio_buffer_size
-        )
+    """
+    Reads the start of the converted video from the download_and_convert_video_proc's stdout until we have parsed
+    the video's dimensions. Returns the dimensions, and the bytes that were read, which must be broadcast before the
+    rest of the video.
 
-        return f"-i <({youtube_dl_video_cmd_with_dimensions_calculation}) -i <({youtube_dl_audio_cmd})"
-
-    def __get_video_dimensions_pipeline_cmd(self):
-        self.__dimensions_fifo_name = self.__make_fifo(additional_prefix = 'dimensions')
-
-        # Explanation of the video dimensions extraction pipeline:
-        #
-        # cat - >/dev/null: Prevent tee from exiting uncleanly (SIGPIPE) after ffprobe has finished probing.
-        #
-        # mbuffer: use mbuffer so that writes in either half of the tee are not blocked by shell pipeline backpressure.
-        # Specifically, ffprobe_mbuffer1 ensures that if ffprobe_cmd is slow to read input, that writing to the stdout
-        # half of the tee will not be blocked. The stdout of the tee is eventually piped to ffmpeg, which
-        # muxes and converts the video. So we ensure this is not blocked by a slow ffprobe. Likewise, ffprobe_mbuffer2
-        # ensures that if the downstream ffmpeg half of the pipeline is slow to read input, that writing to ffprobe
-        # will not be blocked.
-        #
-        # Note: ffprobe may need to read a number of bytes proportional to the video size, thus there may
-        # be no buffer size that works for all videos (see: https://stackoverflow.com/a/70707003/627663 )
-        # But our current buffer size works for videos that are ~24 hours long, so it's good enough in
-        # most cases. Something fails for videos that are 100h+ long, but I believe it's unrelated to
-        # mbuffer size -- those videos failed even with our old model of calculating dimensions separately from
-        # the video playback pipeline. See: https://github.com/yt-dlp/yt-dlp/issues/3390
-        ffprobe_cmd = f'ffprobe -v 0 -of csv=p=0 -select_streams v:0 -show_entries stream=width,height - > {self.__dimensions_fifo_name}'
-        ffprobe_mbuffer1 = f'mbuffer -q -l /tmp/mbuffer-ffprobe1.out -m {1024 * 1024 * 50}b'
-        ffprobe_mbuffer2 = f'mbuffer -q -l /tmp/mbuffer-ffprobe2.out -m {1024 * 1024 * 50}b'
-        dimensions_cmd = f'tee >( {ffprobe_mbuffer1} | {{ {ffprobe_cmd} && cat - >/dev/null ; }} ) | {ffprobe_mbuffer2} '
-
-        return dimensions_cmd
-
-    def __read_dimensions_from_fifo(self):
+    We read from the underlying file descriptor rather than the buffered file object, so that no bytes are left in
+    a python buffer: VideoBroadcaster.__pump_video reads the rest of the video from the same file descriptor.
+    """
+    def __read_video_dimensions(self, download_and_convert_video_proc):
+        start_time = time.time()
+        parser = VideoDimensionsParser()
         dimensions = None
-        try:
-            dimensions_fifo = open(self.__dimensions_fifo_name, 'r')
-            # Need to call .read() rather than .readline() because in some cases, the output could
-            # contain multiple lines. We're only interested in the first line. Closing the fifo
-            # after only reading the first line when it has multi-line output would result in
-            # SIGPIPE errors
-            dimensions = list(map(int, dimensions_fifo.read().splitlines()[0].strip().split(',')))
-            dimensions_fifo.close()
-        except Exception as ex:
+        num_bytes_read = 0
+        video_prefix = bytearray()
+        fd = download_and_convert_video_proc.stdout.fileno()
+        while not parser.is_done():
+            data = os.read(fd, self.__PUMP_CHUNK_SIZE_BYTES)
+            if not data:
+                break # EOF
+            if num_bytes_read == 0:
+                self.__broadcast_timings.record(Logger.get_uuid(), BroadcastTimings.STAGE_FIRST_BYTE)
+            video_prefix += data
+            num_bytes_read += len(data)
+            dimensions = parser.feed(data)
+
+        if dimensions is None:
             if self.__config_loader.is_any_receiver_dual_video_output():
                 dimensions = [1280, 720]
             else:
                 dimensions = [1920, 1080]
 
-            self.__logger.error("Got an error determining the dimensions: " + str(ex))
+            self.__logger.error(f"Unable to determine the dimensions after reading {num_bytes_read} bytes. " +
+                "The video may not be H.264 encoded.")
             self.__logger.error(f"Assuming dimensions are {dimensions} for this video.")
+        else:
+            self.__logger.info(f'Calculated video dimensions: {dimensions} in {round(time.time() - start_time, 3)}s ' +
+                f'({num_bytes_read} bytes read).')
+        self.__broadcast_timings.record(Logger.get_uuid(), BroadcastTimings.STAGE_DIMENSIONS_KNOWN)
+        return (dimensions, bytes(video_prefix))
 
-        self.__logger.info(f'Calculated video dimensions: {dimensions}')
+    """
+    Writes video_prefix, followed by the rest of the download_and_convert_video_proc's stdout, to the
+    video_broadcast_proc's stdin. Returns the PcrPacer that paced the video.
 
-        if self.__config_loader.is_any_receiver_dual_video_output() and dimensions[1] > 720:
-            raise Exception("This video's resolution is too high for a dual output receiver: " +
-                f"({dimensions[1]} is greater than 720p).")
+    The video is sent in an initial burst of up to `broadcast_pacing_lead_s` seconds of media, and then at real time
+    speed. See: https://github.com/dasl-/piwall2/blob/main/docs/controlling_video_broadcast_speed.adoc
 
-        return dimensions
+    Reads block until the download_and_convert_video_proc has more data, and writes block while the
+    video_broadcast_proc applies backpressure, so this doesn't need to poll.
+    """
+    def __pump_video(self, download_and_convert_video_proc, video_broadcast_proc, video_prefix):
+        # Limit the burst to half of the receivers' input buffer, as we did when the burst was implemented with an
+        # mbuffer of this size.
+        pcr_pacer = PcrPacer(
+            Config.get('broadcast_pacing_lead_s', 120), round(Receiver.VIDEO_PLAYBACK_MBUFFER_SIZE_BYTES / 2)
+        )
+        read_fd = download_and_convert_video_proc.stdout.fileno()
+        write_fd = video_broadcast_proc.stdin.fileno()
+        data = video_prefix
+        while True:
+            if data:
+                pcr_pacer.write(write_fd, data)
+            data = os.read(read_fd, self.__PUMP_CHUNK_SIZE_BYTES)
+            if not data:
+                break # EOF
+        video_broadcast_proc.stdin.close()
+        self.__logger.info(f"Sent {round(pcr_pacer.get_media_time_sent_s(), 3)}s of media in " +
+            f"{round(pcr_pacer.get_elapsed_time_s(), 3)}s.")
+        return pcr_pacer
+
+    """
+    Sleeps until playback of the video is estimated to be over, based on its PCR timeline.
+
+    The receivers start the video paused, and bin/msend_video sends the PLAY_VIDEO control message about
+    __PLAYBACK_START_DELAY_S after it starts sending the video, or at the switch time, whichever is later. Thus
+    playback starts no earlier than that. If the video was received slower than real time, playback can't have
+    started before PcrTimeline.get_latest_origin_time. Playback is over the video's duration after it started.
+
+    If handoff is enabled, we only sleep until `gapless_preroll_s` seconds before playback is estimated to be over.
+    Then we write the ENDING_STREAM_FILE, and the broadcast ends without skipping the video. The queue starts the
+    next broadcast with the estimated playback end time as its switch time, so the receivers can preroll the next
+    video while this one finishes playing.
+    """
+    def __wait_for_playback_to_end(self, pcr_pacer, broadcast_start_time):
+        pcr_timeline = pcr_pacer.get_pcr_timeline()
+        duration_s = pcr_pacer.get_media_time_sent_s()
+        if pcr_timeline.get_latest_origin_time() is None:
+            self.__logger.warning("Unable to estimate when video playback will be over: the video had no PCRs.")
+            return
+
+        playback_start_time = max(
+            broadcast_start_time + self.__PLAYBACK_START_DELAY_S, pcr_timeline.get_latest_origin_time(),
+            self.__switch_time or 0
+        )
+        playback_end_time = playback_start_time + duration_s + self.__PLAYBACK_END_MARGIN_S
+        wait_s = playback_end_time - time.time()
+        self.__logger.info(f"Video duration is {round(duration_s, 3)}s. Estimating that video playback will be over " +
+            f"in {round(max(wait_s, 0), 3)}s.")
+        if self.__is_handoff_enabled:
+            wait_s -= Config.get('gapless_preroll_s', 10)
+        if wait_s > 0:
+            time.sleep(wait_s)
+
+        if self.__is_handoff_enabled and playback_end_time > time.time():
+            self.__write_json_file(
+                self.ENDING_STREAM_FILE, {'stream_id': self.__stream_id, 'playback_end_time': playback_end_time}
+            )
+            self.__is_handed_off = True
+            self.__logger.info(f"Handing off to the next video {round(playback_end_time - time.time(), 3)}s " +
+                "before video playback will be over.")
+
+    # Returns the cached video's metadata (see: VideoCache.get), or None if the video is not cached.
+    def __get_cached_video(self):
+        if self.__get_video_url_type() != self.__VIDEO_URL_TYPE_YOUTUBE:
+            return None
+        return self.__video_cache.get(self.__video_url, self.__config_loader.get_youtube_dl_video_format())
 
     def __get_video_url_type(self):
         if self.__video_url.startswith('http://') or self.__video_url.startswith('https://'):
@@ -419,24 +510,6 @@ class VideoBroadcaster:
         else:
             return self.__VIDEO_URL_TYPE_LOCAL_FILE
 
-    def __make_fifo(self, additional_prefix = None):
-        prefix = self.__FIFO_PREFIX + '__'
-        if additional_prefix:
-            prefix += additional_prefix + '__'
-
-        make_fifo_cmd = (
-            'fifo_name=$(mktemp --tmpdir={} --dry-run {}) && mkfifo -m 600 "$fifo_name" && printf $fifo_name'
-            .format(
-                tempfile.gettempdir(),
-                prefix + 'XXXXXXXXXX'
-            )
-        )
-        self.__logger.info('Making fifo...')
-        fifo_name = (subprocess
-            .check_output(make_fifo_cmd, shell = True, executable = '/usr/bin/bash')
-            .decode("utf-8"))
-        return fifo_name
-
     def __update_yt_dlp(self):
         update_yt_dlp_output = (subprocess
             .check_output(
@@ -466,13 +539,25 @@ class VideoBroadcaster:
             except Exception:
                 # might raise: `ProcessLookupError: [Errno 3] No such process`
                 pass
+        if self.__cache_part_file:
+            # The broadcast didn't complete, so the partially written video can't be added to the cache.
+            self.__logger.info(f"Deleting partially written cache file: {self.__cache_part_file} ...")
+            try:
+                os.remove(self.__cache_part_file)
+            except FileNotFoundError:
+                pass
+            self.__cache_part_file = None
         if for_end_of_video:
+            self.__video_cache.flush_stats()
+        if for_end_of_video and not self.__is_handed_off:
             # sending a skip signal at the beginning of a video could skip the loading screen
-            self.__control_message_helper.send_msg(ControlMessageHelper.TYPE_SKIP_VIDEO, {})
+            self.__control_message_helper.send_msg(
+                ControlMessageHelper.TYPE_SKIP_VIDEO, {'stream_id': self.__stream_id}
+            )
 
-        self.__logger.info(f"Deleting fifos, temp dirs, and {self.__VIDEO_PLAYBACK_DONE_FILE} ...")
-        fifos_path_glob = shlex.quote(tempfile.gettempdir() + "/" + self.__FIFO_PREFIX) + '*'
-        cleanup_files_cmd = f'sudo rm -rf {fifos_path_glob} {self.__VIDEO_PLAYBACK_DONE_FILE} {self.__VIDEO_TMP_DIR} {self.__AUDIO_TMP_DIR}'
+        self.__logger.info(f"Deleting temp dirs and {self.CURRENT_STREAM_FILE} ...")
+        cleanup_files_cmd = (f'sudo rm -rf {self.CURRENT_STREAM_FILE} {self.__VIDEO_TMP_DIR} ' +
+            f'{self.__AUDIO_TMP_DIR}')
         subprocess.check_output(cleanup_files_cmd, shell = True, executable = '/usr/bin/bash')
 
     def __register_signal_handlers(self):
@@ -0,0 +1,193 @@
+import hashlib
+import json
+import os
+import time
+import traceback
+
+from piwall2.broadcaster.ffprober import Ffprober
+from piwall2.config import Config
+from piwall2.directoryutils import DirectoryUtils
+from piwall2.logger import Logger
+
+"""
+A disk-backed cache of converted videos, i.e. the MPEG-TS output of the download and convert pipeline. See:
+DownloadCommandBuilder. Entries are keyed by the video's URL and the youtube-dl format selector that was used to
+download it. A cache hit is broadcast from the local file, without running yt-dlp, ffmpeg, or ffprobe.
+
+Each entry consists of two files in the cache directory:
+    <key>.ts: the converted video
+    <key>.json: the entry's metadata: url, ytdl_video_format, video_width, video_height, duration_s, size_bytes, and
+        last_access_time
+
+Entries are evicted in least recently used order whenever the cache grows larger than its size budget. Hit and miss
+counts and the number of bytes saved by cache hits are persisted in stats.json in the cache directory, so that they
+accumulate across broadcasts. Lookups only count in memory, because they are on the critical path of starting a
+broadcast. The counts are persisted via `flush_stats`, after a video is added and at the end of the broadcast.
+"""
+class VideoCache:
+
+    CACHE_DIR = DirectoryUtils().root_dir + '/video_cache'
+
+    __STATS_FILE = CACHE_DIR + '/stats.json'
+
+    def __init__(self):
+        self.__logger = Logger().set_namespace(self.__class__.__name__)
+        self.__max_size_bytes = Config.get('video_cache_max_size_mb', 4096) * 1024 * 1024
+
+        # Counts that have not yet been added to stats.json. See: VideoCache.flush_stats
+        self.__unflushed_stats = self.__get_empty_stats()
+
+    def is_enabled(self):
+        return self.__max_size_bytes > 0
+
+    # Returns the entry's metadata, with an additional `path` key for the converted video, or None if the video is
+    # not cached. Counts as an access for the purposes of LRU eviction, and counts towards the hit / miss stats.
+    def get(self, url, ytdl_video_format):
+        if not self.is_enabled():
+            return None
+
+        key = self.__get_key(url, ytdl_video_format)
+        metadata = self.__read_metadata(key)
+        if metadata is None:
+            self.__unflushed_stats['misses'] += 1
+            self.__logger.info(f"Cache miss for {url}.")
+            return None
+
+        metadata['last_access_time'] = time.time()
+        self.__write_json(self.__get_metadata_file_path(key), metadata)
+        self.__unflushed_stats['hits'] += 1
+        self.__unflushed_stats['bytes_saved'] += metadata['size_bytes']
+        self.__logger.info(f"Cache hit for {url}: {metadata['size_bytes']} bytes, {metadata['video_width']}x" +
+            f"{metadata['video_height']}, {metadata['duration_s']}s.")
+        return {**metadata, 'path': self.__get_video_file_path(key)}
+
+    # Whether the video is cached. Unlike `get`, this does not count as an access.
+    def contains(self, url, ytdl_video_format):
+        if not self.is_enabled():
+            return False
+        return self.__read_metadata(self.__get_key(url, ytdl_video_format)) is not None
+
+    # Returns the path that a new entry should be written to. Once it is completely written, add it via `add`.
+    def get_part_file_path(self, url, ytdl_video_format):
+        os.makedirs(self.CACHE_DIR, exist_ok = True)
+        return self.__get_video_file_path(self.__get_key(url, ytdl_video_format)) + '.part'
+
+    # Adds a completely written video to the cache, moving it into the cache directory. Then evicts the least
+    # recently used entries if the cache is over its size budget.
+    def add(self, url, ytdl_video_format, video_file_path):
+        key = self.__get_key(url, ytdl_video_format)
+        try:
+            ffprobe_metadata = Ffprober().get_video_metadata(video_file_path, ['width', 'height', 'duration'])
+            os.makedirs(self.CACHE_DIR, exist_ok = True)
+            os.replace(video_file_path, self.__get_video_file_path(key))
+            metadata = {
+                'url': url,
+                'ytdl_video_format': ytdl_video_format,
+                'video_width': int(ffprobe_metadata['width']),
+                'video_height': int(ffprobe_metadata['height']),
+                'duration_s': round(float(ffprobe_metadata['duration']), 3),
+                'size_bytes': os.path.getsize(self.__get_video_file_path(key)),
+                'last_access_time': time.time(),
+            }
+            self.__write_json(self.__get_metadata_file_path(key), metadata)
+        except Exception:
+            self.__logger.error(f'Unable to add {url} to the cache: {traceback.format_exc()}')
+            self.__remove_file(video_file_path)
+            self.__remove_entry(key)
+            return
+
+        self.__logger.info(f"Added {url} to the cache: {metadata['size_bytes']} bytes.")
+        self.__evict()
+        self.flush_stats()
+
+    # Adds the hit / miss counts since the last flush to stats.json.
+    def flush_stats(self):
+        if self.__unflushed_stats == self.__get_empty_stats():
+            return
+        try:
+            stats = self.__read_stats()
+            for name, count in self.__unflushed_stats.items():
+                stats[name] += count
+            self.__write_stats(stats)
+        except Exception:
+            self.__logger.error(f'Unable to write cache stats: {traceback.format_exc()}')
+            return
+        self.__unflushed_stats = self.__get_empty_stats()
+        self.__logger.info(f"Cache stats: {self.__format_stats(stats)}.")
+
+    def __evict(self):
+        entries = []
+        cache_size_bytes = 0
+        for file_name in os.listdir(self.CACHE_DIR):
+            if not file_name.endswith('.json') or file_name == os.path.basename(self.__STATS_FILE):
+                continue
+            key = file_name[:-len('.json')]
+            metadata = self.__read_metadata(key)
+            if metadata is None:
+                continue
+            entries.append((metadata['last_access_time'], key, metadata))
+            cache_size_bytes += metadata['size_bytes']
+
+        entries.sort(key = lambda entry: entry[0])
+        for last_access_time, key, metadata in entries:
+            if cache_size_bytes <= self.__max_size_bytes:
+                break
+            self.__logger.info(f"Evicting {metadata['url']} from the cache: {metadata['size_bytes']} bytes.")
+            self.__remove_entry(key)
+            cache_size_bytes -= metadata['size_bytes']
+
+    def __read_metadata(self, key):
+        try:
+            with open(self.__get_metadata_file_path(key)) as metadata_file:
+                metadata = json.loads(metadata_file.read())
+        except Exception:
+            return None
+        if not os.path.isfile(self.__get_video_file_path(key)):
+            return None
+        return metadata
+
+    def __read_stats(self):
+        stats = self.__get_empty_stats()
+        try:
+            with open(self.__STATS_FILE) as stats_file:
+                stats.update(json.loads(stats_file.read()))
+        except Exception:
+            pass
+        return stats
+
+    def __write_stats(self, stats):
+        os.makedirs(self.CACHE_DIR, exist_ok = True)
+        self.__write_json(self.__STATS_FILE, stats)
+
+    def __get_empty_stats(self):
+        return {'hits': 0, 'misses': 0, 'bytes_saved': 0}
+
+    def __format_stats(self, stats):
+        return f"total hits: {stats['hits']}, total misses: {stats['misses']}, total bytes saved: {stats['bytes_saved']}"
+
+    # Write to a temp file and rename it so that readers never read a partially written file.
+    def __write_json(self, file_path, data):
+        tmp_file_path = file_path + '.tmp'
+        with open(tmp_file_path, 'w') as tmp_file:
+            tmp_file.write(json.dumps(data))
+        os.replace(tmp_file_path, file_path)
+
+    # Remove the metadata first, so that a partially removed entry is never considered cached.
+    def __remove_entry(self, key):
+        self.__remove_file(self.__get_metadata_file_path(key))
+        self.__remove_file(self.__get_video_file_path(key))
+
+    def __remove_file(self, file_path):
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            pass
+
+    def __get_key(self, url, ytdl_video_format):
+        return hashlib.sha1(f'{url}\n{ytdl_video_format}'.encode()).hexdigest()
+
+    def __get_video_file_path(self, key):
+        return f'{self.CACHE_DIR}/{key}.ts'
+
+    def __get_metadata_file_path(self, key):
+        return f'{self.CACHE_DIR}/{key}.json'
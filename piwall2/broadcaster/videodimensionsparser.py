@@ -0,0 +1,306 @@
+"""
+Determines the dimensions of an H.264 video from the start of its MPEG-TS stream, without shelling out to ffprobe.
+
+We find the video's elementary stream via the stream's PAT and PMT, then read the first H.264 sequence parameter set
+(SPS) in that elementary stream. The SPS encodes the video's width and height in macroblocks, as well as how many
+pixels to crop from each edge. The SPS is sent before the first frame, so this only takes the first few hundred KB of
+the stream.
+
+Usage: feed the stream's bytes, in order, to `feed` until it returns the dimensions, or until `is_done` returns True.
+If the stream's video is not H.264 or if the stream is malformed, `feed` will never return the dimensions.
+
+See:
+    MPEG-TS: ITU-T H.222.0, section 2.4
+    H.264 SPS: ITU-T H.264, section 7.3.2.1.1
+"""
+class VideoDimensionsParser:
+
+    __TS_PACKET_SIZE = 188
+    __TS_SYNC_BYTE = 0x47
+    __PAT_PID = 0
+
+    __STREAM_TYPE_H264 = 0x1B
+    __NAL_UNIT_TYPE_SPS = 7
+
+    # Profiles whose SPS includes the chroma format, bit depths, and scaling matrices.
+    __HIGH_PROFILE_IDCS = (100, 110, 122, 244, 44, 83, 86, 118, 128, 138, 139, 134, 135)
+
+    # Give up if we haven't found the SPS after buffering this much of the video's elementary stream.
+    __MAX_ELEMENTARY_STREAM_BYTES = 1024 * 1024
+
+    # Give up if we haven't found the SPS after reading this much of the stream, e.g. because the stream has no PMT
+    # or no H.264 video, in which case nothing is buffered in the elementary stream.
+    __MAX_STREAM_BYTES = 1024 * 1024 * 4
+
+    def __init__(self):
+        self.__buffer = b''
+        self.__is_synced = False
+        self.__pmt_pid = None
+        self.__video_pid = None
+        self.__elementary_stream = bytearray()
+        self.__search_position = 0
+        self.__dimensions = None
+        self.__is_done = False
+        self.__num_bytes_fed = 0
+
+    # Returns the video's dimensions as a list of [width, height] once they are known, otherwise None.
+    def feed(self, data):
+        if self.__is_done:
+            return self.__dimensions
+
+        self.__buffer += data
+        self.__num_bytes_fed += len(data)
+        if not self.__is_synced and not self.__sync():
+            return None
+
+        num_packets = len(self.__buffer) // self.__TS_PACKET_SIZE
+        for i in range(num_packets):
+            packet = self.__buffer[i * self.__TS_PACKET_SIZE:(i + 1) * self.__TS_PACKET_SIZE]
+            try:
+                self.__parse_packet(packet)
+            except IndexError:
+                self.__is_done = True # The stream is malformed
+            if self.__is_done:
+                break
+        self.__buffer = self.__buffer[num_packets * self.__TS_PACKET_SIZE:]
+
+        # Check the cap after parsing, so that an SPS in the data that crossed it is still found.
+        if self.__num_bytes_fed >= self.__MAX_STREAM_BYTES:
+            self.__is_done = True
+        return self.__dimensions
+
+    # Whether parsing has finished, either because the dimensions were found, or because they can't be found.
+    def is_done(self):
+        return self.__is_done
+
+    # Skip any leading garbage, so that the buffer starts at a TS packet boundary.
+    def __sync(self):
+        for offset in range(min(len(self.__buffer), self.__TS_PACKET_SIZE)):
+            if (
+                offset + self.__TS_PACKET_SIZE < len(self.__buffer) and
+                self.__buffer[offset] == self.__TS_SYNC_BYTE and
+                self.__buffer[offset + self.__TS_PACKET_SIZE] == self.__TS_SYNC_BYTE
+            ):
+                self.__buffer = self.__buffer[offset:]
+                self.__is_synced = True
+                return True
+        if len(self.__buffer) > self.__TS_PACKET_SIZE * 2:
+            self.__is_done = True # This doesn't look like an MPEG-TS stream.
+        return False
+
+    def __parse_packet(self, packet):
+        if packet[0] != self.__TS_SYNC_BYTE:
+            self.__is_done = True
+            return
+
+        payload_unit_start_indicator = bool(packet[1] & 0x40)
+        pid = ((packet[1] & 0x1F) << 8) | packet[2]
+        adaptation_field_control = (packet[3] >> 4) & 0x03
+        if not adaptation_field_control & 0x01:
+            return # no payload
+
+        payload_start = 4
+        if adaptation_field_control & 0x02:
+            payload_start += 1 + packet[4]
+        payload = packet[payload_start:]
+
+        if pid == self.__PAT_PID and self.__pmt_pid is None:
+            self.__parse_pat(payload, payload_unit_start_indicator)
+        elif pid == self.__pmt_pid and self.__video_pid is None:
+            self.__parse_pmt(payload, payload_unit_start_indicator)
+        elif pid == self.__video_pid:
+            self.__parse_video_payload(payload, payload_unit_start_indicator)
+
+    # Assumes that the PAT section fits in a single packet, which is true for any stream with a few programs.
+    def __parse_pat(self, payload, payload_unit_start_indicator):
+        section = self.__get_psi_section(payload, payload_unit_start_indicator)
+        if section is None:
+            return
+        section_length = ((section[1] & 0x0F) << 8) | section[2]
+        # The program loop starts after the 8 byte header and ends before the 4 byte CRC
+        for i in range(8, 3 + section_length - 4, 4):
+            program_number = (section[i] << 8) | section[i + 1]
+            if program_number != 0: # program number 0 is the network PID, not a PMT
+                self.__pmt_pid = ((section[i + 2] & 0x1F) << 8) | section[i + 3]
+                return
+
+    # Assumes that the PMT section fits in a single packet, which is true for any stream with a few streams.
+    def __parse_pmt(self, payload, payload_unit_start_indicator):
+        section = self.__get_psi_section(payload, payload_unit_start_indicator)
+        if section is None:
+            return
+        section_length = ((section[1] & 0x0F) << 8) | section[2]
+        program_info_length = ((section[10] & 0x0F) << 8) | section[11]
+        i = 12 + program_info_length
+        while i < 3 + section_length - 4:
+            stream_type = section[i]
+            elementary_pid = ((section[i + 1] & 0x1F) << 8) | section[i + 2]
+            es_info_length = ((section[i + 3] & 0x0F) << 8) | section[i + 4]
+            if stream_type == self.__STREAM_TYPE_H264:
+                self.__video_pid = elementary_pid
+                return
+            i += 5 + es_info_length
+        self.__is_done = True # There is no H.264 video stream
+
+    def __get_psi_section(self, payload, payload_unit_start_indicator):
+        if not payload_unit_start_indicator:
+            return None
+        pointer_field = payload[0]
+        section = payload[1 + pointer_field:]
+        if len(section) < 12:
+            return None
+        return section
+
+    def __parse_video_payload(self, payload, payload_unit_start_indicator):
+        if payload_unit_start_indicator:
+            # Skip the PES header: the start code prefix and stream_id (4 bytes), PES_packet_length (2 bytes),
+            # flags (2 bytes), and PES_header_data_length (1 byte) followed by that many bytes.
+            if len(payload) < 9 or payload[0:3] != b'\x00\x00\x01':
+                return
+            payload = payload[9 + payload[8]:]
+        self.__elementary_stream += payload
+
+        sps = self.__find_sps()
+        if sps is not None:
+            try:
+                self.__dimensions = self.__parse_sps(sps)
+            except IndexError:
+                pass # The SPS was truncated or malformed
+            self.__is_done = True
+        elif len(self.__elementary_stream) > self.__MAX_ELEMENTARY_STREAM_BYTES:
+            self.__is_done = True
+
+    # Returns the first SPS NAL unit's payload (excluding its header byte), once the whole NAL unit has been
+    # buffered. Otherwise returns None.
+    def __find_sps(self):
+        es = self.__elementary_stream
+        while True:
+            start = es.find(b'\x00\x00\x01', self.__search_position)
+            if start == -1:
+                # Resume searching near the end next time, in case a start code is split across payloads.
+                self.__search_position = max(self.__search_position, len(es) - 2)
+                return None
+            nal_start = start + 3
+            if nal_start >= len(es):
+                self.__search_position = start
+                return None
+            if (es[nal_start] & 0x1F) == self.__NAL_UNIT_TYPE_SPS:
+                nal_end = es.find(b'\x00\x00\x01', nal_start)
+                if nal_end == -1:
+                    self.__search_position = start # wait for the rest of the NAL unit
+                    return None
+                return bytes(es[nal_start + 1:nal_end])
+            self.__search_position = nal_start
+
+    def __parse_sps(self, sps):
+        reader = _BitReader(self.__remove_emulation_prevention_bytes(sps))
+        profile_idc = reader.read_bits(8)
+        reader.read_bits(8) # constraint_set flags and reserved_zero_2bits
+        reader.read_bits(8) # level_idc
+        reader.read_ue() # seq_parameter_set_id
+
+        chroma_format_idc = 1
+        separate_colour_plane_flag = 0
+        if profile_idc in self.__HIGH_PROFILE_IDCS:
+            chroma_format_idc = reader.read_ue()
+            if chroma_format_idc == 3:
+                separate_colour_plane_flag = reader.read_bits(1)
+            reader.read_ue() # bit_depth_luma_minus8
+            reader.read_ue() # bit_depth_chroma_minus8
+            reader.read_bits(1) # qpprime_y_zero_transform_bypass_flag
+            seq_scaling_matrix_present_flag = reader.read_bits(1)
+            if seq_scaling_matrix_present_flag:
+                for i in range(8 if chroma_format_idc != 3 else 12):
+                    seq_scaling_list_present_flag = reader.read_bits(1)
+                    if seq_scaling_list_present_flag:
+                        self.__skip_scaling_list(reader, 16 if i < 6 else 64)
+
+        reader.read_ue() # log2_max_frame_num_minus4
+        pic_order_cnt_type = reader.read_ue()
+        if pic_order_cnt_type == 0:
+            reader.read_ue() # log2_max_pic_order_cnt_lsb_minus4
+        elif pic_order_cnt_type == 1:
+            reader.read_bits(1) # delta_pic_order_always_zero_flag
+            reader.read_se() # offset_for_non_ref_pic
+            reader.read_se() # offset_for_top_to_bottom_field
+            num_ref_frames_in_pic_order_cnt_cycle = reader.read_ue()
+            for i in range(num_ref_frames_in_pic_order_cnt_cycle):
+                reader.read_se() # offset_for_ref_frame[i]
+        reader.read_ue() # max_num_ref_frames
+        reader.read_bits(1) # gaps_in_frame_num_value_allowed_flag
+        pic_width_in_mbs_minus1 = reader.read_ue()
+        pic_height_in_map_units_minus1 = reader.read_ue()
+        frame_mbs_only_flag = reader.read_bits(1)
+        if not frame_mbs_only_flag:
+            reader.read_bits(1) # mb_adaptive_frame_field_flag
+        reader.read_bits(1) # direct_8x8_inference_flag
+
+        frame_crop_left_offset = frame_crop_right_offset = frame_crop_top_offset = frame_crop_bottom_offset = 0
+        frame_cropping_flag = reader.read_bits(1)
+        if frame_cropping_flag:
+            frame_crop_left_offset = reader.read_ue()
+            frame_crop_right_offset = reader.read_ue()
+            frame_crop_top_offset = reader.read_ue()
+            frame_crop_bottom_offset = reader.read_ue()
+
+        # See the derivation of CropUnitX and CropUnitY in ITU-T H.264, section 7.4.2.1.1
+        chroma_array_type = 0 if separate_colour_plane_flag else chroma_format_idc
+        if chroma_array_type == 0:
+            crop_unit_x = 1
+            crop_unit_y = 2 - frame_mbs_only_flag
+        else:
+            sub_width_c = 1 if chroma_format_idc == 3 else 2
+            sub_height_c = 2 if chroma_format_idc == 1 else 1
+            crop_unit_x = sub_width_c
+            crop_unit_y = sub_height_c * (2 - frame_mbs_only_flag)
+
+        width = ((pic_width_in_mbs_minus1 + 1) * 16 -
+            crop_unit_x * (frame_crop_left_offset + frame_crop_right_offset))
+        height = ((2 - frame_mbs_only_flag) * (pic_height_in_map_units_minus1 + 1) * 16 -
+            crop_unit_y * (frame_crop_top_offset + frame_crop_bottom_offset))
+        return [width, height]
+
+    def __skip_scaling_list(self, reader, size):
+        last_scale = 8
+        next_scale = 8
+        for i in range(size):
+            if next_scale != 0:
+                delta_scale = reader.read_se()
+                next_scale = (last_scale + delta_scale + 256) % 256
+            last_scale = last_scale if next_scale == 0 else next_scale
+
+    # Within a NAL unit, the byte sequence 0x000003 is used to escape sequences that would otherwise look like start
+    # codes. The 0x03 byte must be removed before parsing.
+    def __remove_emulation_prevention_bytes(self, nal_unit):
+        return nal_unit.replace(b'\x00\x00\x03', b'\x00\x00')
+
+
+# Reads the bits of an H.264 RBSP, including its Exp-Golomb coded integers.
+class _BitReader:
+
+    def __init__(self, data):
+        self.__data = data
+        self.__bit_position = 0
+
+    def read_bits(self, num_bits):
+        value = 0
+        for i in range(num_bits):
+            byte = self.__data[self.__bit_position // 8]
+            bit = (byte >> (7 - (self.__bit_position % 8))) & 0x01
+            value = (value << 1) | bit
+            self.__bit_position += 1
+        return value
+
+    # Unsigned Exp-Golomb code. See: ITU-T H.264, section 9.1
+    def read_ue(self):
+        leading_zero_bits = 0
+        while self.read_bits(1) == 0:
+            leading_zero_bits += 1
+        return (1 << leading_zero_bits) - 1 + self.read_bits(leading_zero_bits)
+
+    # Signed Exp-Golomb code. See: ITU-T H.264, section 9.1.1
+    def read_se(self):
+        code_num = self.read_ue()
+        if code_num % 2 == 0:
+            return -(code_num // 2)
+        return (code_num + 1) // 2
@@ -0,0 +1,202 @@
+import copy
+import datetime
+import json
+import os
+import socketserver
+import sys
+import threading
+import time
+import traceback
+import urllib.parse
+
+import yt_dlp
+
+"""
+A long-lived service that resolves video URLs to direct media URLs via yt-dlp. See: bin/ytdlp_resolver
+
+Invoking the yt-dlp CLI pays for python startup, importing yt_dlp, and extractor initialization on every run, and
+each broadcast used to run it twice (once for video, once for audio). This service imports yt_dlp once, and caches
+each URL's extracted info until its media URLs expire. The broadcaster then downloads the media URLs directly. See:
+YtDlpResolverClient
+
+This runs under the python interpreter that yt-dlp is installed into (see: utils/update_yt-dlp.sh), which may not
+have piwall2's dependencies installed. Thus, this module must not import other piwall2 modules.
+
+Protocol: clients connect to the unix socket at SOCKET_PATH and send a single line of JSON:
+    {"url": "...", "formats": {"video": "<format selector>", "audio": "<format selector>"}}
+
+The response is a single line of JSON. On success:
+    {
+        "formats": {"video": {"url": "...", "http_headers": {...}, "format_id": "..."}, "audio": {...}},
+        "is_cache_hit": true,
+        "resolve_time_s": 0.01
+    }
+
+On failure:
+    {"error": "..."}
+"""
+class YtDlpResolver:
+
+    SOCKET_PATH = '/tmp/piwall2_ytdlp_resolver.sock'
+
+    # Media URLs contain an `expire` query parameter. Stop using cached info this long before the URLs expire, so
+    # that a download doesn't start with a URL that is about to expire.
+    __EXPIRY_MARGIN_S = 60 * 30
+
+    __STATS_LOGS_PER_SECOND = 1 / 600
+
+    def __init__(self, cache_ttl_s):
+        self.__cache_ttl_s = cache_ttl_s
+
+        # dict keyed by URL. Each value is a dict with the keys: info (yt-dlp's unprocessed info dict) and expire_time
+        self.__info_cache = {}
+
+        # YoutubeDL instances, keyed by format selector. YoutubeDL instances are not thread safe.
+        self.__ydls = {}
+        self.__lock = threading.Lock()
+
+        self.__stats = {
+            'cold': {'count': 0, 'total_time_s': 0},
+            'warm': {'count': 0, 'total_time_s': 0},
+        }
+        self.__last_stats_log_time = time.time()
+
+    def serve(self):
+        try:
+            os.remove(self.SOCKET_PATH)
+        except FileNotFoundError:
+            pass
+
+        resolver = self
+        class RequestHandler(socketserver.StreamRequestHandler):
+            def handle(self):
+                resolver.handle_request(self.rfile, self.wfile)
+
+        server = socketserver.ThreadingUnixStreamServer(self.SOCKET_PATH, RequestHandler)
+        server.daemon_threads = True
+        self.__log('info', f"Using yt-dlp version {yt_dlp.version.__version__}. Listening on {self.SOCKET_PATH} ...")
+        server.serve_forever()
+
+    def handle_request(self, rfile, wfile):
+        try:
+            request = json.loads(rfile.readline())
+            response = self.__resolve(request['url'], request['formats'])
+        except Exception as e:
+            self.__log('error', 'Caught exception: {}'.format(traceback.format_exc()))
+            response = {'error': str(e)}
+        wfile.write((json.dumps(response) + "\n").encode())
+
+    def __resolve(self, url, format_selectors_by_name):
+        start_time = time.time()
+        with self.__lock:
+            is_cache_hit = True
+            cache_entry = self.__info_cache.get(url)
+            if cache_entry is None or time.time() >= cache_entry['expire_time']:
+                is_cache_hit = False
+                info = self.__get_ydl(None).extract_info(url, download = False, process = False)
+                cache_entry = {'info': info, 'expire_time': self.__get_expire_time(info)}
+                self.__info_cache[url] = cache_entry
+
+            formats = {}
+            for name, format_selector in format_selectors_by_name.items():
+                formats[name] = self.__select_format(cache_entry['info'], format_selector)
+
+            if cache_entry['expire_time'] == float('inf'):
+                # We couldn't determine when the media URLs expire until we had selected the formats
+                cache_entry['expire_time'] = min(
+                    [self.__get_expire_time(f) for f in formats.values()] +
+                    [time.time() + self.__cache_ttl_s]
+                )
+            self.__remove_expired_cache_entries()
+
+            resolve_time_s = time.time() - start_time
+            cache_state = 'warm' if is_cache_hit else 'cold'
+            self.__stats[cache_state]['count'] += 1
+            self.__stats[cache_state]['total_time_s'] += resolve_time_s
+            self.__maybe_log_stats()
+        self.__log('info', f"Resolved {url} in {round(resolve_time_s, 3)}s ({cache_state}).")
+
+        return {
+            'formats': formats,
+            'is_cache_hit': is_cache_hit,
+            'resolve_time_s': resolve_time_s,
+        }
+
+    def __select_format(self, info, format_selector):
+        processed_info = self.__get_ydl(format_selector).process_ie_result(copy.deepcopy(info), download = False)
+
+        # A format selector like 'bestvideo+bestaudio' selects multiple formats that would be merged. We only pass
+        # format selectors that select a single format.
+        selected_format = processed_info
+        if 'requested_formats' in processed_info:
+            selected_format = processed_info['requested_formats'][0]
+
+        protocol = selected_format.get('protocol', '')
+        if protocol not in ('http', 'https'):
+            raise Exception(f"Unsupported protocol for format {selected_format.get('format_id')}: {protocol}.")
+
+        return {
+            'url': selected_format['url'],
+            'http_headers': selected_format.get('http_headers', {}),
+            'format_id': selected_format.get('format_id'),
+        }
+
+    def __get_ydl(self, format_selector):
+        if format_selector not in self.__ydls:
+            opts = {
+                'quiet': True,
+                'no_warnings': True,
+                'noplaylist': True,
+                'retries': 10,
+            }
+            if format_selector is not None:
+                opts['format'] = format_selector
+            self.__ydls[format_selector] = yt_dlp.YoutubeDL(opts)
+        return self.__ydls[format_selector]
+
+    # Returns when the info's media URLs expire, according to their `expire` query parameters. Returns infinity if
+    # none of the URLs have an `expire` query parameter.
+    def __get_expire_time(self, info):
+        urls = []
+        if 'url' in info:
+            urls.append(info['url'])
+        for format in info.get('formats') or []:
+            if 'url' in format:
+                urls.append(format['url'])
+
+        expire_time = float('inf')
+        for url in urls:
+            query = urllib.parse.parse_qs(urllib.parse.urlparse(url).query)
+            if 'expire' in query:
+                try:
+                    expire_time = min(expire_time, int(query['expire'][0]) - self.__EXPIRY_MARGIN_S)
+                except ValueError:
+                    pass
+        if expire_time == float('inf'):
+            return expire_time
+        return min(expire_time, time.time() + self.__cache_ttl_s)
+
+    def __remove_expired_cache_entries(self):
+        now = time.time()
+        for url in list(self.__info_cache.keys()):
+            if now >= self.__info_cache[url]['expire_time']:
+                del self.__info_cache[url]
+
+    def __maybe_log_stats(self):
+        if (time.time() - self.__last_stats_log_time) < (1 / self.__STATS_LOGS_PER_SECOND):
+            return
+        self.__last_stats_log_time = time.time()
+
+        stats_strs = []
+        for cache_state, stats in self.__stats.items():
+            average_time_s = 0
+            if stats['count'] > 0:
+                average_time_s = round(stats['total_time_s'] / stats['count'], 3)
+            stats_strs.append(f"{cache_state}: {stats['count']} resolves averaging {average_time_s}s")
+        self.__log('info', f"Resolve stats: {', '.join(stats_strs)}. Cached URLs: {len(self.__info_cache)}.")
+
+    # Log in the same format as piwall2.logger.Logger, which we can't import here.
+    def __log(self, level, msg):
+        file = sys.stdout if level == 'info' else sys.stderr
+        print(datetime.datetime.now(datetime.timezone.utc).isoformat() +
+            " [" + level + "] [" + self.__class__.__name__ + "] [] " + msg, file = file, flush = True)
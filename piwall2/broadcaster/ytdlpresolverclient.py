@@ -0,0 +1,56 @@
+import json
+import socket
+import time
+
+from piwall2.config import Config
+from piwall2.logger import Logger
+
+# Client for the yt-dlp resolver service. See: YtDlpResolver
+class YtDlpResolverClient:
+
+    # This must match YtDlpResolver.SOCKET_PATH. We can't import YtDlpResolver here, because it imports yt_dlp, which is
+    # only installed for yt-dlp's python interpreter.
+    __SOCKET_PATH = '/tmp/piwall2_ytdlp_resolver.sock'
+
+    # Resolving a URL that isn't cached may take several seconds on a raspberry pi.
+    __TIMEOUT_S = 30
+
+    def __init__(self):
+        self.__logger = Logger().set_namespace(self.__class__.__name__)
+        self.__is_enabled = Config.get('use_ytdlp_resolver', True)
+
+    """
+    format_selectors_by_name: dict of youtube-dl format selectors, e.g.: {'video': '...', 'audio': '...'}
+
+    Returns a dict with the same keys as format_selectors_by_name. Each value is a dict with the keys: url,
+    http_headers, and format_id. Returns None if the resolver is disabled, not running, or unable to resolve the URL,
+    in which case the caller should fall back to running yt-dlp.
+    """
+    def resolve(self, url, format_selectors_by_name):
+        if not self.__is_enabled:
+            return None
+
+        start_time = time.time()
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.__TIMEOUT_S)
+        try:
+            sock.connect(self.__SOCKET_PATH)
+            request = {'url': url, 'formats': format_selectors_by_name}
+            sock.sendall((json.dumps(request) + "\n").encode())
+            response = json.loads(sock.makefile('rb').readline())
+        except Exception as e:
+            self.__logger.warning(f"Unable to resolve {url} via the yt-dlp resolver, falling back to yt-dlp: {e}")
+            return None
+        finally:
+            sock.close()
+
+        if 'error' in response:
+            self.__logger.warning(f"The yt-dlp resolver was unable to resolve {url}, falling back to yt-dlp: " +
+                f"{response['error']}")
+            return None
+
+        cache_state = 'warm' if response['is_cache_hit'] else 'cold'
+        format_ids = {name: resolved_format['format_id'] for name, resolved_format in response['formats'].items()}
+        self.__logger.info(f"Resolved {url} in {round(time.time() - start_time, 3)}s ({cache_state}; the resolver " +
+            f"took {round(response['resolve_time_s'], 3)}s). Formats: {format_ids}.")
+        return response['formats']
@@ -21,10 +21,13 @@ class CmdRunner:
     ]
     __CONCURRENCY_LIMIT = 16
 
-    def __init__(self):
+    # Commands are run on receivers_list, e.g. only the receivers that are live (see: ReceiverRoster), or on all
+    # the configured receivers if it is None.
+    def __init__(self, receivers_list = None):
         self.__logger = Logger().set_namespace(self.__class__.__name__)
-        config_loader = ConfigLoader()
-        self.__receivers_list = config_loader.get_receivers_list()
+        if receivers_list is None:
+            receivers_list = ConfigLoader().get_receivers_list()
+        self.__receivers_list = list(receivers_list)
 
         # populate self.__broadcaster_and_receivers_list
         broadcaster_hostname = self.get_broadcaster_hostname()
@@ -47,6 +50,9 @@ class CmdRunner:
         if include_broadcaster:
             machines_list = self.__broadcaster_and_receivers_list
 
+        if not machines_list:
+            raise Exception(f"No machines to run cmd: [{cmd}] on.")
+
         machines_string = ''
         for machine in machines_list:
             machines_string += f'pi@{machine},'
@@ -1,9 +1,11 @@
+import hashlib
 import json
 import math
 import socket
 import subprocess
 import toml
 
+from piwall2.config import Config
 from piwall2.directoryutils import DirectoryUtils
 from piwall2.logger import Logger
 from piwall2.tv import Tv
@@ -33,6 +35,7 @@ class ConfigLoader:
     __local_ip_address = None
     __wall_rows = None
     __wall_columns = None
+    __config_hash = None
 
     __APP_TV_CONFIG_FILE = DirectoryUtils().root_dir + "/app/src/tv_config.json"
 
@@ -48,11 +51,19 @@ class ConfigLoader:
     # keyed by this hostname. Returns None if no matching stanza is found. This generally only makes
     # sense to run on a receiver host.
     def get_own_receiver_config_stanza(self):
+        receiver = self.get_own_receiver_name()
+        if receiver is None:
+            return None
+        return self.get_receivers_config()[receiver]
+
+    # returns the name this host is listed under in the receivers config: either its hostname or its IP address.
+    # Returns None if this host is not a receiver.
+    def get_own_receiver_name(self):
         receivers_config = self.get_receivers_config()
         if ConfigLoader.__hostname in receivers_config:
-            return receivers_config[ConfigLoader.__hostname]
+            return ConfigLoader.__hostname
         elif ConfigLoader.__local_ip_address in receivers_config:
-            return receivers_config[ConfigLoader.__local_ip_address]
+            return ConfigLoader.__local_ip_address
         else:
             return None
 
@@ -63,6 +74,20 @@ class ConfigLoader:
     def get_raw_config(self):
         return ConfigLoader.__raw_config
 
+    # Returns a hash of the contents of the config files. This may be compared across hosts to detect receivers
+    # whose config is out of sync with the broadcaster's config. See: utils/copy_config_to_receivers
+    def get_config_hash(self):
+        if ConfigLoader.__config_hash is None:
+            md5 = hashlib.md5()
+            for config_path in [self.CONFIG_PATH, Config.CONFIG_PATH]:
+                try:
+                    with open(config_path, 'rb') as config_file:
+                        md5.update(config_file.read())
+                except FileNotFoundError:
+                    pass
+            ConfigLoader.__config_hash = md5.hexdigest()
+        return ConfigLoader.__config_hash
+
     # returns a dict that has a key 'tvs'. This key maps to a dict of TVs and their configuration, and is
     # keyed by tv_id. A single receiver may be present in the 'tvs' dict twice if it has two TVs.
     def get_tv_config(self):
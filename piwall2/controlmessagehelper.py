@@ -8,7 +8,9 @@ from piwall2.multicasthelper import MulticastHelper
 # 2) signalling for starting video playback
 # 3) signalling for skipping a video
 # 4) signalling when to apply video effects, like adjusting the video tiling mode
-# 5) etc
+# 5) periodically sending a snapshot of the whole wall's state, to ensure eventual consistency
+# 6) correcting for TVs that have drifted out of sync with each other
+# 7) etc
 class ControlMessageHelper:
 
     # Control message types
@@ -19,6 +21,8 @@ class ControlMessageHelper:
     TYPE_DISPLAY_MODE = 'display_mode'
     TYPE_SHOW_LOADING_SCREEN = 'type_show_loading_screen'
     TYPE_END_LOADING_SCREEN = 'type_end_loading_screen'
+    TYPE_WALL_STATE = 'wall_state'
+    TYPE_DRIFT_CORRECTION = 'drift_correction'
 
     CTRL_MSG_TYPE_KEY = 'msg_type'
     CONTENT_KEY = 'content'
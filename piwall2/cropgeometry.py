@@ -0,0 +1,183 @@
+from piwall2.configloader import ConfigLoader
+from piwall2.displaymode import DisplayMode
+from piwall2.logger import Logger
+from piwall2.tv import Tv
+
+"""
+Computes the crop coordinates that each TV uses to display its portion of a video, in each display mode.
+Fullscreen mode is like this: https://i.imgur.com/BBrA1Cr.png
+Tile mode is like this: https://i.imgur.com/cpS61s8.png
+
+The crop coordinates only depend on the video's dimensions and the wall's configuration, and almost all videos are
+one of a few common resolutions. Thus, the crop coordinates are memoized, and precomputed for the common
+resolutions. This keeps geometry math off the critical path of starting a video on the receivers.
+"""
+class CropGeometry:
+
+    COMMON_VIDEO_DIMENSIONS = ((1280, 720), (1920, 1080))
+
+    # dict keyed by (video_width, video_height, display_mode, receiver, tv_num), where receiver is the name of the
+    # receiver as it appears in the receivers config. Each value is a tuple of crop coordinates: (x0, y0, x1, y1)
+    __crop_cache = {}
+
+    def __init__(self):
+        self.__logger = Logger().set_namespace(self.__class__.__name__)
+        self.__config_loader = ConfigLoader()
+
+    # receivers: list of receiver names
+    def precompute(self, receivers):
+        for video_width, video_height in self.COMMON_VIDEO_DIMENSIONS:
+            for receiver in receivers:
+                self.get_crop_args(receiver, video_width, video_height)
+
+    """
+    Returns a tuple of two dicts: (crop_args, crop_args2), for each of the two TVs that may be hooked up to a
+    receiver. Each dict is keyed by display mode, and each value is a tuple of crop coordinates: (x0, y0, x1, y1).
+    If the receiver does not have dual video output, the crop coordinates in crop_args2 will be None.
+    """
+    def get_crop_args(self, receiver, video_width, video_height):
+        receiver_config = self.__config_loader.get_receivers_config()[receiver]
+        crop_args = {}
+        crop_args2 = {}
+        for display_mode in DisplayMode.DISPLAY_MODES:
+            crop_args[display_mode] = self.__get_crop(receiver, 1, display_mode, video_width, video_height)
+            crop_args2[display_mode] = None
+            if receiver_config['is_dual_video_output']:
+                crop_args2[display_mode] = self.__get_crop(receiver, 2, display_mode, video_width, video_height)
+        return (crop_args, crop_args2)
+
+    """
+    Returns the crop coordinates for every TV in the wall at once. Returns a dict keyed by tv_id. Each value is a
+    dict keyed by display mode, and each value of that is a tuple of crop coordinates: (x0, y0, x1, y1).
+
+    Computing this at startup validates the wall's configuration: any misconfiguration is logged once, rather than
+    on every video.
+    """
+    def get_wall_crop_table(self, video_width, video_height):
+        wall_crop_table = {}
+        for receiver in self.__config_loader.get_receivers_list():
+            crop_args, crop_args2 = self.get_crop_args(receiver, video_width, video_height)
+            wall_crop_table[Tv(receiver, 1).tv_id] = crop_args
+            if self.__config_loader.get_receivers_config()[receiver]['is_dual_video_output']:
+                wall_crop_table[Tv(receiver, 2).tv_id] = crop_args2
+        return wall_crop_table
+
+    def __get_crop(self, receiver, tv_num, display_mode, video_width, video_height):
+        key = (video_width, video_height, display_mode, receiver, tv_num)
+        if key not in CropGeometry.__crop_cache:
+            CropGeometry.__crop_cache[key] = self.__compute_crop(
+                receiver, tv_num, display_mode, video_width, video_height
+            )
+        return CropGeometry.__crop_cache[key]
+
+    def __compute_crop(self, receiver, tv_num, display_mode, video_width, video_height):
+        receiver_config = self.__config_loader.get_receivers_config()[receiver]
+        suffix = '' if tv_num == 1 else '2'
+        tv_x = receiver_config['x' + suffix]
+        tv_y = receiver_config['y' + suffix]
+        tv_width = receiver_config['width' + suffix]
+        tv_height = receiver_config['height' + suffix]
+
+        if display_mode == DisplayMode.DISPLAY_MODE_TILE:
+            displayable_video_width, displayable_video_height = (
+                self.__get_displayable_video_dimensions_for_screen(video_width, video_height, tv_width, tv_height)
+            )
+            x_offset = (video_width - displayable_video_width) / 2
+            y_offset = (video_height - displayable_video_height) / 2
+            return (
+                round(x_offset),
+                round(y_offset),
+                round(x_offset + displayable_video_width),
+                round(y_offset + displayable_video_height),
+            )
+
+        # fullscreen mode
+        wall_width = self.__config_loader.get_wall_width()
+        wall_height = self.__config_loader.get_wall_height()
+        displayable_video_width, displayable_video_height = (
+            self.__get_displayable_video_dimensions_for_screen(video_width, video_height, wall_width, wall_height)
+        )
+        x_offset = (video_width - displayable_video_width) / 2
+        y_offset = (video_height - displayable_video_height) / 2
+
+        x0 = round(x_offset + ((tv_x / wall_width) * displayable_video_width))
+        y0 = round(y_offset + ((tv_y / wall_height) * displayable_video_height))
+        x1 = round(x_offset + (((tv_x + tv_width) / wall_width) * displayable_video_width))
+        y1 = round(y_offset + (((tv_y + tv_height) / wall_height) * displayable_video_height))
+
+        tv_id = Tv(receiver, tv_num).tv_id
+        for name, coordinate, video_dimension_name, video_dimension in [
+            ('x0', x0, 'video_width', video_width), ('x1', x1, 'video_width', video_width),
+            ('y0', y0, 'video_height', video_height), ('y1', y1, 'video_height', video_height),
+        ]:
+            if coordinate > video_dimension:
+                self.__logger.warning(f"The crop {name} coordinate ({coordinate}) for {tv_id} " +
+                    f"was greater than the {video_dimension_name} ({video_dimension}). This may indicate a " +
+                    "misconfiguration.")
+
+        return (x0, y0, x1, y1)
+
+    """
+    The displayable width and height represents the section of the video that the wall will be
+    displaying. A section of these dimensions will be taken from the center of the original
+    video.
+
+    Currently, the piwall only supports displaying videos in "fill" mode (as opposed to
+    "letterbox" or "stretch"). This means that every portion of the TVs will be displaying
+    some section of the video (i.e. there will be no letterboxing). Furthermore, there will be
+    no warping of the video's aspect ratio. Instead, regions of the original video will be
+    cropped or stretched if necessary.
+
+    The units of the width and height arguments are not important. We are just concerned with
+    the aspect ratio. Thus, as long as video_width and video_height are in the same units
+    (probably pixels), and as long as screen_width and screen_height are in the same units
+    (probably inches or centimeters), everything will work.
+
+    The returned dimensions will be in the units of the inputted video_width and video_height
+    (probably pixels).
+    """
+    def __get_displayable_video_dimensions_for_screen(self, video_width, video_height, screen_width, screen_height):
+        video_aspect_ratio = video_width / video_height
+        screen_aspect_ratio = screen_width / screen_height
+        if screen_aspect_ratio >= video_aspect_ratio:
+            displayable_video_width = video_width
+            displayable_video_height = video_width / screen_aspect_ratio
+            """
+            Note that `video_width = video_aspect_ratio * video_height`.
+            Thus, via substitution, we have:
+                displayable_video_height = (video_aspect_ratio * video_height) / screen_aspect_ratio
+                displayable_video_height = (video_aspect_ratio / screen_aspect_ratio) * video_height
+
+            And because of the above inequality, we know that:
+                (video_aspect_ratio / screen_aspect_ratio) <= 1
+
+            Thus, in this case, we have: `displayable_video_height <= video_height`. The video height
+            will be "cropped" such that when the video is proportionally stretched, it will fill the
+            screen size.
+            """
+
+        else:
+            displayable_video_height = video_height
+            displayable_video_width = screen_aspect_ratio * video_height
+            """
+            Note that `video_height = video_width / video_aspect_ratio`.
+            Thus, via substitution, we have:
+                displayable_video_width = screen_aspect_ratio * (video_width / video_aspect_ratio)
+                displayable_video_width = video_width * (screen_aspect_ratio / video_aspect_ratio)
+
+            And because of the above inequality for which we are now in the `else` clause, we know that:
+                (screen_aspect_ratio / video_aspect_ratio) <= 1
+
+            Thus, in this case, we have: `displayable_video_width <= video_width`. The video width
+            will be "cropped" such that when the video is proportionally stretched, it will fill the
+            screen size.
+            """
+
+        if displayable_video_width > video_width:
+            self.__logger.warning(f"The displayable_video_width ({displayable_video_width}) " +
+                f"was greater than the video_width ({video_width}). This may indicate a misconfiguration.")
+        if displayable_video_height > video_height:
+            self.__logger.warning(f"The displayable_video_height ({displayable_video_height}) " +
+                f"was greater than the video_height ({video_height}). This may indicate a misconfiguration.")
+
+        return (displayable_video_width, displayable_video_height)
@@ -1,4 +1,5 @@
 import piwall2.broadcaster.settingsdb
+from piwall2.broadcaster.queuenotifier import QueueNotifier
 from piwall2.configloader import ConfigLoader
 from piwall2.controlmessagehelper import ControlMessageHelper
 
@@ -33,6 +34,7 @@ class DisplayMode:
             )
             db_data[db_key] = display_mode
         success = self.__settings_db.set_multi(db_data)
+        QueueNotifier.notify(QueueNotifier.EVENT_DISPLAY_MODE)
         return success
 
     def get_display_mode_by_tv_id(self):
@@ -75,4 +77,6 @@ class DisplayMode:
             new_display_mode_by_tv_id[tv_id] = new_display_mode
 
         self.__control_message_helper.send_msg(ControlMessageHelper.TYPE_DISPLAY_MODE, new_display_mode_by_tv_id)
-        return self.__settings_db.set_multi(new_display_modes_for_db)
+        success = self.__settings_db.set_multi(new_display_modes_for_db)
+        QueueNotifier.notify(QueueNotifier.EVENT_DISPLAY_MODE)
+        return success
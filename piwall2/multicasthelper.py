@@ -14,6 +14,10 @@ class MulticastHelper:
     # E.g. volume control commands.
     CONTROL_PORT = 1236
 
+    # Messages will be sent from the receivers to the broadcaster over the telemetry port.
+    # E.g. receiver heartbeats.
+    TELEMETRY_PORT = 1237
+
     # 2 MB. This will be doubled to 4MB when we set it via setsockopt.
     __VIDEO_SOCKET_RECEIVE_BUFFER_SIZE_BYTES = 2097152
 
@@ -68,11 +72,22 @@ class MulticastHelper:
         self.__receive_control_socket = self.__make_receive_socket(self.ADDRESS, self.CONTROL_PORT)
         return self
 
+    # Receivers send telemetry messages to the broadcaster using the same static send socket that the
+    # broadcaster uses to send messages to the receivers.
+    def setup_receiver_telemetry_socket(self):
+        return self.setup_broadcaster_socket()
+
+    def setup_broadcaster_telemetry_socket(self):
+        self.__receive_telemetry_socket = self.__make_receive_socket(self.ADDRESS, self.TELEMETRY_PORT)
+        return self
+
     def send(self, msg, port):
         if port == self.VIDEO_PORT:
             self.__logger.debug(f"Sending video stream message: {msg}")
         elif port == self.CONTROL_PORT:
             self.__logger.debug(f"Sending control message: {msg}")
+        elif port == self.TELEMETRY_PORT:
+            self.__logger.debug(f"Sending telemetry message: {msg}")
 
         address_tuple = (self.ADDRESS, port)
         msg_remainder = msg
@@ -108,12 +123,17 @@ class MulticastHelper:
             return self.__receive_video_socket.recv(self.__MAX_MSG_SIZE)
         elif port == self.CONTROL_PORT:
             return self.__receive_control_socket.recv(self.__MAX_MSG_SIZE)
+        elif port == self.TELEMETRY_PORT:
+            return self.__receive_telemetry_socket.recv(self.__MAX_MSG_SIZE)
         else:
             raise Exception(f'Unexpected port: {port}.')
 
     def get_receive_video_socket(self):
         return self.__receive_video_socket
 
+    def get_receive_telemetry_socket(self):
+        return self.__receive_telemetry_socket
+
     def __make_receive_socket(self, address, port):
         sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
         sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
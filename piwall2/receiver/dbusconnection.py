@@ -0,0 +1,382 @@
+import os
+import select
+import socket
+import struct
+import threading
+
+from piwall2.logger import Logger
+
+# A minimal, pure-python D-Bus client. It holds a single long-lived connection to a D-Bus bus and sends method
+# calls over it. This avoids spawning a `dbus-send` process for each method call, which takes about 3-20ms.
+#
+# Only the subset of the D-Bus wire protocol that we need to control omxplayer is implemented:
+# 1) connecting to `unix:path=...` and `unix:abstract=...` addresses
+# 2) the EXTERNAL authentication mechanism
+# 3) sending method calls, optionally waiting for their reply
+# 4) (un)marshalling of the basic types, variants, arrays, structs, and dict entries
+#
+# See: https://dbus.freedesktop.org/doc/dbus-specification.html
+class DbusConnection:
+
+    __MESSAGE_TYPE_METHOD_CALL = 1
+    __MESSAGE_TYPE_METHOD_RETURN = 2
+    __MESSAGE_TYPE_ERROR = 3
+
+    __FLAG_NO_REPLY_EXPECTED = 0x1
+
+    __HEADER_FIELD_PATH = 1
+    __HEADER_FIELD_INTERFACE = 2
+    __HEADER_FIELD_MEMBER = 3
+    __HEADER_FIELD_ERROR_NAME = 4
+    __HEADER_FIELD_REPLY_SERIAL = 5
+    __HEADER_FIELD_DESTINATION = 6
+    __HEADER_FIELD_SIGNATURE = 8
+
+    __PROTOCOL_VERSION = 1
+
+    # format character for struct.pack and alignment, keyed by D-Bus type code
+    __FIXED_TYPES = {
+        'y': ('B', 1),
+        'b': ('I', 4),
+        'n': ('h', 2),
+        'q': ('H', 2),
+        'i': ('i', 4),
+        'u': ('I', 4),
+        'x': ('q', 8),
+        't': ('Q', 8),
+        'd': ('d', 8),
+        'h': ('I', 4),
+    }
+
+    def __init__(self, address):
+        self.__logger = Logger().set_namespace(self.__class__.__name__)
+        self.__address = address
+        self.__socket = None
+        self.__serial = 0
+        self.__read_buffer = b''
+
+        # Multiple threads may share a connection. Only one may use the socket at a time.
+        self.__lock = threading.Lock()
+
+    def get_address(self):
+        return self.__address
+
+    def connect(self):
+        with self.__lock:
+            if self.__socket is not None:
+                return self
+            self.__socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                self.__socket.connect(self.__parse_address(self.__address))
+                self.__authenticate()
+                self.__read_buffer = b''
+                self.__serial = 0
+                self.__hello()
+            except Exception as e:
+                self.__close_socket()
+                raise e
+        self.__logger.info(f"Connected to dbus at address: {self.__address}.")
+        return self
+
+    def close(self):
+        with self.__lock:
+            self.__close_socket()
+
+    def is_connected(self):
+        return self.__socket is not None
+
+    """
+    Sends a method call.
+
+    signature: the D-Bus signature of the arguments, e.g. 'ssv'
+    args: a list of arguments. Variants must be passed as a tuple of (signature, value), e.g. ('d', 0.5)
+    expect_reply: if False, the call is sent with the NO_REPLY_EXPECTED flag, and this method returns as soon as
+        the call is written to the socket. If True, this method blocks until the reply is received, and returns a
+        list of the reply's arguments.
+
+    Raises an exception if the connection fails, or if the reply is an error. The connection is closed on failure,
+    and a subsequent call to `connect` will reconnect.
+    """
+    def call_method(self, destination, path, interface, member, signature = '', args = None,
+            expect_reply = False, timeout_s = 2):
+        if args is None:
+            args = []
+        with self.__lock:
+            if self.__socket is None:
+                raise Exception(f"Not connected to dbus at address: {self.__address}.")
+            try:
+                serial = self.__send_method_call(destination, path, interface, member, signature, args, expect_reply)
+                if not expect_reply:
+                    self.__discard_pending_messages()
+                    return None
+                return self.__receive_reply(serial, timeout_s)
+            except DbusError as e:
+                raise e
+            except Exception as e:
+                self.__close_socket()
+                raise e
+
+    def __close_socket(self):
+        if self.__socket is None:
+            return
+        try:
+            self.__socket.close()
+        except Exception:
+            pass
+        self.__socket = None
+
+    # Supports addresses of the form: `unix:abstract=/tmp/dbus-XXXXXXXX,guid=...` and `unix:path=/path/to/socket`.
+    # If multiple addresses are separated by semicolons, the first supported one is used.
+    def __parse_address(self, address):
+        for transport_address in address.split(';'):
+            transport, _, params_str = transport_address.partition(':')
+            if transport != 'unix':
+                continue
+            params = {}
+            for param in params_str.split(','):
+                key, _, value = param.partition('=')
+                params[key] = self.__unescape_address_value(value)
+            if 'abstract' in params:
+                return '\0' + params['abstract']
+            if 'path' in params:
+                return params['path']
+        raise Exception(f"Unsupported dbus address: {address}.")
+
+    def __unescape_address_value(self, value):
+        unescaped = bytearray()
+        i = 0
+        while i < len(value):
+            if value[i] == '%':
+                unescaped.append(int(value[i + 1:i + 3], 16))
+                i += 3
+            else:
+                unescaped.extend(value[i].encode())
+                i += 1
+        return unescaped.decode()
+
+    def __authenticate(self):
+        # The client must send a single nul byte before the authentication protocol begins.
+        uid_hex = str(os.geteuid()).encode().hex()
+        self.__socket.sendall(b'\0' + f'AUTH EXTERNAL {uid_hex}\r\n'.encode())
+        response = self.__read_line()
+        if not response.startswith(b'OK '):
+            raise Exception(f"Dbus authentication failed: {response}.")
+        self.__socket.sendall(b'BEGIN\r\n')
+
+    def __read_line(self):
+        line = b''
+        while not line.endswith(b'\r\n'):
+            chunk = self.__socket.recv(1)
+            if not chunk:
+                raise Exception("Dbus connection closed during authentication.")
+            line += chunk
+        return line
+
+    # The first message sent on a bus connection must be a call to Hello.
+    def __hello(self):
+        serial = self.__send_method_call('org.freedesktop.DBus', '/org/freedesktop/DBus', 'org.freedesktop.DBus',
+            'Hello', '', [], expect_reply = True)
+        unique_name = self.__receive_reply(serial, timeout_s = 2)[0]
+        self.__logger.debug(f"Got dbus unique name: {unique_name}.")
+
+    def __send_method_call(self, destination, path, interface, member, signature, args, expect_reply):
+        self.__serial += 1
+        body = bytearray()
+        self.__marshal(body, signature, args)
+
+        fields = [
+            (self.__HEADER_FIELD_PATH, ('o', path)),
+            (self.__HEADER_FIELD_MEMBER, ('s', member)),
+        ]
+        if interface:
+            fields.append((self.__HEADER_FIELD_INTERFACE, ('s', interface)))
+        if destination:
+            fields.append((self.__HEADER_FIELD_DESTINATION, ('s', destination)))
+        if signature:
+            fields.append((self.__HEADER_FIELD_SIGNATURE, ('g', signature)))
+
+        flags = 0 if expect_reply else self.__FLAG_NO_REPLY_EXPECTED
+        msg = bytearray(struct.pack('<cBBBII', b'l', self.__MESSAGE_TYPE_METHOD_CALL, flags,
+            self.__PROTOCOL_VERSION, len(body), self.__serial))
+        self.__marshal(msg, 'a(yv)', [fields])
+        self.__pad(msg, 8)
+        msg.extend(body)
+        self.__socket.sendall(msg)
+        return self.__serial
+
+    # Blocks until the reply to the method call with the given serial is received. Other messages that are
+    # received in the meantime, e.g. signals, are discarded.
+    def __receive_reply(self, serial, timeout_s):
+        while True:
+            msg_type, fields, body = self.__read_message(timeout_s)
+            if fields.get(self.__HEADER_FIELD_REPLY_SERIAL) != serial:
+                continue
+            if msg_type == self.__MESSAGE_TYPE_ERROR:
+                raise DbusError(fields.get(self.__HEADER_FIELD_ERROR_NAME), body)
+            if msg_type == self.__MESSAGE_TYPE_METHOD_RETURN:
+                return body
+
+    # When we don't wait for replies, we still need to read whatever the bus sends us (e.g. the NameAcquired
+    # signal), so that the socket's receive buffer never fills up.
+    def __discard_pending_messages(self):
+        while select.select([self.__socket], [], [], 0)[0]:
+            self.__read_message(timeout_s = 0.1)
+
+    # Returns a tuple of: (message type, dict of header fields, list of body arguments)
+    def __read_message(self, timeout_s):
+        prefix = self.__read_exactly(16, timeout_s)
+        endian = '<' if prefix[0:1] == b'l' else '>'
+        msg_type = prefix[1]
+        body_length, _, fields_length = struct.unpack(endian + 'III', prefix[4:16])
+        header_length = 16 + fields_length
+        header_length += (-header_length) % 8
+        msg = prefix + self.__read_exactly(header_length - 16 + body_length, timeout_s)
+
+        raw_fields, _ = self.__unmarshal(msg, 12, 'a(yv)', endian)
+        fields = {}
+        for code, (_, value) in raw_fields[0]:
+            fields[code] = value
+        body = []
+        if body_length > 0:
+            body, _ = self.__unmarshal(msg[header_length:], 0, fields.get(self.__HEADER_FIELD_SIGNATURE, ''), endian)
+        return msg_type, fields, body
+
+    def __read_exactly(self, num_bytes, timeout_s):
+        while len(self.__read_buffer) < num_bytes:
+            if not select.select([self.__socket], [], [], timeout_s)[0]:
+                raise Exception(f"Timed out waiting for dbus message after {timeout_s}s.")
+            chunk = self.__socket.recv(65536)
+            if not chunk:
+                raise Exception("Dbus connection closed.")
+            self.__read_buffer += chunk
+        data = self.__read_buffer[:num_bytes]
+        self.__read_buffer = self.__read_buffer[num_bytes:]
+        return data
+
+    # Splits a signature into a list of single complete types, e.g. 'sa{sv}(ii)' -> ['s', 'a{sv}', '(ii)']
+    def __split_signature(self, signature):
+        types = []
+        i = 0
+        while i < len(signature):
+            start = i
+            while signature[i] == 'a':
+                i += 1
+            if signature[i] in '({':
+                depth = 0
+                while True:
+                    if signature[i] in '({':
+                        depth += 1
+                    elif signature[i] in ')}':
+                        depth -= 1
+                    i += 1
+                    if depth == 0:
+                        break
+            else:
+                i += 1
+            types.append(signature[start:i])
+        return types
+
+    def __get_alignment(self, type_sig):
+        code = type_sig[0]
+        if code in self.__FIXED_TYPES:
+            return self.__FIXED_TYPES[code][1]
+        if code in 'so' or code == 'a':
+            return 4
+        if code in '({':
+            return 8
+        return 1 # 'g' and 'v'
+
+    def __pad(self, buf, alignment):
+        buf.extend(b'\0' * ((-len(buf)) % alignment))
+
+    def __marshal(self, buf, signature, values):
+        for type_sig, value in zip(self.__split_signature(signature), values):
+            self.__marshal_one(buf, type_sig, value)
+
+    def __marshal_one(self, buf, type_sig, value):
+        code = type_sig[0]
+        self.__pad(buf, self.__get_alignment(type_sig))
+        if code in self.__FIXED_TYPES:
+            buf.extend(struct.pack('<' + self.__FIXED_TYPES[code][0], value))
+        elif code in 'so':
+            encoded = value.encode()
+            buf.extend(struct.pack('<I', len(encoded)) + encoded + b'\0')
+        elif code == 'g':
+            encoded = value.encode()
+            buf.extend(struct.pack('<B', len(encoded)) + encoded + b'\0')
+        elif code == 'v':
+            variant_sig, variant_value = value
+            self.__marshal_one(buf, 'g', variant_sig)
+            self.__marshal_one(buf, variant_sig, variant_value)
+        elif code == 'a':
+            element_sig = type_sig[1:]
+            length_offset = len(buf)
+            buf.extend(b'\0\0\0\0')
+            # The padding between the array length and the first element is not included in the array length.
+            self.__pad(buf, self.__get_alignment(element_sig))
+            elements_start = len(buf)
+            if element_sig[0] == '{' and isinstance(value, dict):
+                value = value.items()
+            for element in value:
+                self.__marshal_one(buf, element_sig, element)
+            struct.pack_into('<I', buf, length_offset, len(buf) - elements_start)
+        elif code in '({':
+            self.__marshal(buf, type_sig[1:-1], value)
+        else:
+            raise Exception(f"Unsupported dbus type: {type_sig}.")
+
+    # Returns a tuple of: (list of values, offset after the last value)
+    def __unmarshal(self, buf, offset, signature, endian):
+        values = []
+        for type_sig in self.__split_signature(signature):
+            value, offset = self.__unmarshal_one(buf, offset, type_sig, endian)
+            values.append(value)
+        return values, offset
+
+    def __unmarshal_one(self, buf, offset, type_sig, endian):
+        code = type_sig[0]
+        offset += (-offset) % self.__get_alignment(type_sig)
+        if code in self.__FIXED_TYPES:
+            fmt = endian + self.__FIXED_TYPES[code][0]
+            value = struct.unpack_from(fmt, buf, offset)[0]
+            if code == 'b':
+                value = bool(value)
+            return value, offset + struct.calcsize(fmt)
+        elif code in 'so':
+            length = struct.unpack_from(endian + 'I', buf, offset)[0]
+            offset += 4
+            return bytes(buf[offset:offset + length]).decode(), offset + length + 1
+        elif code == 'g':
+            length = buf[offset]
+            offset += 1
+            return bytes(buf[offset:offset + length]).decode(), offset + length + 1
+        elif code == 'v':
+            variant_sig, offset = self.__unmarshal_one(buf, offset, 'g', endian)
+            value, offset = self.__unmarshal_one(buf, offset, variant_sig, endian)
+            return (variant_sig, value), offset
+        elif code == 'a':
+            element_sig = type_sig[1:]
+            length = struct.unpack_from(endian + 'I', buf, offset)[0]
+            offset += 4
+            offset += (-offset) % self.__get_alignment(element_sig)
+            end = offset + length
+            elements = []
+            while offset < end:
+                element, offset = self.__unmarshal_one(buf, offset, element_sig, endian)
+                elements.append(element)
+            if element_sig[0] == '{':
+                elements = dict(elements)
+            return elements, offset
+        elif code in '({':
+            values, offset = self.__unmarshal(buf, offset, type_sig[1:-1], endian)
+            return tuple(values), offset
+        else:
+            raise Exception(f"Unsupported dbus type: {type_sig}.")
+
+# Raised when a method call's reply is a D-Bus error, e.g. `org.freedesktop.DBus.Error.ServiceUnknown` when
+# the destination does not exist. The connection is still usable after this error.
+class DbusError(Exception):
+
+    def __init__(self, error_name, body):
+        self.error_name = error_name
+        super().__init__(f"{error_name}: {body}")
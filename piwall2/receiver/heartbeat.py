@@ -0,0 +1,71 @@
+import socket
+import subprocess
+import threading
+import time
+import traceback
+
+from piwall2.configloader import ConfigLoader
+from piwall2.directoryutils import DirectoryUtils
+from piwall2.logger import Logger
+from piwall2.telemetryhelper import TelemetryHelper
+
+# Periodically sends a heartbeat from the receiver to the broadcaster. The broadcaster uses the heartbeats
+# to keep a roster of which receivers are live. See: ReceiverRoster
+class Heartbeat:
+
+    HEARTBEATS_PER_SECOND = 0.5
+
+    def __init__(self, omxplayer_controller):
+        self.__logger = Logger().set_namespace(self.__class__.__name__)
+        self.__omxplayer_controller = omxplayer_controller
+        self.__telemetry_helper = TelemetryHelper().setup_for_receiver()
+        self.__start_time = time.time()
+
+        config_loader = ConfigLoader()
+        self.__receiver = config_loader.get_own_receiver_name()
+        self.__hostname = socket.gethostname() + ".local"
+        self.__config_hash = config_loader.get_config_hash()
+        self.__version = self.__get_version()
+
+    # Sends heartbeats from a daemon thread, so that the heartbeat does not block on the receiver's
+    # control message loop, and so that it does not prevent the receiver process from exiting.
+    def start(self):
+        thread = threading.Thread(target = self.__run, daemon = True)
+        thread.start()
+        return self
+
+    def __run(self):
+        while True:
+            try:
+                self.__send_heartbeat()
+            except Exception:
+                self.__logger.error('Caught exception: {}'.format(traceback.format_exc()))
+            time.sleep(1 / self.HEARTBEATS_PER_SECOND)
+
+    def __send_heartbeat(self):
+        msg = {
+            'receiver': self.__receiver,
+            'hostname': self.__hostname,
+            'version': self.__version,
+            'config_hash': self.__config_hash,
+            'uptime_s': round(time.time() - self.__start_time),
+            'failed_command_counts': self.__omxplayer_controller.get_failed_command_counts(),
+        }
+        self.__telemetry_helper.send_msg(TelemetryHelper.TYPE_HEARTBEAT, msg)
+
+    # Returns the git commit that the receiver is running.
+    def __get_version(self):
+        try:
+            return (subprocess
+                .check_output(
+                    f"git -C {DirectoryUtils().root_dir} rev-parse --short HEAD",
+                    shell = True,
+                    executable = '/usr/bin/bash',
+                    stderr = subprocess.DEVNULL
+                )
+                .decode("utf-8")
+                .strip()
+            )
+        except Exception:
+            self.__logger.warning('Unable to determine git version: {}'.format(traceback.format_exc()))
+            return None
@@ -1,10 +1,11 @@
 import getpass
 import math
-import re
-import shlex
-import subprocess
+import os
+import threading
+import time
 
 from piwall2.logger import Logger
+from piwall2.receiver.dbusconnection import DbusConnection, DbusError
 from piwall2.volumecontroller import VolumeController
 
 # Controls omxplayer via dbus.
@@ -17,138 +18,154 @@ class OmxplayerController:
     TV1_LOADING_SCREEN_DBUS_NAME = 'piwall.tv1.loadingscreen'
     TV2_VIDEO_DBUS_NAME = 'piwall.tv2.video'
     TV2_LOADING_SCREEN_DBUS_NAME = 'piwall.tv2.loadingscreen'
-
-    __DBUS_TIMEOUT_MS = 2000
-    __PARALLEL_CMD_TEMPLATE_PREFIX = (
-        f"parallel --will-cite --link --max-procs 0 " +
-        # Run all jobs even if one or more failed.
-        # Exit status: 1-100 Some of the jobs failed. The exit status gives the number of failed jobs.
-        "--halt never ")
-
-    # Ensure we don't have too many processes in flight that could overload CPU.
-    # Need to track the limits separately because in Queue.__maybe_set_receiver_state,
-    # we set volume and display_mode in quick succession. If we had a global limit of 1,
-    # we'd risk that the display_mode never gets set due to throttling.
-    __MAX_IN_FLIGHT_VOL_PROCS = 1
-    __MAX_IN_FLIGHT_CROP_PROCS = 1
+    TV1_ALT_VIDEO_DBUS_NAME = 'piwall.tv1.altvideo'
+    TV2_ALT_VIDEO_DBUS_NAME = 'piwall.tv2.altvideo'
+
+    # Consecutive videos alternate between two slots of players, so that the next video can be prerolled while the
+    # current video finishes playing. Each slot is a dict keyed by tv_num. See: Receiver
+    VIDEO_DBUS_NAMES_BY_SLOT = [
+        {1: TV1_VIDEO_DBUS_NAME, 2: TV2_VIDEO_DBUS_NAME},
+        {1: TV1_ALT_VIDEO_DBUS_NAME, 2: TV2_ALT_VIDEO_DBUS_NAME},
+    ]
+
+    __DBUS_TIMEOUT_S = 2
+    __DBUS_OBJECT_PATH = '/org/mpris/MediaPlayer2'
+    __PLAYER_INTERFACE = 'org.mpris.MediaPlayer2.Player'
+    __PROPERTIES_INTERFACE = 'org.freedesktop.DBus.Properties'
+
+    # Properties of a player that are set via the pending value slots. See: __set_pending_value
+    __PROPERTY_VOLUME = 'volume'
+    __PROPERTY_CROP = 'crop'
+
+    # Log a warning if applying a property change takes longer than this, measured from when it was requested.
+    __SLOW_PROPERTY_CHANGE_THRESHOLD_S = 0.1
+    __RETRY_BACKOFF_S = 0.5
+
+    """
+    Method calls are sent over one of several dbus connections, depending on who sends them. A call that waits for a
+    reply holds its connection until the reply arrives, for up to __DBUS_TIMEOUT_S, and closes the connection if the
+    reply times out, e.g. because the player is shutting down. Thus the calls that must go out in sync across the
+    wall, e.g. `play`, get a connection of their own, on which no call ever waits for a reply.
+
+    __CONNECTION_COMMANDS: fire-and-forget calls from the receiver's control message loop. See: __send_method_call
+    __CONNECTION_PENDING_VALUES: calls from the pending values worker thread. See: __drain_pending_values
+    __CONNECTION_STATUS: reads of the players' state, e.g. from the PlaybackSampler's thread.
+    """
+    __CONNECTION_COMMANDS = 'commands'
+    __CONNECTION_PENDING_VALUES = 'pending_values'
+    __CONNECTION_STATUS = 'status'
 
     def __init__(self):
         self.__logger = Logger().set_namespace(self.__class__.__name__)
         self.__user = getpass.getuser()
-        self.__dbus_addr = None
-        self.__dbus_pid = None
-        self.__load_dbus_session_info()
-        self.__in_flight_vol_procs = []
-        self.__in_flight_crop_procs = []
+        self.__dbus_addr_file_path = f"/tmp/omxplayerdbus.{self.__user}"
+
+        # dicts keyed by connection name, e.g. __CONNECTION_COMMANDS. The latter holds the (inode, mtime) of the dbus
+        # address file at the time we read the address for the connection. See: __get_dbus_connection
+        self.__dbus_connections = {}
+        self.__dbus_addr_file_stats = {}
+
+        # One lock per connection, so that (re)connecting one connection doesn't hold up calls on the others.
+        self.__dbus_connection_locks = {
+            connection_name: threading.Lock()
+            for connection_name in [
+                self.__CONNECTION_COMMANDS, self.__CONNECTION_PENDING_VALUES, self.__CONNECTION_STATUS
+            ]
+        }
+
+        # dict keyed by command, e.g. 'SetVideoCropPos' or 'Set:Volume'. Each value is the number of times the
+        # command failed. See: get_failed_command_counts
+        self.__failed_command_counts = {}
+        self.__failed_command_counts_lock = threading.Lock()
+
+        # dict keyed by (dbus_name, property). Each value is a dict with the keys: method_call, request_time,
+        # and num_coalesced. See: __set_pending_value
+        self.__pending_values = {}
+        self.__pending_values_cond = threading.Condition()
+        thread = threading.Thread(target = self.__drain_pending_values, daemon = True)
+        thread.start()
+
+    # Returns a dict keyed by command, e.g. 'SetVideoCropPos' or 'Set:Volume'. Each value is the number of times the
+    # command failed since the receiver started, e.g. because the player was not running or dbus was unreachable.
+    def get_failed_command_counts(self):
+        with self.__failed_command_counts_lock:
+            return dict(self.__failed_command_counts)
 
     # gets a perceptual loudness %
     # returns a float in the range [0, 100]
     # TODO: update this to account for multiple dbus names
     def get_vol_pct(self):
-        cmd = (f"sudo -u {self.__user} DBUS_SESSION_BUS_ADDRESS={self.__dbus_addr} DBUS_SESSION_BUS_PID={self.__dbus_pid} dbus-send " +
-            f"--print-reply=literal --session --reply-timeout={self.__DBUS_TIMEOUT_MS} " +
-            f"--dest={self.TV1_VIDEO_DBUS_NAME} /org/mpris/MediaPlayer2 org.freedesktop.DBus.Properties.Get " +
-            "string:'org.mpris.MediaPlayer2.Player' string:'Volume'")
-        vol_cmd_output = None
         try:
-            vol_cmd_output = (subprocess
-                .check_output(cmd, shell = True, executable = '/usr/bin/bash', stderr = subprocess.STDOUT)
-                .decode("utf-8"))
-        except Exception:
+            reply = self.__call_method(
+                self.__CONNECTION_STATUS, self.TV1_VIDEO_DBUS_NAME, self.__PROPERTIES_INTERFACE, 'Get', 'ss',
+                [self.__PLAYER_INTERFACE, 'Volume'], expect_reply = True
+            )
+        except Exception as e:
+            self.__logger.debug(f"Unable to get volume: {e}")
             return 0
 
-        m = re.search(r"\s+double\s+(\d+(\.\d*)?)", vol_cmd_output)
-        if m is None:
-            return 0
-        vol_pct = 100 * float(m.group(1))
+        _, omx_vol_pct = reply[0]
+        vol_pct = 100 * float(omx_vol_pct)
         vol_pct = max(0, vol_pct)
         vol_pct = min(100, vol_pct)
         return vol_pct
 
+    # Returns a dict with the keys:
+    #   position_s: the playback position in seconds
+    #   duration_s: the duration of the video in seconds. This is 0 when playing a video from stdin, as we do when
+    #       receiving a broadcast.
+    #   is_paused: boolean
+    # Returns None if the player is not running or did not respond.
+    #
+    # This waits for replies from the player, so it should not be called from the receiver's control message loop.
+    def get_playback_status(self, dbus_name):
+        status = {}
+        try:
+            for prop in ['Position', 'Duration', 'PlaybackStatus']:
+                reply = self.__call_method(
+                    self.__CONNECTION_STATUS, dbus_name, self.__PROPERTIES_INTERFACE, 'Get', 'ss',
+                    [self.__PLAYER_INTERFACE, prop], expect_reply = True
+                )
+                _, status[prop] = reply[0]
+        except Exception as e:
+            self.__logger.debug(f"Unable to get playback status for {dbus_name}: {e}")
+            return None
+
+        # omxplayer reports position and duration in microseconds
+        return {
+            'position_s': status['Position'] / 1000000,
+            'duration_s': status['Duration'] / 1000000,
+            'is_paused': status['PlaybackStatus'] != 'Playing',
+        }
+
     # pairs: a dict where each key is a dbus name and each value is a vol_pct.
     # vol_pct should be a float in the range [0, 100]. This is a perceptual loudness %.
     # e.g.: {'piwall.tv1.video': 99.8}
+    #
+    # The volume is applied asynchronously. Always returns True: the most recently requested volume for each
+    # player will be applied eventually, as long as the player is running.
     def set_vol_pct(self, pairs):
-        num_pairs = len(pairs)
-        if num_pairs <= 0:
-            return
-
-        if self.__are_too_many_procs_in_flight(self.__in_flight_vol_procs, self.__MAX_IN_FLIGHT_VOL_PROCS):
-            self.__logger.warning("Too many in-flight dbus processes; bailing without setting volume.")
-            return
-
-        vol_template = (self.__get_dbus_cmd_template_prefix() +
-            "org.freedesktop.DBus.Properties.Set string:'org.mpris.MediaPlayer2.Player' " +
-            "string:'Volume' double:{1} >/dev/null 2>&1")
-
-        if num_pairs == 1:
-            dbus_name, vol_pct = list(pairs.items())[0]
+        for dbus_name, vol_pct in pairs.items():
             omx_vol_pct = self.__vol_pct_to_omx_vol_pct(vol_pct)
-            cmd = vol_template.format(dbus_name, omx_vol_pct)
-        else:
-            parallel_vol_template = shlex.quote(vol_template.format('{1}', '{2}'))
-            dbus_names = ''
-            omx_vol_pcts = ''
-            for dbus_name, vol_pct in pairs.items():
-                dbus_names += dbus_name + ' '
-                omx_vol_pcts += str(self.__vol_pct_to_omx_vol_pct(vol_pct)) + ' '
-            dbus_names = dbus_names.strip()
-            omx_vol_pcts = omx_vol_pcts.strip()
-            cmd = (f"{self.__PARALLEL_CMD_TEMPLATE_PREFIX} {parallel_vol_template} ::: {dbus_names} " +
-                f"::: {omx_vol_pcts}")
-
-        self.__logger.debug(f"dbus_cmd vol_cmd: {cmd}")
-
-        # Send dbus commands in non-blocking fashion so that the receiver process is free to handle other input.
-        # Dbus can sometimes take a while to execute. Starting the subprocess takes about 3-20ms
-        proc = subprocess.Popen(cmd, shell = True, executable = '/usr/bin/bash')
-        self.__in_flight_vol_procs.append(proc)
+            self.__set_pending_value(
+                dbus_name, self.__PROPERTY_VOLUME,
+                (self.__PROPERTIES_INTERFACE, 'Set', 'ssv', [self.__PLAYER_INTERFACE, 'Volume', ('d', omx_vol_pct)])
+            )
+        return True
 
     # pairs: a dict where each key is a dbus name and each value is a list of crop coordinates
     # e.g.: {'piwall.tv1.video': (0, 0, 100, 100)}
+    #
+    # The crop is applied asynchronously. Always returns True: the most recently requested crop for each
+    # player will be applied eventually, as long as the player is running.
     def set_crop(self, pairs):
-        num_pairs = len(pairs)
-        if num_pairs <= 0:
-            return
-
-        if self.__are_too_many_procs_in_flight(self.__in_flight_crop_procs, self.__MAX_IN_FLIGHT_CROP_PROCS):
-            self.__logger.warning("Too many in-flight dbus processes; bailing without setting crop.")
-            return
-
-        crop_template = (self.__get_dbus_cmd_template_prefix() +
-            "org.mpris.MediaPlayer2.Player.SetVideoCropPos objpath:/not/used string:'{1}' >/dev/null 2>&1")
-
-        if num_pairs == 1:
-            dbus_name, crop_coords = list(pairs.items())[0]
-            cmd = crop_template.format(
-                dbus_name,
-                OmxplayerController.crop_coordinate_list_to_string(crop_coords)
+        for dbus_name, crop_coords in pairs.items():
+            crop_string = OmxplayerController.crop_coordinate_list_to_string(crop_coords)
+            self.__set_pending_value(
+                dbus_name, self.__PROPERTY_CROP,
+                (self.__PLAYER_INTERFACE, 'SetVideoCropPos', 'os', ['/not/used', crop_string])
             )
-        else:
-            parallel_crop_template = shlex.quote(crop_template.format('{1}', '{2} {3} {4} {5}'))
-            dbus_names = ''
-            crop_x1s = crop_y1s = crop_x2s = crop_y2s = ''
-            for dbus_name, crop_coords in pairs.items():
-                dbus_names += dbus_name + ' '
-                x1, y1, x2, y2 = crop_coords
-                crop_x1s += f'{x1} '
-                crop_y1s += f'{y1} '
-                crop_x2s += f'{x2} '
-                crop_y2s += f'{y2} '
-            dbus_names = dbus_names.strip()
-            crop_x1s = crop_x1s.strip()
-            crop_y1s = crop_y1s.strip()
-            crop_x2s = crop_x2s.strip()
-            crop_y2s = crop_y2s.strip()
-            cmd = (f"{self.__PARALLEL_CMD_TEMPLATE_PREFIX} {parallel_crop_template} ::: {dbus_names} " +
-                f"::: {crop_x1s} ::: {crop_y1s} ::: {crop_x2s} ::: {crop_y2s}")
-
-        self.__logger.debug(f"dbus_cmd crop_cmd: {cmd}")
-
-        # Send dbus commands in non-blocking fashion so that the receiver process is free to handle other input.
-        # Dbus can sometimes take a while to execute. Starting the subprocess takes about 3-20ms
-        proc = subprocess.Popen(cmd, shell = True, executable = '/usr/bin/bash')
-        self.__in_flight_crop_procs.append(proc)
+        return True
 
     @staticmethod
     def crop_coordinate_list_to_string(crop_coord_list):
@@ -158,27 +175,24 @@ class OmxplayerController:
 
     # start playback / unpause the video
     def play(self, dbus_names):
-        num_dbus_names = len(dbus_names)
-        if num_dbus_names <= 0:
-            return
-
-        # Don't check if too many procs are in flight, because we never want to ignore a play command.
-        # This is used to start the video playback in sync across all the TVs.
-
-        play_template = (self.__get_dbus_cmd_template_prefix() +
-            "org.mpris.MediaPlayer2.Player.Play >/dev/null 2>&1")
-        if num_dbus_names == 1:
-            cmd = play_template.format(dbus_names[0])
-        else:
-            parallel_play_template = shlex.quote(play_template.format('{1}'))
-            dbus_names_str = ' '.join(dbus_names.keys())
-            cmd = f"{self.__PARALLEL_CMD_TEMPLATE_PREFIX} {parallel_play_template} ::: {dbus_names_str} "
-
-        self.__logger.debug(f"dbus_cmd play_cmd: {cmd}")
-
-        # Send dbus commands in non-blocking fashion so that the receiver process is free to handle other input.
-        # Dbus can sometimes take a while to execute. Starting the subprocess takes about 3-20ms
-        proc = subprocess.Popen(cmd, shell = True, executable = '/usr/bin/bash')
+        # This is used to start the video playback in sync across all the TVs. Sending a method call just writes
+        # to the dbus socket, so the play commands for each player go out back to back.
+        for dbus_name in dbus_names:
+            self.__logger.debug(f"Sending play to {dbus_name}")
+            self.__send_method_call(dbus_name, self.__PLAYER_INTERFACE, 'Play')
+
+    # pause the video. Note that omxplayer's Pause method toggles the play state: if the video is already paused,
+    # it will start playing. Callers should only use this on a video that they know is playing.
+    def pause(self, dbus_names):
+        for dbus_name in dbus_names:
+            self.__logger.debug(f"Sending pause to {dbus_name}")
+            self.__send_method_call(dbus_name, self.__PLAYER_INTERFACE, 'Pause')
+
+    # Make a video that was started hidden (with `--alpha 0`) visible.
+    def show(self, dbus_names):
+        for dbus_name in dbus_names:
+            self.__logger.debug(f"Sending show to {dbus_name}")
+            self.__send_method_call(dbus_name, self.__PLAYER_INTERFACE, 'SetAlpha', 'ox', ['/not/used', 255])
 
     # omxplayer uses a different algorithm for computing volume percentage from the original millibels than
     # our VolumeController class uses. Convert to omxplayer's equivalent percentage for a smoother volume
@@ -191,58 +205,168 @@ class OmxplayerController:
         omx_vol_pct = min(omx_vol_pct, 1)
         return round(omx_vol_pct, 2)
 
-    def __are_too_many_procs_in_flight(self, in_flight_procs, max_procs):
-        updated_in_flight_procs = []
-        for proc in in_flight_procs:
-            if proc.poll() is None:
-                updated_in_flight_procs.append(proc)
-
-        # modify in_flight_procs in place so that all references are updated
-        in_flight_procs.clear()
-        in_flight_procs.extend(updated_in_flight_procs)
-        if len(in_flight_procs) >= max_procs:
-            return True
-        return False
-
-    def __get_dbus_cmd_template_prefix(self):
-        dbus_timeout_s = self.__DBUS_TIMEOUT_MS / 1000 + 0.1
-        dbus_kill_after_timeout_s = dbus_timeout_s + 0.1
-        dbus_prefix = (
-            f'sudo timeout --kill-after={dbus_kill_after_timeout_s} {dbus_timeout_s} '
-            'sudo -u ' + self.__user + ' ' +
-            'DBUS_SESSION_BUS_ADDRESS=' + self.__dbus_addr + ' ' +
-            'DBUS_SESSION_BUS_PID=' + self.__dbus_pid + ' ' +
-            'dbus-send --print-reply=literal --session --reply-timeout=' + str(self.__DBUS_TIMEOUT_MS) + ' ' +
-            '--dest={0} /org/mpris/MediaPlayer2 ')
-        return dbus_prefix
-
-    # Returns a boolean. True if the session was loaded or already loaded, false if we failed to load.
-    def __load_dbus_session_info(self):
-        if self.__dbus_addr and self.__dbus_pid:
-            return True # already loaded
-
-        dbus_addr_file_path = f"/tmp/omxplayerdbus.{self.__user}"
-        dbus_pid_file_path = f"/tmp/omxplayerdbus.{self.__user}.pid"
-        self.__logger.info(f"Reading dbus info from files {dbus_addr_file_path} and {dbus_pid_file_path}.")
-
-        # Omxplayer creates these files on its first run after a reboot.
-        # These files might not yet exist if omxplayer has not been started since the pi
-        # was last rebooted.
-        dbus_addr_file = None
+    """
+    Each player has one pending value slot per property. A new value overwrites the pending value in its slot if
+    the worker has not applied it yet. Thus, when values are requested faster than they can be applied (e.g. while
+    an animation is running), we skip the intermediate values rather than falling behind or dropping the most
+    recent value.
+
+    method_call: a tuple of (interface, member, signature, args)
+    """
+    def __set_pending_value(self, dbus_name, prop, method_call):
+        key = (dbus_name, prop)
+        with self.__pending_values_cond:
+            num_coalesced = 0
+            if key in self.__pending_values:
+                num_coalesced = self.__pending_values[key]['num_coalesced'] + 1
+            self.__pending_values[key] = {
+                'method_call': method_call,
+                'request_time': time.time(),
+                'num_coalesced': num_coalesced,
+            }
+            self.__pending_values_cond.notify()
+
+    # A single worker thread applies the pending values, waiting for omxplayer's reply to each one so that we
+    # know when the value was actually applied.
+    def __drain_pending_values(self):
+        while True:
+            with self.__pending_values_cond:
+                while not self.__pending_values:
+                    self.__pending_values_cond.wait()
+                # Slots that are overwritten keep their position in the dict, so no slot is starved.
+                key = next(iter(self.__pending_values))
+                pending_value = self.__pending_values.pop(key)
+
+            dbus_name, prop = key
+            interface, member, signature, args = pending_value['method_call']
+            try:
+                self.__call_method(
+                    self.__CONNECTION_PENDING_VALUES, dbus_name, interface, member, signature, args,
+                    expect_reply = True
+                )
+            except DbusError as e:
+                # E.g. `org.freedesktop.DBus.Error.ServiceUnknown` if the player is no longer running. There's no
+                # point in retrying.
+                self.__logger.debug(f"Unable to set {prop} for {dbus_name}: {e}")
+                continue
+            except Exception as e:
+                self.__logger.warning(f"Unable to set {prop} for {dbus_name}, will retry: {e}")
+                with self.__pending_values_cond:
+                    # Don't clobber a newer value that was requested while we were trying to apply this one.
+                    if key not in self.__pending_values:
+                        self.__pending_values[key] = pending_value
+                time.sleep(self.__RETRY_BACKOFF_S)
+                continue
+
+            latency_s = time.time() - pending_value['request_time']
+            msg = (f"Set {prop} for {dbus_name} to {args[-1]} in {round(latency_s * 1000, 2)}ms " +
+                f"(skipped {pending_value['num_coalesced']} intermediate values).")
+            if latency_s > self.__SLOW_PROPERTY_CHANGE_THRESHOLD_S:
+                self.__logger.warning(msg)
+            else:
+                self.__logger.debug(msg)
+
+    # Sends a method call without waiting for a reply, so that the receiver process is free to handle other input.
+    # Returns False if the method call could not be sent, True otherwise.
+    def __send_method_call(self, dbus_name, interface, member, signature = '', args = None):
         try:
-            dbus_addr_file = open(dbus_addr_file_path)
-        except Exception:
-            self.__logger.debug(f"Unable to open {dbus_addr_file_path}")
+            self.__call_method(
+                self.__CONNECTION_COMMANDS, dbus_name, interface, member, signature, args, expect_reply = False
+            )
+        except Exception as e:
+            self.__logger.warning(f"Unable to send dbus method call {interface}.{member} to {dbus_name}: {e}")
             return False
-
-        dbus_pid_file = None
+        return True
+
+    # If the call fails because of a connection error, we reconnect and retry once. Omxplayer may have started a
+    # new dbus session since we connected, in which case the dbus session info in /tmp will have changed.
+    #
+    # connection_name: which of the dbus connections to use, e.g. __CONNECTION_COMMANDS
+    def __call_method(
+        self, connection_name, dbus_name, interface, member, signature = '', args = None, expect_reply = False
+    ):
+        for attempt in range(2):
+            dbus_connection = None
+            try:
+                dbus_connection = self.__get_dbus_connection(connection_name)
+                return dbus_connection.call_method(
+                    dbus_name, self.__DBUS_OBJECT_PATH, interface, member, signature, args,
+                    expect_reply = expect_reply, timeout_s = self.__DBUS_TIMEOUT_S
+                )
+            except DbusError as e:
+                self.__increment_failed_command_count(member, args)
+                raise e
+            except Exception as e:
+                self.__reset_dbus_connection(connection_name, dbus_connection)
+                if attempt > 0:
+                    self.__increment_failed_command_count(member, args)
+                    raise e
+                self.__logger.info(f"Reconnecting to dbus after error: {e}")
+
+    def __increment_failed_command_count(self, member, args):
+        command = member
+        if member in ['Get', 'Set']:
+            command += ':' + args[1] # the property name
+        with self.__failed_command_counts_lock:
+            self.__failed_command_counts[command] = self.__failed_command_counts.get(command, 0) + 1
+
+    # When run as a systemd service, omxplayer starts a new dbus session the first time a video is played after
+    # the service is restarted, and writes the new session's address to the dbus address file. The old session
+    # may still be running, so sending commands to it would not fail -- they just would never reach omxplayer. Thus,
+    # before every command, check whether the file has changed since we read the address from it. This is cheap:
+    # it's a stat call, not a read.
+    def __get_dbus_connection(self, connection_name):
+        with self.__dbus_connection_locks[connection_name]:
+            dbus_connection = self.__dbus_connections.get(connection_name)
+            dbus_addr_file_stat = self.__stat_dbus_addr_file()
+            if (
+                dbus_connection is not None and dbus_addr_file_stat is not None and
+                dbus_addr_file_stat != self.__dbus_addr_file_stats.get(connection_name)
+            ):
+                self.__logger.info(f"Dbus address file changed. Reconnecting {connection_name} connection to dbus...")
+                dbus_connection.close()
+                dbus_connection = None
+
+            if dbus_connection is None:
+                dbus_addr = self.__load_dbus_addr()
+                if dbus_addr is None:
+                    raise Exception("Unable to load dbus session info.")
+                dbus_connection = DbusConnection(dbus_addr).connect()
+                self.__dbus_connections[connection_name] = dbus_connection
+                self.__dbus_addr_file_stats[connection_name] = dbus_addr_file_stat
+            return dbus_connection
+
+    # Returns a tuple of (inode, mtime), or None if the file does not exist.
+    def __stat_dbus_addr_file(self):
+        try:
+            stat_result = os.stat(self.__dbus_addr_file_path)
+        except FileNotFoundError:
+            return None
+        return (stat_result.st_ino, stat_result.st_mtime_ns)
+
+    # Only reset the connection if another thread has not already replaced the failed connection with a new one.
+    def __reset_dbus_connection(self, connection_name, failed_dbus_connection):
+        with self.__dbus_connection_locks[connection_name]:
+            if failed_dbus_connection is not None:
+                failed_dbus_connection.close()
+            if self.__dbus_connections.get(connection_name) is failed_dbus_connection:
+                self.__dbus_connections.pop(connection_name, None)
+
+    # Returns the dbus session address, or None if we failed to load it.
+    def __load_dbus_addr(self):
+        dbus_addr_file_path = self.__dbus_addr_file_path
+        self.__logger.info(f"Reading dbus info from file {dbus_addr_file_path}.")
+
+        # Omxplayer creates this file on its first run after a reboot.
+        # This file might not yet exist if omxplayer has not been started since the pi
+        # was last rebooted.
         try:
-            dbus_pid_file = open(dbus_pid_file_path)
+            with open(dbus_addr_file_path) as dbus_addr_file:
+                dbus_addr = dbus_addr_file.read().strip()
         except Exception:
-            self.__logger.debug(f"Unable to open {dbus_pid_file_path}")
-            return False
+            self.__logger.debug(f"Unable to open {dbus_addr_file_path}")
+            return None
 
-        self.__dbus_addr = dbus_addr_file.read().strip()
-        self.__dbus_pid = dbus_pid_file.read().strip()
-        if self.__dbus_addr and self.__dbus_pid:
-            return True
+        if not dbus_addr:
+            return None
+        return dbus_addr
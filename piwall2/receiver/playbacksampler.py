@@ -0,0 +1,94 @@
+import os
+import threading
+import time
+import traceback
+
+from piwall2.config import Config
+from piwall2.configloader import ConfigLoader
+from piwall2.logger import Logger
+from piwall2.telemetryhelper import TelemetryHelper
+
+# Periodically samples the playback position of the video players on this receiver, and sends the samples to the
+# broadcaster. The broadcaster uses the samples to measure how far the TVs have drifted apart during a video.
+# See: PlaybackSampleCollector
+class PlaybackSampler:
+
+    def __init__(self, omxplayer_controller):
+        self.__logger = Logger().set_namespace(self.__class__.__name__)
+        self.__omxplayer_controller = omxplayer_controller
+        self.__telemetry_helper = TelemetryHelper().setup_for_receiver()
+        self.__receiver = ConfigLoader().get_own_receiver_name()
+        self.__sample_rate_hz = Config.get('playback_sample_rate_hz', 1)
+
+        # Guards the stream being sampled, which is set from the receiver's control message loop.
+        self.__lock = threading.Lock()
+        self.__stream_id = None
+        self.__log_uuid = None
+        self.__tv_ids_by_dbus_name = {}
+
+    def start(self):
+        if not self.__sample_rate_hz or self.__sample_rate_hz <= 0:
+            self.__logger.info("Playback sampling is disabled.")
+            return self
+
+        # Sample from a daemon thread, because getting the playback status waits for replies from the players.
+        thread = threading.Thread(target = self.__run, daemon = True)
+        thread.start()
+        return self
+
+    # tv_ids_by_dbus_name: the video players to sample, e.g.: {'piwall.tv1.video': 'piwall1.local_1'}
+    def set_stream(self, stream_id, log_uuid, tv_ids_by_dbus_name):
+        with self.__lock:
+            self.__stream_id = stream_id
+            self.__log_uuid = log_uuid
+            self.__tv_ids_by_dbus_name = tv_ids_by_dbus_name
+
+    def clear_stream(self):
+        self.set_stream(None, None, {})
+
+    def __run(self):
+        while True:
+            loop_start = time.time()
+            try:
+                self.__sample()
+            except Exception:
+                self.__logger.error('Caught exception: {}'.format(traceback.format_exc()))
+            time.sleep(max(0, (1 / self.__sample_rate_hz) - (time.time() - loop_start)))
+
+    def __sample(self):
+        with self.__lock:
+            stream_id = self.__stream_id
+            log_uuid = self.__log_uuid
+            tv_ids_by_dbus_name = dict(self.__tv_ids_by_dbus_name)
+        if not tv_ids_by_dbus_name:
+            return
+
+        samples = []
+        for dbus_name, tv_id in tv_ids_by_dbus_name.items():
+            # The position is the first property that get_playback_status requests, so it is sampled shortly
+            # after we make the call. Record when that was, so that the broadcaster can account for the time that
+            # elapsed between sampling and sending.
+            sampled_at = time.time()
+            playback_status = self.__omxplayer_controller.get_playback_status(dbus_name)
+            if playback_status is None:
+                continue
+            samples.append({
+                **playback_status,
+                'tv_id': tv_id,
+                'sampled_at': sampled_at,
+            })
+        if not samples:
+            return
+
+        now = time.time()
+        for sample in samples:
+            sample['sample_age_s'] = now - sample.pop('sampled_at')
+
+        msg = {
+            'receiver': self.__receiver,
+            'stream_id': stream_id,
+            'log_uuid': log_uuid,
+            'load_avg': os.getloadavg()[0],
+            'samples': samples,
+        }
+        self.__telemetry_helper.send_msg(TelemetryHelper.TYPE_PLAYBACK_SAMPLE, msg)
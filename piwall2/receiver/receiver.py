@@ -3,17 +3,23 @@ import os
 import signal
 import socket
 import subprocess
+import threading
 import time
 import traceback
 
+from piwall2.animator import Animator
+from piwall2.broadcaster.broadcasttimings import BroadcastTimings
 from piwall2.config import Config
 from piwall2.configloader import ConfigLoader
 from piwall2.controlmessagehelper import ControlMessageHelper
 from piwall2.directoryutils import DirectoryUtils
 from piwall2.displaymode import DisplayMode
 from piwall2.logger import Logger
+from piwall2.receiver.heartbeat import Heartbeat
 from piwall2.receiver.omxplayercontroller import OmxplayerController
+from piwall2.receiver.playbacksampler import PlaybackSampler
 from piwall2.receiver.receivercommandbuilder import ReceiverCommandBuilder
+from piwall2.telemetryhelper import TelemetryHelper
 from piwall2.tv import Tv
 from piwall2.volumecontroller import VolumeController
 
@@ -37,11 +43,20 @@ class Receiver:
         self.__loading_screen_crop_args2 = None
 
         config_loader = ConfigLoader()
+        self.__receiver = config_loader.get_own_receiver_name()
         self.__receiver_config_stanza = config_loader.get_own_receiver_config_stanza()
         self.__receiver_command_builder = ReceiverCommandBuilder(config_loader, self.__receiver_config_stanza)
         self.__tv_ids = self.__get_tv_ids_by_tv_num()
 
         self.__control_message_helper = ControlMessageHelper().setup_for_receiver()
+        self.__telemetry_helper = TelemetryHelper().setup_for_receiver()
+
+        # When run as a systemd service, omxplayer starts a new dbus session the first time a video is played after
+        # the service is restarted (i.e. when we play the warmup video). The OmxplayerController notices when this
+        # happens and reconnects, so it may be initialized before the warmup video is played.
+        self.__omxplayer_controller = OmxplayerController()
+        self.__playback_sampler = PlaybackSampler(self.__omxplayer_controller).start()
+        self.__heartbeat = Heartbeat(self.__omxplayer_controller).start()
 
         # Store the PGIDs separately, because attempting to get the PGID later via `os.getpgid` can
         # raise `ProcessLookupError: [Errno 3] No such process` if the process is no longer running
@@ -49,6 +64,21 @@ class Receiver:
         self.__receive_and_play_video_proc = None
         self.__receive_and_play_video_proc_pgid = None
 
+        # The slot of players that the current video plays in. See: OmxplayerController.VIDEO_DBUS_NAMES_BY_SLOT
+        self.__video_slot = 0
+
+        # The next video, if it is being prerolled while the current video finishes playing. A dict with the keys:
+        # stream, video_slot, proc, pgid, crop_args, and crop_args2. See: __preroll_next_video
+        self.__next_video = None
+
+        # The stream_id of the most recent video we started playing. This is not reset when playback ends, so
+        # that we don't re-join a stream that already finished playing on this receiver.
+        self.__stream_id = None
+
+        # The version of the most recent wall state snapshot that was fully applied.
+        # See: Queue.__send_wall_state_snapshot
+        self.__applied_wall_state_version = None
+
         self.__is_loading_screen_playback_in_progress = False
         self.__loading_screen_proc = None
         self.__loading_screen_pgid = None
@@ -60,14 +90,6 @@ class Receiver:
         self.__disable_terminal_output()
         self.__play_warmup_video()
 
-        # This must come after the warmup video. When run as a systemd service, omxplayer wants to
-        # start new dbus sessions / processes every time the service is restarted. This means it will
-        # create new dbus files in /tmp when the first video is played after the service is restarted
-        # But the old files will still be in /tmp. So if we initialize the OmxplayerController before
-        # the new dbus files are created by playing the first video since restarting the service, we
-        # will be reading stale dbus info from the files in /tmp.
-        self.__omxplayer_controller = OmxplayerController()
-
     def run(self):
         while True:
             try:
@@ -90,86 +112,261 @@ class Receiver:
                 self.__logger.info("Ending loading screen playback because loading_screen_proc is no longer running...")
                 self.__stop_loading_screen_playback_if_playing(reset_log_uuid = False)
 
+        if self.__next_video and self.__next_video['proc'].poll() is not None:
+            self.__logger.info("Discarding prerolled video because its receive_and_play_video_proc is no longer " +
+                "running...")
+            self.__stop_next_video_if_prerolled()
+
         msg_type = ctrl_msg[ControlMessageHelper.CTRL_MSG_TYPE_KEY]
         if msg_type == ControlMessageHelper.TYPE_INIT_VIDEO:
-            self.__stop_video_playback_if_playing(stop_loading_screen_playback = False)
-            self.__receive_and_play_video_proc = self.__receive_and_play_video(ctrl_msg)
-            self.__receive_and_play_video_proc_pgid = os.getpgid(self.__receive_and_play_video_proc.pid)
+            stream = ctrl_msg[ControlMessageHelper.CONTENT_KEY]
+            if stream.get('switch_time') is not None and self.__is_video_playback_in_progress:
+                self.__preroll_next_video(stream)
+            else:
+                self.__stop_next_video_if_prerolled()
+                self.__stop_video_playback_if_playing(stop_loading_screen_playback = False)
+                self.__start_video_playback(stream, start_paused = True)
         if msg_type == ControlMessageHelper.TYPE_PLAY_VIDEO:
-            if self.__is_video_playback_in_progress:
-                if self.__receiver_config_stanza['is_dual_video_output']:
-                    dbus_names = [OmxplayerController.TV1_VIDEO_DBUS_NAME, OmxplayerController.TV2_VIDEO_DBUS_NAME]
-                else:
-                    dbus_names = [OmxplayerController.TV1_VIDEO_DBUS_NAME]
-                self.__omxplayer_controller.play(dbus_names)
+            stream_id = ctrl_msg[ControlMessageHelper.CONTENT_KEY].get('stream_id')
+            if self.__is_next_video_stream(stream_id):
+                self.__switch_to_next_video()
+            elif self.__is_video_playback_in_progress and stream_id in (None, self.__stream_id):
+                self.__omxplayer_controller.play(self.__get_video_dbus_names(self.__video_slot))
         elif msg_type == ControlMessageHelper.TYPE_SKIP_VIDEO:
-            self.__stop_video_playback_if_playing(stop_loading_screen_playback = True)
+            # A skip without a stream_id stops all video playback. Otherwise, only the given stream is stopped: the
+            # previous video may still be finishing up while the next one is prerolled.
+            stream_id = ctrl_msg[ControlMessageHelper.CONTENT_KEY].get('stream_id')
+            if stream_id is None or self.__is_next_video_stream(stream_id):
+                self.__stop_next_video_if_prerolled()
+            if stream_id is None or stream_id == self.__stream_id:
+                self.__stop_video_playback_if_playing(stop_loading_screen_playback = True)
+            else:
+                self.__stop_loading_screen_playback_if_playing(reset_log_uuid = False)
         elif msg_type == ControlMessageHelper.TYPE_VOLUME:
-            if Config.get('mute_audio', False):
-                return # Don't adjust video player volume from its initial muted state.
-
-            self.__video_player_volume_pct = ctrl_msg[ControlMessageHelper.CONTENT_KEY]
-            vol_pairs = {}
-            if self.__is_video_playback_in_progress:
-                vol_pairs[OmxplayerController.TV1_VIDEO_DBUS_NAME] = self.__video_player_volume_pct
-                if self.__receiver_config_stanza['is_dual_video_output']:
-                    vol_pairs[OmxplayerController.TV2_VIDEO_DBUS_NAME] = self.__video_player_volume_pct
-            if self.__is_loading_screen_playback_in_progress:
-                vol_pairs[OmxplayerController.TV1_LOADING_SCREEN_DBUS_NAME] = self.__video_player_volume_pct
-                if self.__receiver_config_stanza['is_dual_video_output']:
-                    vol_pairs[OmxplayerController.TV2_LOADING_SCREEN_DBUS_NAME] = self.__video_player_volume_pct
-            self.__omxplayer_controller.set_vol_pct(vol_pairs)
+            self.__set_volume(ctrl_msg[ControlMessageHelper.CONTENT_KEY])
         elif msg_type == ControlMessageHelper.TYPE_DISPLAY_MODE:
-            display_mode_by_tv_id = ctrl_msg[ControlMessageHelper.CONTENT_KEY]
-            should_set_tv1 = False
-            should_set_tv2 = False
-            for tv_num, tv_id in self.__tv_ids.items():
-                if tv_id in display_mode_by_tv_id:
-                    display_mode_to_set = display_mode_by_tv_id[tv_id]
-                    if display_mode_to_set not in DisplayMode.DISPLAY_MODES:
-                        display_mode_to_set = DisplayMode.DISPLAY_MODE_FULLSCREEN
-                    if tv_num == 1:
-                        should_set_tv1 = True
-                        self.__display_mode = display_mode_to_set
-                    else:
-                        should_set_tv2 = True
-                        self.__display_mode2 = display_mode_to_set
-
-            crop_pairs = {}
-            if self.__is_video_playback_in_progress:
-                if should_set_tv1 and self.__video_crop_args:
-                    crop_pairs[OmxplayerController.TV1_VIDEO_DBUS_NAME] = self.__video_crop_args[self.__display_mode]
-                if should_set_tv2 and self.__receiver_config_stanza['is_dual_video_output'] and self.__video_crop_args2:
-                    crop_pairs[OmxplayerController.TV2_VIDEO_DBUS_NAME] = self.__video_crop_args2[self.__display_mode2]
-            if self.__is_loading_screen_playback_in_progress:
-                if should_set_tv1 and self.__loading_screen_crop_args:
-                    crop_pairs[OmxplayerController.TV1_LOADING_SCREEN_DBUS_NAME] = self.__loading_screen_crop_args[self.__display_mode]
-                if should_set_tv2 and self.__receiver_config_stanza['is_dual_video_output'] and self.__loading_screen_crop_args2:
-                    crop_pairs[OmxplayerController.TV2_LOADING_SCREEN_DBUS_NAME] = self.__loading_screen_crop_args2[self.__display_mode2]
-            if crop_pairs:
-                self.__omxplayer_controller.set_crop(crop_pairs)
+            self.__set_display_mode(ctrl_msg[ControlMessageHelper.CONTENT_KEY])
         elif msg_type == ControlMessageHelper.TYPE_SHOW_LOADING_SCREEN:
             self.__loading_screen_proc = self.__show_loading_screen(ctrl_msg)
             self.__loading_screen_pgid = os.getpgid(self.__loading_screen_proc.pid)
         elif msg_type == ControlMessageHelper.TYPE_END_LOADING_SCREEN:
             self.__stop_loading_screen_playback_if_playing(reset_log_uuid = False)
+            self.__send_broadcast_timing(BroadcastTimings.STAGE_LOADING_SCREEN_ENDED)
+        elif msg_type == ControlMessageHelper.TYPE_WALL_STATE:
+            self.__apply_wall_state(ctrl_msg[ControlMessageHelper.CONTENT_KEY])
+        elif msg_type == ControlMessageHelper.TYPE_DRIFT_CORRECTION:
+            self.__apply_drift_correction(ctrl_msg[ControlMessageHelper.CONTENT_KEY])
 
-    def __receive_and_play_video(self, ctrl_msg):
-        ctrl_msg_content = ctrl_msg[ControlMessageHelper.CONTENT_KEY]
-        Logger.set_uuid(ctrl_msg_content['log_uuid'])
-        cmd, self.__video_crop_args, self.__video_crop_args2 = (
+    # Report when this receiver completed a stage of the current broadcast. See: BroadcastTimings
+    def __send_broadcast_timing(self, stage):
+        if not Logger.get_uuid():
+            return
+        self.__telemetry_helper.send_msg(
+            TelemetryHelper.TYPE_BROADCAST_TIMING,
+            {'log_uuid': Logger.get_uuid(), 'receiver': self.__receiver, 'stage': stage}
+        )
+
+    # Returns False if the volume could not be set, True otherwise.
+    def __set_volume(self, vol_pct):
+        if Config.get('mute_audio', False):
+            return True # Don't adjust video player volume from its initial muted state.
+
+        self.__video_player_volume_pct = vol_pct
+        vol_pairs = {}
+        if self.__is_video_playback_in_progress:
+            for dbus_name in self.__get_video_dbus_names(self.__video_slot):
+                vol_pairs[dbus_name] = self.__video_player_volume_pct
+        if self.__next_video:
+            for dbus_name in self.__get_video_dbus_names(self.__next_video['video_slot']):
+                vol_pairs[dbus_name] = self.__video_player_volume_pct
+        if self.__is_loading_screen_playback_in_progress:
+            vol_pairs[OmxplayerController.TV1_LOADING_SCREEN_DBUS_NAME] = self.__video_player_volume_pct
+            if self.__receiver_config_stanza['is_dual_video_output']:
+                vol_pairs[OmxplayerController.TV2_LOADING_SCREEN_DBUS_NAME] = self.__video_player_volume_pct
+        return self.__omxplayer_controller.set_vol_pct(vol_pairs)
+
+    # display_mode_by_tv_id: may contain display modes for TVs that are not connected to this receiver.
+    # Returns False if the crop could not be set, True otherwise.
+    def __set_display_mode(self, display_mode_by_tv_id):
+        should_set_tv1 = False
+        should_set_tv2 = False
+        for tv_num, tv_id in self.__tv_ids.items():
+            if tv_id in display_mode_by_tv_id:
+                display_mode_to_set = display_mode_by_tv_id[tv_id]
+                if display_mode_to_set not in DisplayMode.DISPLAY_MODES:
+                    display_mode_to_set = DisplayMode.DISPLAY_MODE_FULLSCREEN
+                if tv_num == 1:
+                    should_set_tv1 = True
+                    self.__display_mode = display_mode_to_set
+                else:
+                    should_set_tv2 = True
+                    self.__display_mode2 = display_mode_to_set
+
+        crop_pairs = {}
+        if self.__is_video_playback_in_progress:
+            crop_pairs.update(self.__get_video_crop_pairs(
+                self.__video_slot, self.__video_crop_args, self.__video_crop_args2, should_set_tv1, should_set_tv2
+            ))
+        if self.__next_video:
+            crop_pairs.update(self.__get_video_crop_pairs(
+                self.__next_video['video_slot'], self.__next_video['crop_args'], self.__next_video['crop_args2'],
+                should_set_tv1, should_set_tv2
+            ))
+        if self.__is_loading_screen_playback_in_progress:
+            if should_set_tv1 and self.__loading_screen_crop_args:
+                crop_pairs[OmxplayerController.TV1_LOADING_SCREEN_DBUS_NAME] = self.__loading_screen_crop_args[self.__display_mode]
+            if should_set_tv2 and self.__receiver_config_stanza['is_dual_video_output'] and self.__loading_screen_crop_args2:
+                crop_pairs[OmxplayerController.TV2_LOADING_SCREEN_DBUS_NAME] = self.__loading_screen_crop_args2[self.__display_mode2]
+        return self.__omxplayer_controller.set_crop(crop_pairs)
+
+    def __get_video_crop_pairs(self, video_slot, crop_args, crop_args2, should_set_tv1, should_set_tv2):
+        dbus_names = OmxplayerController.VIDEO_DBUS_NAMES_BY_SLOT[video_slot]
+        crop_pairs = {}
+        if should_set_tv1 and crop_args:
+            crop_pairs[dbus_names[1]] = crop_args[self.__display_mode]
+        if should_set_tv2 and self.__receiver_config_stanza['is_dual_video_output'] and crop_args2:
+            crop_pairs[dbus_names[2]] = crop_args2[self.__display_mode2]
+        return crop_pairs
+
+    # Applying a wall state snapshot is idempotent. If we have already applied this version of the wall state,
+    # there is nothing to do. See: Queue.__send_wall_state_snapshot
+    def __apply_wall_state(self, wall_state):
+        if wall_state['version'] == self.__applied_wall_state_version:
+            return
+
+        stream = wall_state['stream']
+        if (
+            stream and not self.__is_video_playback_in_progress and stream['stream_id'] != self.__stream_id and
+            not self.__is_next_video_stream(stream['stream_id'])
+        ):
+            # We missed this stream's INIT_VIDEO control message, for instance because the receiver was restarted
+            # in the middle of the video. Join the stream that is in progress. It won't be in sync with the other
+            # TVs, but that is better than showing nothing.
+            self.__logger.info(f"Joining stream that is already in progress: {stream}.")
+            self.__stop_loading_screen_playback_if_playing(reset_log_uuid = False)
+            self.__start_video_playback(stream, start_paused = False)
+
+        is_applied = self.__set_volume(wall_state['vol_pct'])
+
+        # While an animation is running, the animator continuously sends DISPLAY_MODE control messages. Those are
+        # more current than the display modes stored in the DB, so only apply the latter when there is no animation.
+        if wall_state['animation_mode'] == Animator.ANIMATION_MODE_NONE:
+            is_applied = self.__set_display_mode(wall_state['display_mode_by_tv_id']) and is_applied
+
+        # If any of the state could not be applied, try again when we receive the next snapshot.
+        if is_applied:
+            self.__applied_wall_state_version = wall_state['version']
+
+    # Pause each of our TVs that is ahead of the rest of the wall for as long as it is ahead.
+    # See: DriftController
+    def __apply_drift_correction(self, drift_correction):
+        if not self.__is_video_playback_in_progress or drift_correction['stream_id'] != self.__stream_id:
+            return
+
+        hold_ms_by_tv_id = drift_correction['hold_ms_by_tv_id']
+        dbus_names_by_tv_num = OmxplayerController.VIDEO_DBUS_NAMES_BY_SLOT[self.__video_slot]
+        for tv_num, tv_id in self.__tv_ids.items():
+            if tv_id not in hold_ms_by_tv_id:
+                continue
+            dbus_name = dbus_names_by_tv_num[tv_num]
+            hold_s = hold_ms_by_tv_id[tv_id] / 1000
+            self.__logger.info(f"Pausing {dbus_name} for {hold_s}s to correct drift.")
+            self.__omxplayer_controller.pause([dbus_name])
+            timer = threading.Timer(hold_s, self.__end_drift_correction_hold, [dbus_name, self.__stream_id])
+            timer.daemon = True
+            timer.start()
+
+    def __end_drift_correction_hold(self, dbus_name, stream_id):
+        # If a new video was started in the meantime, don't unpause it: it will be started in sync with the
+        # other TVs via a PLAY_VIDEO control message.
+        if stream_id != self.__stream_id:
+            return
+        self.__omxplayer_controller.play([dbus_name])
+
+    # stream: dict with the keys: log_uuid, stream_id, video_width, video_height, and optionally switch_time
+    def __start_video_playback(self, stream, start_paused):
+        Logger.set_uuid(stream['log_uuid'])
+
+        # Alternate slots, so that the new video's players can't clash with the previous video's players, which may
+        # still be shutting down.
+        video = self.__receive_and_play_video(stream, start_paused, 1 - self.__video_slot, is_hidden = False)
+        self.__set_current_video(video)
+
+    """
+    Starts the next video hidden and paused, in the other slot of players, while the current video finishes playing.
+    The broadcaster sends the next video's INIT_VIDEO control message with a switch_time shortly before the current
+    video is over, and its PLAY_VIDEO control message at the switch time. Thus the wall goes straight from one video
+    to the next, without a loading screen. See: VideoBroadcaster
+    """
+    def __preroll_next_video(self, stream):
+        self.__stop_next_video_if_prerolled()
+        self.__logger.info(f"Prerolling next video while the current video finishes playing: {stream}.")
+        self.__next_video = self.__receive_and_play_video(stream, True, 1 - self.__video_slot, is_hidden = True)
+
+    def __switch_to_next_video(self):
+        next_video = self.__next_video
+        self.__next_video = None
+        dbus_names = self.__get_video_dbus_names(next_video['video_slot'])
+        self.__omxplayer_controller.show(dbus_names)
+        self.__omxplayer_controller.play(dbus_names)
+        self.__stop_video_playback_if_playing(stop_loading_screen_playback = False)
+        self.__set_current_video(next_video)
+        self.__logger.info(f"Switched to prerolled video: {next_video['stream']}.")
+
+    def __stop_next_video_if_prerolled(self):
+        if not self.__next_video:
+            return
+        self.__logger.info("Killing prerolled receive_and_play_video proc (if it's still running)...")
+        try:
+            os.killpg(self.__next_video['pgid'], signal.SIGTERM)
+        except Exception:
+            # might raise: `ProcessLookupError: [Errno 3] No such process`
+            pass
+        self.__next_video = None
+
+    def __is_next_video_stream(self, stream_id):
+        return self.__next_video is not None and self.__next_video['stream']['stream_id'] == stream_id
+
+    # Returns a dict with the keys: stream, video_slot, proc, pgid, crop_args, and crop_args2
+    def __receive_and_play_video(self, stream, start_paused, video_slot, is_hidden):
+        cmd, crop_args, crop_args2 = (
             self.__receiver_command_builder.build_receive_and_play_video_command_and_get_crop_args(
-                ctrl_msg_content['log_uuid'], ctrl_msg_content['video_width'],
-                ctrl_msg_content['video_height'], self.__video_player_volume_pct,
-                self.__display_mode, self.__display_mode2
+                stream['log_uuid'], stream['video_width'], stream['video_height'], self.__video_player_volume_pct,
+                self.__display_mode, self.__display_mode2, start_paused, stream.get('stream_id'), video_slot,
+                is_hidden
             )
         )
         self.__logger.info(f"Running receive_and_play_video command: {cmd}")
-        self.__is_video_playback_in_progress = True
         proc = subprocess.Popen(
             cmd, shell = True, executable = '/usr/bin/bash', start_new_session = True
         )
-        return proc
+        return {
+            'stream': stream,
+            'video_slot': video_slot,
+            'proc': proc,
+            'pgid': os.getpgid(proc.pid),
+            'crop_args': crop_args,
+            'crop_args2': crop_args2,
+        }
+
+    def __set_current_video(self, video):
+        stream = video['stream']
+        Logger.set_uuid(stream['log_uuid'])
+        self.__receive_and_play_video_proc = video['proc']
+        self.__receive_and_play_video_proc_pgid = video['pgid']
+        self.__video_slot = video['video_slot']
+        self.__video_crop_args = video['crop_args']
+        self.__video_crop_args2 = video['crop_args2']
+        self.__is_video_playback_in_progress = True
+        self.__stream_id = stream.get('stream_id')
+        dbus_names = OmxplayerController.VIDEO_DBUS_NAMES_BY_SLOT[self.__video_slot]
+        tv_ids_by_dbus_name = {dbus_names[tv_num]: tv_id for tv_num, tv_id in self.__tv_ids.items()}
+        self.__playback_sampler.set_stream(self.__stream_id, stream['log_uuid'], tv_ids_by_dbus_name)
+
+    # Returns the dbus names of the players in the given slot, for the TVs that are connected to this receiver.
+    def __get_video_dbus_names(self, video_slot):
+        dbus_names = OmxplayerController.VIDEO_DBUS_NAMES_BY_SLOT[video_slot]
+        return [dbus_names[tv_num] for tv_num in self.__tv_ids]
 
     def __show_loading_screen(self, ctrl_msg):
         ctrl_msg_content = ctrl_msg[ControlMessageHelper.CONTENT_KEY]
@@ -202,6 +399,7 @@ class Receiver:
                 # might raise: `ProcessLookupError: [Errno 3] No such process`
                 pass
         Logger.set_uuid('')
+        self.__playback_sampler.clear_stream()
         self.__is_video_playback_in_progress = False
         self.__video_crop_args = None
         self.__video_crop_args2 = None
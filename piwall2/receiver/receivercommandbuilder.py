@@ -2,8 +2,8 @@ import math
 import shlex
 
 from piwall2.config import Config
+from piwall2.cropgeometry import CropGeometry
 from piwall2.directoryutils import DirectoryUtils
-from piwall2.displaymode import DisplayMode
 from piwall2.logger import Logger
 import piwall2.receiver.receiver
 from piwall2.receiver.omxplayercontroller import OmxplayerController
@@ -21,12 +21,27 @@ class ReceiverCommandBuilder:
         self.__config_loader = config_loader
         self.__receiver_config_stanza = receiver_config_stanza
 
+        # Precompute the crop args for common video dimensions, so that handling INIT_VIDEO control messages
+        # usually doesn't involve any geometry math.
+        self.__receiver = config_loader.get_own_receiver_name()
+        self.__crop_geometry = CropGeometry()
+        self.__crop_geometry.precompute([self.__receiver])
+
+    # start_paused: normally the video starts paused, and playback is started in sync across all the TVs via the
+    #   PLAY_VIDEO control message. When joining a stream that is already in progress, there will be no PLAY_VIDEO
+    #   control message, so the video should not start paused.
+    # stream_id: identifies the stream in the readiness ack that is sent once the command is ready to receive the
+    #   video. See: VideoReceiver
+    # video_slot: the slot of players to play the video in. See: OmxplayerController.VIDEO_DBUS_NAMES_BY_SLOT
+    # is_hidden: start the video hidden, so that it can be prerolled underneath the video that is currently playing.
+    #   It is shown via OmxplayerController.show once it is time to switch to it.
     def build_receive_and_play_video_command_and_get_crop_args(
-        self, log_uuid, video_width, video_height, volume_pct, display_mode, display_mode2
+        self, log_uuid, video_width, video_height, volume_pct, display_mode, display_mode2, start_paused = True,
+        stream_id = None, video_slot = 0, is_hidden = False
     ):
         adev, adev2 = self.__get_video_command_adev_args()
         display, display2 = self.__get_video_command_display_args()
-        crop_args, crop_args2 = self.__get_video_command_crop_args(video_width, video_height)
+        crop_args, crop_args2 = self.__crop_geometry.get_crop_args(self.__receiver, video_width, video_height)
         crop = OmxplayerController.crop_coordinate_list_to_string(crop_args[display_mode])
         crop2 = OmxplayerController.crop_coordinate_list_to_string(crop_args2[display_mode2])
         volume_millibels = self.__get_video_command_volume_arg(volume_pct)
@@ -63,23 +78,34 @@ class ReceiverCommandBuilder:
         mbuffer_cmd = ('mbuffer -q -l /tmp/mbuffer.out -m ' +
             f'{piwall2.receiver.receiver.Receiver.VIDEO_PLAYBACK_MBUFFER_SIZE_BYTES}b')
 
-        omx_cmd_template = self.__OMX_CMD_TEMPLATE + ' --start-paused'
+        omx_cmd_template = self.__OMX_CMD_TEMPLATE
+        if start_paused:
+            omx_cmd_template += ' --start-paused'
+        if is_hidden:
+            omx_cmd_template += ' --alpha 0'
+
+        # Each slot gets its own layer, above the loading screen's, so that the players of consecutive videos don't
+        # share a layer while one is prerolled.
+        dbus_names = OmxplayerController.VIDEO_DBUS_NAMES_BY_SLOT[video_slot]
+        layer = str(video_slot + 1)
         omx_cmd = omx_cmd_template.format(
             shlex.quote(crop), shlex.quote(adev), shlex.quote(display), shlex.quote(str(volume_millibels)),
-            OmxplayerController.TV1_VIDEO_DBUS_NAME, '1'
+            dbus_names[1], layer
         )
         cmd = 'set -o pipefail && export SHELLOPTS && '
         if self.__receiver_config_stanza['is_dual_video_output']:
             omx_cmd2 = omx_cmd_template.format(
                 shlex.quote(crop2), shlex.quote(adev2), shlex.quote(display2), shlex.quote(str(volume_millibels)),
-                OmxplayerController.TV2_VIDEO_DBUS_NAME, '1'
+                dbus_names[2], layer
             )
             cmd += f'{mbuffer_cmd} | tee >({omx_cmd}) >({omx_cmd2}) >/dev/null'
         else:
             cmd += f'{mbuffer_cmd} | {omx_cmd}'
 
         receiver_cmd = (f'{DirectoryUtils().root_dir}/bin/receive_and_play_video --command {shlex.quote(cmd)} ' +
-            f'--log-uuid {shlex.quote(log_uuid)}')
+            f'--log-uuid {shlex.quote(log_uuid)} --receiver {shlex.quote(self.__receiver)}')
+        if stream_id is not None:
+            receiver_cmd += f' --stream-id {shlex.quote(str(stream_id))}'
         return (receiver_cmd, crop_args, crop_args2)
 
     def build_loading_screen_command_and_get_crop_args(
@@ -87,7 +113,9 @@ class ReceiverCommandBuilder:
     ):
         adev, adev2 = self.__get_video_command_adev_args()
         display, display2 = self.__get_video_command_display_args()
-        crop_args, crop_args2 = self.__get_video_command_crop_args(loading_screen_data['width'], loading_screen_data['height'])
+        crop_args, crop_args2 = self.__crop_geometry.get_crop_args(
+            self.__receiver, loading_screen_data['width'], loading_screen_data['height']
+        )
         crop = OmxplayerController.crop_coordinate_list_to_string(crop_args[display_mode])
         crop2 = OmxplayerController.crop_coordinate_list_to_string(crop_args2[display_mode2])
         volume_millibels = self.__get_video_command_volume_arg(volume_pct)
@@ -153,114 +181,6 @@ class ReceiverCommandBuilder:
 
         return (display, display2)
 
-    """
-    Returns a set of crop args supporting two display modes: fullscreen mode and tile mode.
-    Fullscreen mode is like this: https://i.imgur.com/BBrA1Cr.png
-    Tile mode is like this: https://i.imgur.com/cpS61s8.png
-
-    We return four crop settings because for each mode, we calculate the crop arguments
-    for each of two TVs (each receiver can have at most two TVs hooked up to it).
-    """
-    def __get_video_command_crop_args(self, video_width, video_height):
-        receiver_config = self.__receiver_config_stanza
-
-        #####################################################################################
-        # Do fullscreen mode calculations first ###################################################
-        #####################################################################################
-        wall_width = self.__config_loader.get_wall_width()
-        wall_height = self.__config_loader.get_wall_height()
-
-        displayable_video_width, displayable_video_height = (
-            self.__get_displayable_video_dimensions_for_screen(
-                video_width, video_height, wall_width, wall_height
-            )
-        )
-        x_offset = (video_width - displayable_video_width) / 2
-        y_offset = (video_height - displayable_video_height) / 2
-
-        x0 = round(x_offset + ((receiver_config['x'] / wall_width) * displayable_video_width))
-        y0 = round(y_offset + ((receiver_config['y'] / wall_height) * displayable_video_height))
-        x1 = round(x_offset + (((receiver_config['x'] + receiver_config['width']) / wall_width) * displayable_video_width))
-        y1 = round(y_offset + (((receiver_config['y'] + receiver_config['height']) / wall_height) * displayable_video_height))
-
-        if x0 > video_width:
-            self.__logger.warn(f"The crop x0 coordinate ({x0}) " +
-                f"was greater than the video_width ({video_width}). This may indicate a misconfiguration.")
-        if x1 > video_width:
-            self.__logger.warn(f"The crop x1 coordinate ({x1}) " +
-                f"was greater than the video_width ({video_width}). This may indicate a misconfiguration.")
-        if y0 > video_height:
-            self.__logger.warn(f"The crop y0 coordinate ({y0}) " +
-                f"was greater than the video_height ({video_height}). This may indicate a misconfiguration.")
-        if y1 > video_height:
-            self.__logger.warn(f"The crop y1 coordinate ({y1}) " +
-                f"was greater than the video_height ({video_height}). This may indicate a misconfiguration.")
-
-        fullscreen_mode_crop = (x0, y0, x1, y1)
-
-        fullscreen_mode_crop2 = None
-        if receiver_config['is_dual_video_output']:
-            x0_2 = round(x_offset + ((receiver_config['x2'] / wall_width) * displayable_video_width))
-            y0_2 = round(y_offset + ((receiver_config['y2'] / wall_height) * displayable_video_height))
-            x1_2 = round(x_offset + (((receiver_config['x2'] + receiver_config['width2']) / wall_width) * displayable_video_width))
-            y1_2 = round(y_offset + (((receiver_config['y2'] + receiver_config['height2']) / wall_height) * displayable_video_height))
-
-            if x0_2 > video_width:
-                self.__logger.warn(f"The crop x0_2 coordinate ({x0_2}) " +
-                    f"was greater than the video_width ({video_width}). This may indicate a misconfiguration.")
-            if x1_2 > video_width:
-                self.__logger.warn(f"The crop x1_2 coordinate ({x1_2}) " +
-                    f"was greater than the video_width ({video_width}). This may indicate a misconfiguration.")
-            if y0_2 > video_height:
-                self.__logger.warn(f"The crop y0_2 coordinate ({y0_2}) " +
-                    f"was greater than the video_height ({video_height}). This may indicate a misconfiguration.")
-            if y1_2 > video_height:
-                self.__logger.warn(f"The crop y1_2 coordinate ({y1_2}) " +
-                    f"was greater than the video_height ({video_height}). This may indicate a misconfiguration.")
-
-            fullscreen_mode_crop2 = (x0_2, y0_2, x1_2, y1_2)
-
-        #####################################################################################
-        # Do tile mode calculations second ################################################
-        #####################################################################################
-        displayable_video_width, displayable_video_height = (
-            self.__get_displayable_video_dimensions_for_screen(
-                video_width, video_height, receiver_config['width'], receiver_config['height']
-            )
-        )
-        x_offset = (video_width - displayable_video_width) / 2
-        y_offset = (video_height - displayable_video_height) / 2
-        x0 = round(x_offset)
-        y0 = round(y_offset)
-        x1 = round(x_offset + displayable_video_width)
-        y1 = round(y_offset + displayable_video_height)
-        tile_mode_crop = (x0, y0, x1, y1)
-
-        tile_mode_crop2 = None
-        if receiver_config['is_dual_video_output']:
-            displayable_video_width, displayable_video_height = (
-                self.__get_displayable_video_dimensions_for_screen(
-                    video_width, video_height, receiver_config['width2'], receiver_config['height2']
-                )
-            )
-            x_offset = (video_width - displayable_video_width) / 2
-            y_offset = (video_height - displayable_video_height) / 2
-            x0 = round(x_offset)
-            y0 = round(y_offset)
-            x1 = round(x_offset + displayable_video_width)
-            y1 = round(y_offset + displayable_video_height)
-            tile_mode_crop2 = (x0, y0, x1, y1)
-
-        crop_args = {
-            DisplayMode.DISPLAY_MODE_FULLSCREEN: fullscreen_mode_crop,
-            DisplayMode.DISPLAY_MODE_TILE: tile_mode_crop,
-        }
-        crop_args2 = {
-            DisplayMode.DISPLAY_MODE_FULLSCREEN: fullscreen_mode_crop2,
-            DisplayMode.DISPLAY_MODE_TILE: tile_mode_crop2,
-        }
-        return (crop_args, crop_args2)
-
     def __get_video_command_volume_arg(self, volume_pct):
         # See: https://github.com/popcornmix/omxplayer/#volume-rw
         volume_pct = VolumeController.normalize_vol_pct(volume_pct)
@@ -269,68 +189,3 @@ class ReceiverCommandBuilder:
         else:
             volume_millibels = 2000 * math.log(volume_pct, 10)
         return volume_millibels
-
-    """
-    The displayable width and height represents the section of the video that the wall will be
-    displaying. A section of these dimensions will be taken from the center of the original
-    video.
-
-    Currently, the piwall only supports displaying videos in "fill" mode (as opposed to
-    "letterbox" or "stretch"). This means that every portion of the TVs will be displaying
-    some section of the video (i.e. there will be no letterboxing). Furthermore, there will be
-    no warping of the video's aspect ratio. Instead, regions of the original video will be
-    cropped or stretched if necessary.
-
-    The units of the width and height arguments are not important. We are just concerned with
-    the aspect ratio. Thus, as long as video_width and video_height are in the same units
-    (probably pixels), and as long as screen_width and screen_height are in the same units
-    (probably inches or centimeters), everything will work.
-
-    The returned dimensions will be in the units of the inputted video_width and video_height
-    (probably pixels).
-    """
-    def __get_displayable_video_dimensions_for_screen(self, video_width, video_height, screen_width, screen_height):
-        video_aspect_ratio = video_width / video_height
-        screen_aspect_ratio = screen_width / screen_height
-        if screen_aspect_ratio >= video_aspect_ratio:
-            displayable_video_width = video_width
-            displayable_video_height = video_width / screen_aspect_ratio
-            """
-            Note that `video_width = video_aspect_ratio * video_height`.
-            Thus, via substitution, we have:
-                displayable_video_height = (video_aspect_ratio * video_height) / screen_aspect_ratio
-                displayable_video_height = (video_aspect_ratio / screen_aspect_ratio) * video_height
-
-            And because of the above inequality, we know that:
-                (video_aspect_ratio / screen_aspect_ratio) <= 1
-
-            Thus, in this case, we have: `displayable_video_height <= video_height`. The video height
-            will be "cropped" such that when the video is proportionally stretched, it will fill the
-            screen size.
-            """
-
-        else:
-            displayable_video_height = video_height
-            displayable_video_width = screen_aspect_ratio * video_height
-            """
-            Note that `video_height = video_width / video_aspect_ratio`.
-            Thus, via substitution, we have:
-                displayable_video_width = screen_aspect_ratio * (video_width / video_aspect_ratio)
-                displayable_video_width = video_width * (screen_aspect_ratio / video_aspect_ratio)
-
-            And because of the above inequality for which we are now in the `else` clause, we know that:
-                (screen_aspect_ratio / video_aspect_ratio) <= 1
-
-            Thus, in this case, we have: `displayable_video_width <= video_width`. The video width
-            will be "cropped" such that when the video is proportionally stretched, it will fill the
-            screen size.
-            """
-
-        if displayable_video_width > video_width:
-            self.__logger.warn(f"The displayable_video_width ({displayable_video_width}) " +
-                f"was greater than the video_width ({video_width}). This may indicate a misconfiguration.")
-        if displayable_video_height > video_height:
-            self.__logger.warn(f"The displayable_video_height ({displayable_video_height}) " +
-                f"was greater than the video_height ({video_height}). This may indicate a misconfiguration.")
-
-        return (displayable_video_width, displayable_video_height)
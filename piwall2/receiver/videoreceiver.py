@@ -4,6 +4,7 @@ import time
 from piwall2.logger import Logger
 from piwall2.multicasthelper import MulticastHelper
 from piwall2.broadcaster.videobroadcaster import VideoBroadcaster
+from piwall2.telemetryhelper import TelemetryHelper
 
 class VideoReceiver:
 
@@ -13,7 +14,10 @@ class VideoReceiver:
     def __init__(self):
         self.__logger = Logger().set_namespace(self.__class__.__name__)
 
-    def receive_and_play_video(self, cmd):
+    # receiver: the name of this receiver, as it appears in the receivers config
+    # stream_id: if given, send a readiness ack to the broadcaster once we are ready to receive the video. The
+    #   broadcaster waits for the acks before it starts streaming the video. See: VideoBroadcaster
+    def receive_and_play_video(self, cmd, receiver = None, stream_id = None):
         multicast_helper = MulticastHelper().setup_receiver_video_socket()
         socket = multicast_helper.get_receive_video_socket()
 
@@ -24,6 +28,14 @@ class VideoReceiver:
         )
         self.__logger.info(f'Started receive_and_play_video command: {cmd}')
 
+        # The video socket is bound and the player pipeline has been started, so any video data that the broadcaster
+        # sends from now on will be buffered until the player reads it.
+        if stream_id is not None:
+            TelemetryHelper().setup_for_receiver().send_msg(
+                TelemetryHelper.TYPE_RECEIVER_READY, {'receiver': receiver, 'stream_id': stream_id}
+            )
+            self.__logger.info(f"Sent {TelemetryHelper.TYPE_RECEIVER_READY} telemetry message.")
+
         measurement_window_start = time.time()
         measurement_window_bytes_count = 0
         total_bytes_count = 0
@@ -43,6 +55,10 @@ class VideoReceiver:
                 self.__logger.info(f"Received end of video magic bytes. Received {total_bytes_count} bytes. " +
                     "Waiting for video to finish playing...")
                 proc.stdin.close()
+
+                # Leave the multicast group while the video finishes playing, so that we don't buffer the next
+                # video's stream, which may be sent in the meantime. See: Receiver.__preroll_next_video
+                socket.close()
                 break
 
             proc.stdin.write(video_bytes)
@@ -0,0 +1,68 @@
+import json
+from piwall2.logger import Logger
+from piwall2.multicasthelper import MulticastHelper
+
+# Helper for sending "telemetry messages". Telemetry messages flow in the opposite direction of control
+# messages: they are sent from the receivers via UDP multicast to the broadcaster. They are used for:
+# 1) receiver heartbeats, which the broadcaster uses to keep a roster of live receivers
+# 2) samples of the playback position of each TV, which the broadcaster uses to measure drift between TVs
+# 3) readiness acks, which tell the broadcaster that a receiver is ready to receive a video it is about to stream
+# 4) the times at which receivers completed each stage of a broadcast. See: BroadcastTimings
+# 5) etc
+#
+# See: ControlMessageHelper
+class TelemetryHelper:
+
+    # Telemetry message types
+    TYPE_HEARTBEAT = 'heartbeat'
+    TYPE_PLAYBACK_SAMPLE = 'playback_sample'
+    TYPE_RECEIVER_READY = 'receiver_ready'
+    TYPE_BROADCAST_TIMING = 'broadcast_timing'
+
+    MSG_TYPE_KEY = 'msg_type'
+    CONTENT_KEY = 'content'
+
+    def __init__(self):
+        self.__logger = Logger().set_namespace(self.__class__.__name__)
+
+    def setup_for_broadcaster(self):
+        self.__multicast_helper = MulticastHelper().setup_broadcaster_telemetry_socket()
+        return self
+
+    def setup_for_receiver(self):
+        self.__multicast_helper = MulticastHelper().setup_receiver_telemetry_socket()
+        return self
+
+    def send_msg(self, msg_type, content):
+        msg = json.dumps({
+            self.MSG_TYPE_KEY: msg_type,
+            self.CONTENT_KEY: content
+        })
+        self.__multicast_helper.send(msg.encode(), MulticastHelper.TELEMETRY_PORT)
+
+    # Sets a timeout on receive_msg, so that a caller may periodically do work even if no receivers are sending
+    # telemetry. A timeout of None means receive_msg blocks until a message is received.
+    def set_receive_timeout(self, timeout_s):
+        self.__multicast_helper.get_receive_telemetry_socket().settimeout(timeout_s)
+        return self
+
+    # Closes the receive socket. Only needed by callers that listen for telemetry temporarily.
+    def close(self):
+        self.__multicast_helper.get_receive_telemetry_socket().close()
+
+    """
+    Returns a dictionary representing the message. The dictionary has two keys:
+    1) self.MSG_TYPE_KEY
+    2) self.CONTENT_KEY
+
+    Raises socket.timeout if a receive timeout was set and no message was received in time.
+    """
+    def receive_msg(self):
+        msg_bytes = self.__multicast_helper.receive(MulticastHelper.TELEMETRY_PORT)
+        try:
+            msg = json.loads(msg_bytes)
+        except Exception as e:
+            self.__logger.error(f"Unable to load telemetry message json: {msg_bytes}.")
+            raise e
+
+        return msg
@@ -2,6 +2,8 @@ import subprocess
 import re
 import math
 
+from piwall2.broadcaster.queuenotifier import QueueNotifier
+
 # Gets and sets alsa volume
 #
 # On the receivers, we use this to ensure their audio output is at max volume when the receiver
@@ -50,6 +52,9 @@ class VolumeController:
         mb_level = round(VolumeController.pct_to_millibels(vol_pct))
         subprocess.check_output(('amixer', 'cset', 'numid=1', '--', str(mb_level)))
 
+        # The queue process caches the volume. On the receivers, there is no queue process to notify.
+        QueueNotifier.notify(QueueNotifier.EVENT_VOLUME)
+
     # increments volume percentage by the specified increment. The increment should be a float in the range [0, 100]
     # Returns the new volume percent, which will be a float in the range [0, 100]
     def increment_vol_pct(self, inc = 1):
@@ -0,0 +1,88 @@
+import os
+import tempfile
+import unittest
+
+from piwall2.broadcaster.database import Database
+from piwall2.broadcaster.databasewriter import DatabaseWriter
+from piwall2.broadcaster.playlist import Playlist
+from piwall2.broadcaster.playlistmodel import PlaylistModel
+
+# The DB classes cache a connection per thread, so all tests in this module share one scratch DB.
+def setUpModule():
+    global tmp_dir
+    tmp_dir = tempfile.TemporaryDirectory()
+    Database.set_db_path(os.path.join(tmp_dir.name, 'piwall2.db'))
+
+    # Only the playlist's tables, because constructing the settings table requires a config file.
+    Playlist().construct()
+
+def tearDownModule():
+    tmp_dir.cleanup()
+
+"""
+PlaylistModel must order the queue the same way as Playlist's queries, including rows whose priority is NULL.
+"""
+class TestPlaylistModel(unittest.TestCase):
+
+    def setUp(self):
+        DatabaseWriter.write(lambda cursor: cursor.execute("DELETE FROM playlist_videos"))
+        self.playlist = Playlist()
+
+    def test_reenqueue_when_no_regular_video_is_queued(self):
+        playlist_video_id = self.enqueue('a', Playlist.TYPE_VIDEO)
+        self.assertTrue(self.playlist.set_current_video(playlist_video_id))
+        self.enqueue('channel', Playlist.TYPE_CHANNEL_VIDEO)
+
+        model = PlaylistModel()
+        self.assertTrue(model.reenqueue(playlist_video_id))
+
+        self.assertEqual(self.get_priority(playlist_video_id), 1)
+        self.assertEqual(self.get_urls(model.get_next_playlist_items(10)), ['channel', 'a'])
+        self.assertOrderMatchesPlaylist(model)
+
+    def test_play_next_when_no_other_regular_video_is_queued(self):
+        playlist_video_id = self.enqueue('a', Playlist.TYPE_VIDEO)
+        self.assertTrue(self.playlist.play_next(playlist_video_id))
+        self.assertEqual(self.get_priority(playlist_video_id), 1)
+
+    def test_null_priorities_are_ordered_last(self):
+        self.enqueue('null_1', Playlist.TYPE_VIDEO, priority = None)
+        self.enqueue('zero', Playlist.TYPE_VIDEO)
+        self.enqueue('channel', Playlist.TYPE_CHANNEL_VIDEO)
+        self.enqueue('null_2', Playlist.TYPE_VIDEO, priority = None)
+        self.enqueue('one', Playlist.TYPE_VIDEO, priority = 1)
+
+        model = PlaylistModel()
+        self.assertEqual(
+            self.get_urls(model.get_next_playlist_items(10)), ['channel', 'one', 'zero', 'null_1', 'null_2']
+        )
+        self.assertEqual(model.get_next_playlist_item()['url'], 'channel')
+        self.assertOrderMatchesPlaylist(model)
+
+    def assertOrderMatchesPlaylist(self, model):
+        self.assertEqual(
+            self.get_urls(model.get_next_playlist_items(10)),
+            self.get_urls(self.playlist.get_next_playlist_items(10))
+        )
+
+    # Inserts directly, so that the priority can be NULL, as it could be for rows re-enqueued before
+    # Playlist.reenqueue handled an empty queue.
+    def enqueue(self, url, video_type, priority = 0):
+        if video_type == Playlist.TYPE_CHANNEL_VIDEO:
+            return self.playlist.enqueue(url, '', url, '', '', video_type)
+        return DatabaseWriter.write(lambda cursor: cursor.execute(
+            "INSERT INTO playlist_videos (url, status, type, priority) VALUES(?, ?, ?, ?)",
+            [url, Playlist.STATUS_QUEUED, video_type, priority]
+        ).lastrowid)
+
+    def get_priority(self, playlist_video_id):
+        cursor = Database().get_cursor()
+        cursor.execute("SELECT priority FROM playlist_videos WHERE playlist_video_id = ?", [playlist_video_id])
+        return cursor.fetchone()['priority']
+
+    def get_urls(self, playlist_items):
+        return [playlist_item['url'] for playlist_item in playlist_items]
+
+
+if __name__ == '__main__':
+    unittest.main()
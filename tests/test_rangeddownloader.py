@@ -0,0 +1,162 @@
+import http.server
+import io
+import os
+import random
+import re
+import threading
+import unittest
+
+from piwall2.broadcaster.rangeddownloader import RangedDownloader
+
+"""
+A local stand-in for a media server. It honors Range headers, unless `supports_ranges` is False, in which case it
+responds with the whole file. Responses can be truncated to simulate connections that are reset mid-download: the
+connection is closed after sending part of the body that its Content-Length promises.
+"""
+class MediaRequestHandler(http.server.BaseHTTPRequestHandler):
+
+    __RANGE_REGEX = re.compile(r'^bytes=(\d+)-(\d+)$')
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requested_ranges.append(self.headers.get('Range'))
+
+        match = self.__RANGE_REGEX.match(self.headers.get('Range', ''))
+        if not server.supports_ranges or not match:
+            self.__send(200, server.content, {})
+            return
+
+        range_start = int(match.group(1))
+        range_end = min(int(match.group(2)), len(server.content) - 1)
+        self.__send(206, server.content[range_start:range_end + 1], {
+            'Content-Range': f'bytes {range_start}-{range_end}/{len(server.content)}',
+        })
+
+    def log_message(self, format, *args):
+        pass
+
+    def __send(self, status, body, headers):
+        server = self.server
+        with server.lock:
+            num_bytes_to_send = server.get_num_bytes_to_send(self.headers.get('Range'), len(body))
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'video/mp4')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body[:num_bytes_to_send])
+        self.close_connection = True
+
+
+class MediaServer(http.server.ThreadingHTTPServer):
+
+    daemon_threads = True
+
+    # truncations: dict keyed by the Range header of a request (None for requests without one), whose values are
+    #   lists of how many bytes to send in each successive response to that request before closing the connection.
+    #   Once the list is exhausted, the whole response is sent.
+    # truncation_rate: the probability that any other response is truncated at a random byte.
+    def __init__(self, content, supports_ranges = True, truncations = None, truncation_rate = 0):
+        super().__init__(('127.0.0.1', 0), MediaRequestHandler)
+        self.content = content
+        self.supports_ranges = supports_ranges
+        self.truncations = truncations or {}
+        self.truncation_rate = truncation_rate
+        self.random = random.Random(0)
+        self.requested_ranges = []
+        self.lock = threading.Lock()
+
+    def get_num_bytes_to_send(self, range_header, body_size):
+        truncations = self.truncations.get(range_header)
+        if truncations:
+            return truncations.pop(0)
+        if self.random.random() < self.truncation_rate:
+            return self.random.randrange(body_size)
+        return body_size
+
+    def get_url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}/video.mp4'
+
+
+class TestRangedDownloader(unittest.TestCase):
+
+    __CONTENT = os.urandom(1024 * 1024 + 123)
+
+    __FIRST_RANGE_SIZE_BYTES = 16 * 1024
+    __RANGE_SIZE_BYTES = 64 * 1024
+
+    __NUM_RANGES = 1 + -(-(len(__CONTENT) - __FIRST_RANGE_SIZE_BYTES) // __RANGE_SIZE_BYTES)
+
+    def test_downloads_ranges_in_order(self):
+        server = self.start_server()
+        self.assertEqual(self.download(server), self.__CONTENT)
+        self.assertEqual(len(server.requested_ranges), self.__NUM_RANGES)
+
+    def test_retries_truncated_ranges_from_the_last_byte_received(self):
+        second_range = self.get_range_header(self.__FIRST_RANGE_SIZE_BYTES, self.__RANGE_SIZE_BYTES)
+        resumed_second_range = self.get_range_header(
+            self.__FIRST_RANGE_SIZE_BYTES + 5000, self.__RANGE_SIZE_BYTES - 5000
+        )
+        server = self.start_server(truncations = {
+            self.get_range_header(0, self.__FIRST_RANGE_SIZE_BYTES): [1000],
+            second_range: [5000],
+            resumed_second_range: [0],
+        })
+        self.assertEqual(self.download(server), self.__CONTENT)
+
+        # The first range resumes from where its response ended.
+        self.assertIn(f'bytes=1000-{self.__FIRST_RANGE_SIZE_BYTES - 1}', server.requested_ranges)
+
+        # The second range is retried on its own, twice, resuming from the last byte received.
+        self.assertEqual(server.requested_ranges.count(second_range), 1)
+        self.assertEqual(server.requested_ranges.count(resumed_second_range), 2)
+
+    def test_survives_randomly_truncated_responses(self):
+        server = self.start_server(truncation_rate = 0.3)
+        self.assertEqual(self.download(server), self.__CONTENT)
+        self.assertGreater(len(server.requested_ranges), self.__NUM_RANGES)
+
+    def test_falls_back_to_a_single_connection_without_range_support(self):
+        server = self.start_server(supports_ranges = False)
+        self.assertEqual(self.download(server), self.__CONTENT)
+        self.assertEqual(len(server.requested_ranges), 1)
+
+    def test_raises_if_the_response_ends_early_without_range_support(self):
+        server = self.start_server(supports_ranges = False, truncations = {
+            self.get_range_header(0, self.__FIRST_RANGE_SIZE_BYTES): [1000],
+        })
+        with self.assertRaisesRegex(Exception, 'Response ended early at byte 1000 of'):
+            self.download(server)
+
+    def test_raises_after_too_many_attempts_at_a_range(self):
+        second_range = self.get_range_header(self.__FIRST_RANGE_SIZE_BYTES, self.__RANGE_SIZE_BYTES)
+        server = self.start_server(truncations = {second_range: [0, 0]})
+        with self.assertRaisesRegex(Exception, 'Giving up on range'):
+            self.download(server, max_attempts_per_range = 2)
+
+    def start_server(self, supports_ranges = True, truncations = None, truncation_rate = 0):
+        server = MediaServer(self.__CONTENT, supports_ranges, truncations, truncation_rate)
+        threading.Thread(target = server.serve_forever, daemon = True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server
+
+    def download(self, server, max_attempts_per_range = 10):
+        out_file = io.BytesIO()
+        num_bytes_written = RangedDownloader(
+            server.get_url(), num_connections = 4, range_size_bytes = self.__RANGE_SIZE_BYTES,
+            first_range_size_bytes = self.__FIRST_RANGE_SIZE_BYTES, max_buffered_ranges = 4,
+            max_attempts_per_range = max_attempts_per_range
+        ).download(out_file)
+        self.assertEqual(num_bytes_written, len(out_file.getvalue()))
+        return out_file.getvalue()
+
+    def get_range_header(self, range_start, range_size_bytes):
+        return f'bytes={range_start}-{range_start + range_size_bytes - 1}'
+
+
+if __name__ == '__main__':
+    unittest.main()
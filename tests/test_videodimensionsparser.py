@@ -0,0 +1,108 @@
+import unittest
+
+from piwall2.broadcaster.videodimensionsparser import VideoDimensionsParser
+
+"""
+Builds a minimal MPEG-TS stream: a PAT, a PMT with one H.264 stream, and a video packet whose elementary stream
+starts with an SPS for a 1920x1080 video. Null packets can be used as filler.
+"""
+class TsStreamBuilder:
+
+    PMT_PID = 0x1000
+    VIDEO_PID = 0x100
+    NULL_PID = 0x1FFF
+
+    __PACKET_SIZE = 188
+
+    def pat_packet(self):
+        section = bytes([
+            0x00, 0xB0, 0x0D, # table_id, section_length
+            0x00, 0x01, 0xC1, 0x00, 0x00, # transport_stream_id, version, section numbers
+            0x00, 0x01, 0xE0 | (self.PMT_PID >> 8), self.PMT_PID & 0xFF, # program 1's PMT PID
+        ]) + b'\x00' * 4 # CRC, which the parser doesn't check
+        return self.__packet(0, b'\x00' + section)
+
+    def pmt_packet(self):
+        section = bytes([
+            0x02, 0xB0, 0x12, # table_id, section_length
+            0x00, 0x01, 0xC1, 0x00, 0x00, # program_number, version, section numbers
+            0xE0 | (self.VIDEO_PID >> 8), self.VIDEO_PID & 0xFF, # PCR PID
+            0xF0, 0x00, # program_info_length
+            0x1B, 0xE0 | (self.VIDEO_PID >> 8), self.VIDEO_PID & 0xFF, 0xF0, 0x00, # H.264 stream
+        ]) + b'\x00' * 4
+        return self.__packet(self.PMT_PID, b'\x00' + section)
+
+    def video_packet(self):
+        pes_header = b'\x00\x00\x01\xE0\x00\x00\x80\x00\x00'
+        sps_nal_unit = b'\x00\x00\x01\x67' + self.__sps_1920x1080()
+        pps_start_code = b'\x00\x00\x01\x68'
+        return self.__packet(self.VIDEO_PID, pes_header + sps_nal_unit + pps_start_code)
+
+    def null_packets(self, num_packets):
+        return self.__packet(self.NULL_PID, b'', payload_unit_start_indicator = False) * num_packets
+
+    # Baseline profile, 120x68 macroblocks, cropped by 8 rows at the bottom.
+    def __sps_1920x1080(self):
+        bits = '{:08b}'.format(66) + '{:08b}'.format(0) + '{:08b}'.format(40) # profile, constraints, level
+        bits += self.__ue(0) + self.__ue(0) + self.__ue(0) + self.__ue(0) # sps id, frame num, poc type, poc lsb
+        bits += self.__ue(1) + '0' # max_num_ref_frames, gaps_in_frame_num_value_allowed_flag
+        bits += self.__ue(119) + self.__ue(67) # pic_width_in_mbs_minus1, pic_height_in_map_units_minus1
+        bits += '1' + '1' # frame_mbs_only_flag, direct_8x8_inference_flag
+        bits += '1' + self.__ue(0) + self.__ue(0) + self.__ue(0) + self.__ue(4) # frame cropping
+        bits += '0' + '1' # vui_parameters_present_flag, rbsp_stop_one_bit
+        bits += '0' * (-len(bits) % 8)
+        return int(bits, 2).to_bytes(len(bits) // 8, 'big')
+
+    # Unsigned Exp-Golomb code.
+    def __ue(self, value):
+        code = '{:b}'.format(value + 1)
+        return '0' * (len(code) - 1) + code
+
+    def __packet(self, pid, payload, payload_unit_start_indicator = True):
+        header = bytes([0x47, (0x40 if payload_unit_start_indicator else 0) | (pid >> 8), pid & 0xFF, 0x10])
+        return header + payload + b'\xFF' * (self.__PACKET_SIZE - len(header) - len(payload))
+
+
+class TestVideoDimensionsParser(unittest.TestCase):
+
+    __MAX_STREAM_BYTES = VideoDimensionsParser._VideoDimensionsParser__MAX_STREAM_BYTES
+
+    # Like VideoBroadcaster's pump chunks: 64 KB, rounded down to a whole number of packets.
+    __NUM_PACKETS_PER_CHUNK = 1024 * 64 // 188
+
+    def setUp(self):
+        self.builder = TsStreamBuilder()
+
+    def test_parses_dimensions_from_the_sps(self):
+        parser = VideoDimensionsParser()
+        stream = self.builder.pat_packet() + self.builder.pmt_packet() + self.builder.video_packet()
+        self.assertEqual(parser.feed(stream), [1920, 1080])
+        self.assertTrue(parser.is_done())
+
+    def test_parses_an_sps_in_the_chunk_that_crosses_the_cap(self):
+        parser = VideoDimensionsParser()
+        self.assertIsNone(parser.feed(self.builder.pat_packet() + self.builder.pmt_packet()))
+        num_bytes_fed = 188 * 2
+        chunk = self.builder.null_packets(self.__NUM_PACKETS_PER_CHUNK)
+        while num_bytes_fed + len(chunk) <= self.__MAX_STREAM_BYTES:
+            self.assertIsNone(parser.feed(chunk))
+            num_bytes_fed += len(chunk)
+        self.assertFalse(parser.is_done())
+
+        last_chunk = self.builder.null_packets(self.__NUM_PACKETS_PER_CHUNK - 1) + self.builder.video_packet()
+        self.assertGreater(num_bytes_fed + len(last_chunk), self.__MAX_STREAM_BYTES)
+        self.assertEqual(parser.feed(last_chunk), [1920, 1080])
+        self.assertTrue(parser.is_done())
+
+    def test_gives_up_without_a_pmt(self):
+        parser = VideoDimensionsParser()
+        chunk = self.builder.null_packets(self.__NUM_PACKETS_PER_CHUNK)
+        num_bytes_fed = 0
+        while not parser.is_done():
+            self.assertIsNone(parser.feed(chunk))
+            num_bytes_fed += len(chunk)
+        self.assertLess(num_bytes_fed, self.__MAX_STREAM_BYTES + len(chunk))
+
+
+if __name__ == '__main__':
+    unittest.main()
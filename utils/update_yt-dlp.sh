@@ -33,4 +33,7 @@ parallel --will-cite --max-procs 0 --halt never sudo -u {1} yt-dlp --rm-cache-di
 # shellcheck disable=SC1083
 parallel --will-cite --max-procs 0 --halt never sudo -u {1} yt-dlp --output - --restrict-filenames --format 'worst[ext=mp4]/worst' --newline 'https://www.youtube.com/watch?v=IB_2jkwxqh4' > /dev/null ::: root pi
 
+# The resolver service imports yt_dlp once at startup. Restart it (if it is running) so that it picks up the update.
+sudo systemctl try-restart piwall2_ytdlp_resolver.service || true
+
 echo "finished update_yt-dlp at $(date -u)"